@@ -0,0 +1,140 @@
+"""Общие помощники для нагрузочных тестов и микро-бенчмарков."""
+import json
+import math
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Перцентиль с линейной интерполяцией по отсортированному списку."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    fraction = position - lower
+    return (
+        sorted_values[lower] * (1 - fraction)
+        + sorted_values[upper] * fraction
+    )
+
+
+def summarize(samples: list) -> dict:
+    """Сводная статистика по выборке длительностей."""
+    ordered = sorted(samples)
+    count = len(ordered)
+    mean = sum(ordered) / count if count else 0.0
+    variance = (
+        sum((value - mean) ** 2 for value in ordered) / (count - 1)
+        if count > 1 else 0.0
+    )
+    return {
+        'count': count,
+        'mean': mean,
+        'stdev': math.sqrt(variance),
+        'min': ordered[0] if ordered else 0.0,
+        'max': ordered[-1] if ordered else 0.0,
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+    }
+
+
+def load_json(path: str):
+    """Читает сохранённую базовую линию или None, если файла нет."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_json(path: str, data) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as output_file:
+        json.dump(data, output_file, indent=2, sort_keys=True)
+        output_file.write('\n')
+
+
+@contextmanager
+def temporary_metrics_dirs():
+    """Метрики и статистика запросов прогона — во временном каталоге.
+
+    Иначе запросы нагрузочного теста и бенчмарков попадают в /metrics/
+    и query_stats работающего сайта.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-metrics-')
+    settings.METRICS_DIR = os.path.join(directory, 'metrics')
+    settings.QUERY_STATS_DIR = os.path.join(settings.METRICS_DIR, 'queries')
+    try:
+        yield directory
+    finally:
+        # Сброс при выходе процесса не должен создать каталог заново
+        settings.METRICS_DIR = settings.QUERY_STATS_DIR = ''
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _reset_caches() -> None:
+    for backend in caches.all():
+        backend.close()
+    caches._caches.caches = {}
+
+
+@contextmanager
+def temporary_cache():
+    """Общий кеш прогона — в отдельном файле, а не в кеше сайта.
+
+    Прогон работает со своей временной БД: id из кеша сайта ей чужие,
+    а записи прогона испортили бы кеш сайта.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-cache-')
+    shared = settings.CACHES['shared']
+    location = shared['LOCATION']
+    shared['LOCATION'] = os.path.join(directory, 'cache')
+    _reset_caches()
+    # L1 процесса мог запомнить значения из кеша сайта
+    caches['default'].clear()
+    try:
+        yield directory
+    finally:
+        _reset_caches()
+        shared['LOCATION'] = location
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# Реестр микро-бенчмарков: приложения объявляют их в модулях benchmarks.py
+BENCHMARKS = {}
+
+
+def register(name: str):
+    """Регистрирует микро-бенчмарк.
+
+    Функция выполняет подготовку и возвращает замеряемый вызов
+    без аргументов.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def welch_t(first: list, second: list) -> float:
+    """t-статистика Уэлча для разницы средних двух выборок."""
+    first_stats = summarize(first)
+    second_stats = summarize(second)
+    error = math.sqrt(
+        first_stats['stdev'] ** 2 / max(first_stats['count'], 1)
+        + second_stats['stdev'] ** 2 / max(second_stats['count'], 1)
+    )
+    difference = first_stats['mean'] - second_stats['mean']
+    if error == 0:
+        return math.copysign(math.inf, difference) if difference else 0.0
+    return difference / error
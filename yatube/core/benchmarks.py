@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.urls import reverse
+
+from core.bench import register
+from core.cache.shared import SharedMemoryCache
+from core.templatetags.user_filters import addclass
+from posts.forms import CommentForm
+from posts.models import Post
+
+
+@register('core.addclass')
+def addclass_filter():
+    field = CommentForm()['text']
+    return lambda: addclass(field, 'form-control')
+
+
+@register('core.reverse')
+def url_reverse():
+    post = Post.objects.select_related('author').first()
+
+    def run():
+        reverse('posts:index')
+        reverse('posts:profile', args=[post.author.username])
+        reverse('posts:post_detail', args=[post.pk])
+    return run
+
+
+CACHE_BACKENDS = {
+    'locmem': lambda: LocMemCache('bench', {}),
+    'filebased': lambda: FileBasedCache(tempfile.mkdtemp(), {}),
+    'shared': lambda: SharedMemoryCache(
+        os.path.join(tempfile.mkdtemp(), 'cache'), {}
+    ),
+}
+
+
+def page_of_posts() -> list:
+    return list(Post.objects.select_related('author', 'group')[:10])
+
+
+def register_cache_benchmarks(backend: str, make_cache):
+    """Чтение, запись и пакетное чтение страницы постов из кеша."""
+
+    @register(f'core.cache_get.{backend}')
+    def cache_get():
+        cache = make_cache()
+        cache.set('page', page_of_posts())
+        return lambda: cache.get('page')
+
+    @register(f'core.cache_set.{backend}')
+    def cache_set():
+        cache = make_cache()
+        posts = page_of_posts()
+        return lambda: cache.set('page', posts)
+
+    @register(f'core.cache_get_many.{backend}')
+    def cache_get_many():
+        cache = make_cache()
+        posts = page_of_posts()
+        cache.set_many({f'post:{post.pk}': post for post in posts})
+        keys = [f'post:{post.pk}' for post in posts]
+        return lambda: cache.get_many(keys)
+
+
+for backend, make_cache in CACHE_BACKENDS.items():
+    register_cache_benchmarks(backend, make_cache)
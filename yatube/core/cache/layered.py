@@ -0,0 +1,212 @@
+"""Двухуровневый кеш: L1 в памяти процесса перед общим L2.
+
+Горячие ключи, например первая страница главной, читаются из L1 без
+обращения к общему кешу. L1 ограничен L1_SIZE записями (вытесняется
+давно не читавшаяся) и хранит их не дольше L1_TIMEOUT секунд.
+
+Для сброса L1 во всех воркерах в L2 лежит поколение. delete, clear и
+invalidate записывают новое поколение, а каждый процесс сверяется с
+ним не чаще раза в GENERATION_CHECK_INTERVAL секунд и при смене
+поколения очищает свой L1. Устаревшее значение живёт в чужих воркерах
+не дольше этого интервала.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.layered.LayeredCache',
+            'LOCATION': 'layered',
+            'OPTIONS': {'L2': 'shared'},
+        },
+        'shared': {
+            'BACKEND': 'core.cache.shared.SharedMemoryCache',
+            'LOCATION': '/var/tmp/yatube-cache',
+        },
+    }
+"""
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .. import metrics
+
+GENERATION_KEY = 'core.cache.layered:generation'
+MISSING = object()
+
+# L1 общий для всех экземпляров бэкенда в процессе, как у LocMemCache
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class L1Store:
+    def __init__(self):
+        # ключ -> (истекает по monotonic, поколение, pickle значения)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked = 0.0
+
+
+class LayeredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._l1_size = options.get('L1_SIZE', 256)
+        self._l1_timeout = options.get('L1_TIMEOUT', 2)
+        self._check_interval = options.get('GENERATION_CHECK_INTERVAL', 0.5)
+        with _stores_lock:
+            self._l1 = _stores.setdefault(location, L1Store())
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _generation(self):
+        """Текущее поколение; при его смене L1 процесса очищается."""
+        store = self._l1
+        now = time.monotonic()
+        if now - store.checked >= self._check_interval:
+            generation = self.l2.get(GENERATION_KEY)
+            with store.lock:
+                if generation != store.generation:
+                    store.entries.clear()
+                    store.generation = generation
+                store.checked = now
+        return store.generation
+
+    def invalidate(self) -> None:
+        """Сбрасывает L1 во всех процессах."""
+        # Уникальное значение, а не счётчик: после вытеснения ключа из L2
+        # счётчик мог бы вернуться к поколению, которое воркер уже видел
+        self.l2.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        self._l1.checked = 0.0
+
+    def _l1_get(self, l1_key: str, generation):
+        with self._l1.lock:
+            entry = self._l1.entries.get(l1_key)
+            if entry is None:
+                return None
+            expires, entry_generation, pickled = entry
+            if expires <= time.monotonic() or entry_generation != generation:
+                del self._l1.entries[l1_key]
+                return None
+            self._l1.entries.move_to_end(l1_key)
+            return pickled
+
+    def _remember(self, l1_key: str, value, generation,
+                  timeout=DEFAULT_TIMEOUT) -> None:
+        ttl = self._l1_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            self._forget(l1_key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        entries = self._l1.entries
+        with self._l1.lock:
+            entries[l1_key] = (time.monotonic() + ttl, generation, pickled)
+            entries.move_to_end(l1_key)
+            while len(entries) > self._l1_size:
+                entries.popitem(last=False)
+
+    def _forget(self, l1_key: str) -> None:
+        with self._l1.lock:
+            self._l1.entries.pop(l1_key, None)
+
+    def get(self, key, default=None, version=None):
+        l1_key = self.make_key(key, version=version)
+        generation = self._generation()
+        pickled = self._l1_get(l1_key, generation)
+        if pickled is not None:
+            metrics.inc('cache_layer_requests_total', layer='l1', result='hit')
+            return pickle.loads(pickled)
+        value = self.l2.get(key, MISSING, version=version)
+        if value is MISSING:
+            metrics.inc(
+                'cache_layer_requests_total', layer='l2', result='miss'
+            )
+            return default
+        metrics.inc('cache_layer_requests_total', layer='l2', result='hit')
+        self._remember(l1_key, value, generation)
+        return value
+
+    def get_many(self, keys, version=None):
+        generation = self._generation()
+        found = {}
+        missing = []
+        for key in keys:
+            pickled = self._l1_get(self.make_key(key, version), generation)
+            if pickled is None:
+                missing.append(key)
+            else:
+                found[key] = pickle.loads(pickled)
+        if missing:
+            from_l2 = self.l2.get_many(missing, version=version)
+            for key, value in from_l2.items():
+                self._remember(self.make_key(key, version), value, generation)
+            found.update(from_l2)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        generation = self._generation()
+        stored = self.l2.set(key, value, timeout, version=version)
+        # Не сохранённое в L2 не держим и в L1: другие воркеры его не
+        # видят
+        if stored is not False:
+            self._remember(
+                self.make_key(key, version=version), value, generation,
+                timeout,
+            )
+        return stored
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        generation = self._generation()
+        failed = self.l2.set_many(data, timeout, version=version) or []
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(
+                    self.make_key(key, version), value, generation, timeout
+                )
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        generation = self._generation()
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._remember(
+                self.make_key(key, version=version), value, generation,
+                timeout,
+            )
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        # Счётчики не кешируются в L1: у каждого воркера своё значение
+        self._forget(self.make_key(key, version=version))
+        return self.l2.incr(key, delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def delete(self, key, version=None):
+        self.l2.delete(key, version=version)
+        self._forget(self.make_key(key, version=version))
+        self.invalidate()
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        for key in keys:
+            self._forget(self.make_key(key, version=version))
+        self.invalidate()
+
+    def clear(self):
+        self.l2.clear()
+        with self._l1.lock:
+            self._l1.entries.clear()
+        self.invalidate()
@@ -0,0 +1,360 @@
+"""Кеш в общем файле, отображённом в память.
+
+Все воркеры одного хоста открывают один и тот же файл через mmap,
+поэтому кеш у них общий: значение, положенное одним процессом, сразу
+видно остальным, а удаление работает для всех. Внешних сервисов не
+нужно.
+
+Файл поделён на классы слотов разного размера (SLOT_SIZES). Каждый
+класс — множественно-ассоциативная таблица: ключ по хешу попадает в
+один набор из WAYS слотов, при нехватке места вытесняется давно не
+читавшийся слот набора (LRU внутри набора). Общий объём ограничен
+SIZE, значения больше самого крупного слота не кешируются: такая
+запись учитывается в метрике cache_set_failures_total и в логе
+yatube.cache, а set возвращает False. Запись, которая не читается
+pickle (например, слот затёрт при падении процесса), считается
+промахом и удаляется, а случай попадает в метрику
+cache_read_failures_total и тот же лог.
+
+Доступ из разных процессов и потоков сериализуется блокировкой flock
+на файл, поэтому add и incr атомарны. Работает только на Unix.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.shared.SharedMemoryCache',
+            'LOCATION': '/var/tmp/yatube-cache',
+            'OPTIONS': {'SIZE': 64 * 1024 * 1024},
+        }
+    }
+"""
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .. import metrics
+
+logger = logging.getLogger('yatube.cache')
+
+MAGIC = b'YTCACHE1'
+FILE_HEADER = struct.Struct('<8sQI')
+# Хеш ключа (0 — пустой слот), срок, время последнего чтения,
+# длина ключа, длина значения
+SLOT_HEADER = struct.Struct('<QddII')
+SLOT_SIZES = (1024, 4096, 16384, 65536, 262144, 1048576)
+DEFAULT_SIZE = 64 * 1024 * 1024
+DEFAULT_WAYS = 8
+NEVER = math.inf
+# Результат _loads для записи, которую не удалось прочитать
+_CORRUPT = object()
+
+
+def key_hash(key: bytes) -> int:
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    # Ноль зарезервирован для пустого слота
+    return int.from_bytes(digest, 'little') | 1
+
+
+class SharedMemoryCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location or os.path.join(
+            tempfile.gettempdir(), 'yatube-cache'
+        )
+        self._ways = options.get('WAYS', DEFAULT_WAYS)
+        size = options.get('SIZE', DEFAULT_SIZE)
+        slot_sizes = options.get('SLOT_SIZES', SLOT_SIZES)
+        # Классы слотов делят объём поровну: (размер слота, наборов, начало)
+        self._classes = []
+        offset = FILE_HEADER.size
+        for slot_size in slot_sizes:
+            sets = max(1, size // len(slot_sizes) // slot_size // self._ways)
+            self._classes.append((slot_size, sets, offset))
+            offset += sets * self._ways * slot_size
+        self._file_size = offset
+        self._header = FILE_HEADER.pack(MAGIC, self._file_size, self._ways)
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._mm = None
+
+    def _open(self) -> None:
+        # После fork нужен свой дескриптор: flock общего не разделяет
+        # родителя и потомка
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, FILE_HEADER.size, 0)
+            if header != self._header:
+                # Новый файл или файл с другой разметкой
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self._file_size)
+                os.pwrite(fd, self._header, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, self._file_size)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._mm
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _sets(self, hashed: int):
+        for slot_size, sets, offset in self._classes:
+            start = offset + hashed % sets * self._ways * slot_size
+            yield slot_size, start
+
+    def _find(self, mm, hashed: int, key: bytes, now: float):
+        """Смещение слота с ключом или None; просроченный слот очищается."""
+        for slot_size, start in self._sets(hashed):
+            for position in range(start, start + self._ways * slot_size,
+                                  slot_size):
+                slot_hash, expires, _, key_length, _ = (
+                    SLOT_HEADER.unpack_from(mm, position)
+                )
+                if slot_hash != hashed:
+                    continue
+                key_start = position + SLOT_HEADER.size
+                if mm[key_start:key_start + key_length] != key:
+                    continue
+                if expires <= now:
+                    self._free(mm, position)
+                    return None
+                return position
+        return None
+
+    @staticmethod
+    def _free(mm, position: int) -> None:
+        SLOT_HEADER.pack_into(mm, position, 0, 0.0, 0.0, 0, 0)
+
+    def _read(self, mm, position: int, now: float) -> bytes:
+        slot_hash, expires, _, key_length, value_length = (
+            SLOT_HEADER.unpack_from(mm, position)
+        )
+        SLOT_HEADER.pack_into(
+            mm, position, slot_hash, expires, now, key_length, value_length
+        )
+        start = position + SLOT_HEADER.size + key_length
+        return mm[start:start + value_length]
+
+    def _loads(self, key: bytes, pickled: bytes):
+        """Значение записи или _CORRUPT, если она не читается."""
+        try:
+            return pickle.loads(pickled)
+        except Exception:
+            # Испорченные байты могут уронить pickle почти любым
+            # исключением
+            metrics.inc('cache_read_failures_total', reason='corrupt')
+            logger.warning(
+                'Запись %s не читается и удалена', key.decode(),
+                exc_info=True,
+            )
+            return _CORRUPT
+
+    def _discard(self, key: bytes, pickled: bytes) -> None:
+        """Удаляет испорченную запись, если её не успели перезаписать."""
+        hashed = key_hash(key)
+        with self._locked() as mm:
+            now = time.time()
+            position = self._find(mm, hashed, key, now)
+            if position is not None and self._read(
+                mm, position, now
+            ) == pickled:
+                self._free(mm, position)
+
+    def _victim(self, mm, start: int, slot_size: int, now: float) -> int:
+        """Пустой или просроченный слот набора, иначе давно не читавшийся."""
+        victim = start
+        oldest = NEVER
+        for position in range(start, start + self._ways * slot_size,
+                              slot_size):
+            slot_hash, expires, accessed, _, _ = (
+                SLOT_HEADER.unpack_from(mm, position)
+            )
+            if not slot_hash or expires <= now:
+                return position
+            if accessed < oldest:
+                victim, oldest = position, accessed
+        return victim
+
+    def _store(self, mm, hashed: int, key: bytes, value: bytes,
+               expires: float, now: float) -> bool:
+        existing = self._find(mm, hashed, key, now)
+        if existing is not None:
+            self._free(mm, existing)
+        needed = SLOT_HEADER.size + len(key) + len(value)
+        for slot_size, start in self._sets(hashed):
+            if needed > slot_size:
+                continue
+            position = self._victim(mm, start, slot_size, now)
+            SLOT_HEADER.pack_into(
+                mm, position, hashed, expires, now, len(key), len(value)
+            )
+            key_start = position + SLOT_HEADER.size
+            value_start = key_start + len(key)
+            mm[key_start:value_start] = key
+            mm[value_start:value_start + len(value)] = value
+            return True
+        # Значение больше самого крупного слота
+        metrics.inc('cache_set_failures_total', reason='too_large')
+        logger.warning(
+            'Значение %s (%d байт) не влезает в слот и не закешировано',
+            key.decode(), len(value),
+        )
+        return False
+
+    def _key(self, key, version) -> bytes:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key.encode()
+
+    def _expires(self, timeout) -> float:
+        expires = self.get_backend_timeout(timeout)
+        return NEVER if expires is None else expires
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        hashed = key_hash(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._locked() as mm:
+            now = time.time()
+            if self._find(mm, hashed, key, now) is not None:
+                return False
+            return self._store(
+                mm, hashed, key, pickled, self._expires(timeout), now
+            )
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        hashed = key_hash(key)
+        with self._locked() as mm:
+            now = time.time()
+            position = self._find(mm, hashed, key, now)
+            if position is None:
+                return default
+            pickled = self._read(mm, position, now)
+        value = self._loads(key, pickled)
+        if value is _CORRUPT:
+            self._discard(key, pickled)
+            return default
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._locked() as mm:
+            return self._store(
+                mm, key_hash(key), key, pickled, self._expires(timeout),
+                time.time(),
+            )
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._locked() as mm:
+            position = self._find(mm, key_hash(key), key, time.time())
+            if position is None:
+                return False
+            slot = list(SLOT_HEADER.unpack_from(mm, position))
+            slot[1] = self._expires(timeout)
+            SLOT_HEADER.pack_into(mm, position, *slot)
+            return True
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        with self._locked() as mm:
+            position = self._find(mm, key_hash(key), key, time.time())
+            if position is not None:
+                self._free(mm, position)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        with self._locked() as mm:
+            return self._find(mm, key_hash(key), key, time.time()) is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        hashed = key_hash(key)
+        with self._locked() as mm:
+            now = time.time()
+            position = self._find(mm, hashed, key, now)
+            if position is None:
+                raise ValueError(f"Key '{key.decode()}' not found")
+            expires = SLOT_HEADER.unpack_from(mm, position)[1]
+            value = self._loads(key, self._read(mm, position, now))
+            if value is _CORRUPT:
+                self._free(mm, position)
+                raise ValueError(f"Key '{key.decode()}' not found")
+            value += delta
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self._store(mm, hashed, key, pickled, expires, now)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        found = {}
+        with self._locked() as mm:
+            now = time.time()
+            for key in keys:
+                position = self._find(mm, key_hash(key), key, now)
+                if position is not None:
+                    found[key] = self._read(mm, position, now)
+        result = {}
+        for key, pickled in found.items():
+            value = self._loads(key, pickled)
+            if value is _CORRUPT:
+                self._discard(key, pickled)
+            else:
+                result[keys[key]] = value
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        pickled = [
+            (self._key(original, version), original,
+             pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            for original, value in data.items()
+        ]
+        failed = []
+        with self._locked() as mm:
+            now = time.time()
+            expires = self._expires(timeout)
+            for key, original, value in pickled:
+                if not self._store(mm, key_hash(key), key, value, expires,
+                                   now):
+                    failed.append(original)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._locked() as mm:
+            now = time.time()
+            for key in keys:
+                position = self._find(mm, key_hash(key), key, now)
+                if position is not None:
+                    self._free(mm, position)
+
+    def clear(self):
+        with self._locked() as mm:
+            for slot_size, sets, offset in self._classes:
+                end = offset + sets * self._ways * slot_size
+                for position in range(offset, end, slot_size):
+                    self._free(mm, position)
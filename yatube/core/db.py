@@ -0,0 +1,195 @@
+"""Инструментирование запросов к БД.
+
+QueryInstrumentationMiddleware оборачивает выполнение запросов:
+каждый запрос сводится к отпечатку (SQL без значений) и учитывается
+в статистике по отпечаткам. Место вызова в коде и в шаблоне ищется
+обходом стека, а это дороже самого учёта, поэтому оно берётся у доли
+QUERY_LOCATION_SAMPLE_RATE запросов и у всех медленных. Запросы
+дольше SLOW_QUERY_THRESHOLD мс пишутся в лог yatube.db.slow вместе с
+параметрами и планом EXPLAIN. Статистика каждого процесса
+сбрасывается в QUERY_STATS_DIR, команда query_stats её складывает.
+"""
+import atexit
+import functools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.template.base import Node
+
+from . import metrics
+from .middleware import get_view_name
+
+logger = logging.getLogger('yatube.db.slow')
+
+# Сколько разных мест вызова хранить для одного отпечатка
+MAX_LOCATIONS = 10
+NO_LOCATION = (None, None)
+CORE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN \((?:\?|%s)(?:, (?:\?|%s))*\)', re.I)
+_SPACE_RE = re.compile(r'\s+')
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = 0.0
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    """SQL без конкретных значений: литералы и списки IN свёрнуты."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def _is_project_file(filename: str) -> bool:
+    # Кадры core — это middleware и инструментирование, а не источник
+    return (
+        filename.startswith(settings.BASE_DIR)
+        and not filename.startswith(CORE_DIR)
+        and 'site-packages' not in filename
+    )
+
+
+def query_location() -> tuple:
+    """Строка кода проекта и строка шаблона, откуда пришёл запрос.
+
+    Код — ближайший кадр из файлов проекта, шаблон — ближайший
+    рендерящийся узел шаблона.
+    """
+    code_line = template_line = None
+    frame = sys._getframe(1)
+    while frame is not None and (code_line is None or template_line is None):
+        filename = frame.f_code.co_filename
+        if code_line is None and _is_project_file(filename):
+            code_line = '{}:{} {}'.format(
+                os.path.relpath(filename, settings.BASE_DIR),
+                frame.f_lineno, frame.f_code.co_name,
+            )
+        if template_line is None:
+            node = frame.f_locals.get('self')
+            # type(), а не isinstance: isinstance вычислил бы ленивый
+            # объект вроде request.user и выполнил бы новый запрос
+            if issubclass(type(node), Node) and getattr(node, 'origin', None):
+                template_line = '{}:{}'.format(
+                    node.origin.template_name, node.token.lineno
+                )
+        frame = frame.f_back
+    return code_line, template_line
+
+
+def explain(context: dict, sql: str, params) -> str:
+    """План запроса через отдельный курсор, в обход обёрток."""
+    db = context['connection']
+    prefix = db.ops.explain_query_prefix()
+    cursor = db.create_cursor()
+    try:
+        cursor.execute(f'{prefix} {sql}', params)
+        return '\n'.join(
+            ' '.join(str(column) for column in row)
+            for row in cursor.fetchall()
+        )
+    except Exception as error:
+        return f'EXPLAIN не выполнен: {error}'
+    finally:
+        cursor.close()
+
+
+def record(key: str, duration_ms: float, view_name: str, location: tuple,
+           slow: bool) -> None:
+    """Учитывает запрос в статистике по отпечатку.
+
+    Место вызова без выборки — NO_LOCATION, оно не учитывается.
+    """
+    code_line, template_line = location
+    where = ' | '.join(part for part in (code_line, template_line) if part)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0,
+                'views': {}, 'locations': {},
+            }
+        entry['count'] += 1
+        entry['total_ms'] += duration_ms
+        entry['max_ms'] = max(entry['max_ms'], duration_ms)
+        entry['slow'] += slow
+        entry['views'][view_name] = entry['views'].get(view_name, 0) + 1
+        locations = entry['locations']
+        if where and (where in locations or len(locations) < MAX_LOCATIONS):
+            locations[where] = locations.get(where, 0) + 1
+
+
+def flush(force: bool = False) -> None:
+    """Сбрасывает статистику процесса в QUERY_STATS_DIR."""
+    global _last_flush
+    if not settings.QUERY_STATS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    with _lock:
+        data = {key: dict(entry) for key, entry in _stats.items()}
+    metrics.write_snapshot(settings.QUERY_STATS_DIR, data)
+
+
+atexit.register(lambda: flush(force=True))
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
+
+
+class QueryInstrumenter:
+    """Обёртка execute для запросов одного HTTP-запроса."""
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            slow = duration_ms >= settings.SLOW_QUERY_THRESHOLD
+            view_name = get_view_name(self.request)
+            location = NO_LOCATION
+            if slow or random.random() < settings.QUERY_LOCATION_SAMPLE_RATE:
+                location = query_location()
+            key = fingerprint(sql)
+            record(key, duration_ms, view_name, location, slow)
+            if slow:
+                plan = ''
+                if not many and sql.lstrip()[:6].upper() == 'SELECT':
+                    plan = explain(context, sql, params)
+                logger.warning(
+                    '%.1f ms %s\nview: %s\nкод: %s\nшаблон: %s\n'
+                    'параметры: %r\nплан:\n%s',
+                    duration_ms, key, view_name, location[0],
+                    location[1], params, plan,
+                )
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with connection.execute_wrapper(QueryInstrumenter(request)):
+            response = self.get_response(request)
+        flush()
+        return response
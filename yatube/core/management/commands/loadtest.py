@@ -0,0 +1,386 @@
+"""Нагрузочный тест yatube.wsgi.application под несколькими воркерами.
+
+Пример:
+    python manage.py loadtest --workers 4 --concurrency 16 \
+        --requests 5000 --baseline benchmarks/loadtest.json
+"""
+import os
+import random
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from io import StringIO
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import requests
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from core.bench import (load_json, save_json, summarize, temporary_cache,
+                        temporary_metrics_dirs)
+from posts.models import Group, Post, User
+
+# Доля запросов каждого вида по умолчанию
+DEFAULT_MIX = (
+    'index=35,group=15,profile=15,detail=20,follow=8,'
+    'create=3,comment=3,profile_follow=1'
+)
+# CSRF-секрет клиентов: одинаковое значение в cookie и в форме
+CSRF_SECRET = 'loadtest' * 4
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет временную БД, поднимает WSGI-приложение в нескольких '
+        'процессах и замеряет пропускную способность и p50/p95/p99 '
+        'по именам URL'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help='Веса видов запросов: index=35,group=15,...'
+        )
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--port', type=int, default=0)
+        parser.add_argument(
+            '--baseline',
+            help='JSON с базовой линией для сравнения'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            help='Сохранить результаты как новую базовую линию'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Допустимое ухудшение относительно базовой линии'
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        mix = self.parse_mix(options['mix'])
+        database_dir = self.use_temporary_database()
+        try:
+            with temporary_cache(), temporary_metrics_dirs():
+                report = self.benchmark(mix, options)
+        finally:
+            connection.close()
+            shutil.rmtree(database_dir, ignore_errors=True)
+        self.print_report(report)
+        if options['save_baseline']:
+            save_json(options['save_baseline'], report)
+        baseline = load_json(options['baseline'])
+        if baseline is not None:
+            regressions = self.find_regressions(
+                report, baseline, options['tolerance']
+            )
+            if regressions:
+                raise CommandError(
+                    'Регрессия производительности:\n' + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS(
+                'Регрессий относительно базовой линии нет'
+            ))
+
+    def benchmark(self, mix, options) -> dict:
+        self.stdout.write('Заполняем базу данных...')
+        targets = self.seed(options)
+        server, pids = self.start_workers(options['workers'], options['port'])
+        base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            sessions = self.login_clients(targets, options['concurrency'])
+            self.stdout.write('Прогрев...')
+            self.run_load(
+                base_url, sessions, mix, targets, options['warmup']
+            )
+            self.stdout.write('Нагрузка...')
+            samples, elapsed = self.run_load(
+                base_url, sessions, mix, targets, options['requests']
+            )
+        finally:
+            self.stop_workers(server, pids)
+        return self.build_report(samples, elapsed)
+
+    def parse_mix(self, mix: str) -> dict:
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            if name not in self.REQUESTS:
+                raise CommandError(f'Неизвестный вид запроса: {name}')
+            weights[name] = float(weight or 1)
+        return weights
+
+    def use_temporary_database(self) -> str:
+        """Переключает default на временный файл SQLite.
+
+        Файл, а не :memory:, нужен, чтобы БД видели все воркеры.
+        """
+        if connection.vendor != 'sqlite':
+            raise CommandError('Нагрузочный тест рассчитан на SQLite')
+        database_dir = tempfile.mkdtemp()
+        path = os.path.join(database_dir, 'loadtest.sqlite3')
+        connection.close()
+        settings.DATABASES['default']['NAME'] = path
+        connection.settings_dict['NAME'] = path
+        call_command('migrate', verbosity=0)
+        return database_dir
+
+    def seed(self, options) -> dict:
+        """Заполняет БД генератором generate_data и собирает цели запросов."""
+        call_command(
+            'generate_data',
+            users=options['users'],
+            groups=max(options['users'] // 20, 1),
+            posts=options['posts'],
+            comments=options['posts'],
+            follows_per_user=10,
+            seed=options['seed'],
+            prefix='user',
+            password='loadtest',
+            stdout=StringIO(),
+        )
+        return {
+            'usernames': list(User.objects.values_list('username', flat=True)),
+            'slugs': list(Group.objects.values_list('slug', flat=True)),
+            'post_ids': list(Post.objects.values_list('id', flat=True)),
+        }
+
+    def start_workers(self, workers: int, port: int):
+        """Pre-fork сервер: воркеры принимают соединения с общего сокета."""
+        server = WSGIServer(('127.0.0.1', port), QuietHandler)
+        # Импорт здесь, чтобы приложение поднималось с уже подменённой БД
+        from yatube.wsgi import application
+        server.set_app(application)
+        connection.close()
+        pids = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, lambda *args: os._exit(0))
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        return server, pids
+
+    def stop_workers(self, server, pids):
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        server.server_close()
+
+    def login_clients(self, targets: dict, count: int) -> list:
+        """Сессии авторизованных клиентов без прохода через форму входа."""
+        sessions = []
+        for username in targets['usernames'][:count]:
+            client = Client()
+            client.force_login(User.objects.get(username=username))
+            session = requests.Session()
+            session.cookies.set(
+                settings.SESSION_COOKIE_NAME,
+                client.cookies[settings.SESSION_COOKIE_NAME].value,
+            )
+            session.cookies.set(settings.CSRF_COOKIE_NAME, CSRF_SECRET)
+            session.username = username
+            sessions.append(session)
+        return sessions
+
+    def request_index(self, rng, targets):
+        return 'GET', reverse('posts:index'), None
+
+    def request_group(self, rng, targets):
+        slug = rng.choice(targets['slugs'])
+        return 'GET', reverse('posts:group_list', args=[slug]), None
+
+    def request_profile(self, rng, targets):
+        username = rng.choice(targets['usernames'])
+        return 'GET', reverse('posts:profile', args=[username]), None
+
+    def request_detail(self, rng, targets):
+        post_id = rng.choice(targets['post_ids'])
+        return 'GET', reverse('posts:post_detail', args=[post_id]), None
+
+    def request_follow(self, rng, targets):
+        return 'GET', reverse('posts:follow_index'), None
+
+    def request_create(self, rng, targets):
+        data = {'text': 'Нагрузочный пост', 'csrfmiddlewaretoken': CSRF_SECRET}
+        return 'POST', reverse('posts:post_create'), data
+
+    def request_comment(self, rng, targets):
+        post_id = rng.choice(targets['post_ids'])
+        data = {'text': 'Нагрузочный комментарий',
+                'csrfmiddlewaretoken': CSRF_SECRET}
+        return 'POST', reverse('posts:add_comment', args=[post_id]), data
+
+    def request_profile_follow(self, rng, targets):
+        username = rng.choice(targets['usernames'])
+        return 'GET', reverse('posts:profile_follow', args=[username]), None
+
+    REQUESTS = {
+        'index': request_index,
+        'group': request_group,
+        'profile': request_profile,
+        'detail': request_detail,
+        'follow': request_follow,
+        'create': request_create,
+        'comment': request_comment,
+        'profile_follow': request_profile_follow,
+    }
+
+    def run_load(self, base_url, sessions, mix, targets, total):
+        """Клиенты в потоках выполняют total запросов по смеси mix."""
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        samples = []
+        samples_lock = threading.Lock()
+        remaining = [total]
+
+        def worker(index, session):
+            rng = random.Random(self.rng.random() + index)
+            while True:
+                with samples_lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                name = rng.choices(names, weights)[0]
+                method, path, data = self.REQUESTS[name](self, rng, targets)
+                start = time.perf_counter()
+                try:
+                    response = session.request(
+                        method, base_url + path, data=data,
+                        allow_redirects=False, timeout=30,
+                    )
+                    ok = response.status_code < 400
+                except requests.RequestException:
+                    ok = False
+                duration = time.perf_counter() - start
+                with samples_lock:
+                    samples.append((name, duration, ok))
+
+        threads = [
+            threading.Thread(target=worker, args=(index, session))
+            for index, session in enumerate(sessions)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - start
+
+    def build_report(self, samples, elapsed) -> dict:
+        by_name = {}
+        for name, duration, ok in samples:
+            stats = by_name.setdefault(name, {'durations': [], 'errors': 0})
+            stats['durations'].append(duration * 1000)
+            if not ok:
+                stats['errors'] += 1
+        views = {}
+        for name, stats in sorted(by_name.items()):
+            summary = summarize(stats['durations'])
+            views[name] = {
+                'count': summary['count'],
+                'errors': stats['errors'],
+                'throughput': (
+                    summary['count'] / elapsed if elapsed else 0.0
+                ),
+                'p50': summary['p50'],
+                'p95': summary['p95'],
+                'p99': summary['p99'],
+            }
+        all_durations = [duration * 1000 for _, duration, _ in samples]
+        summary = summarize(all_durations)
+        return {
+            'elapsed': elapsed,
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'errors': sum(view['errors'] for view in views.values()),
+            'p50': summary['p50'],
+            'p95': summary['p95'],
+            'p99': summary['p99'],
+            'views': views,
+        }
+
+    def print_report(self, report):
+        row = '{:<16} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9}'
+        self.stdout.write(row.format(
+            'view', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'
+        ))
+        for name, view in report['views'].items():
+            self.stdout.write(row.format(
+                name, view['count'], view['errors'],
+                f'{view["throughput"]:.1f}', f'{view["p50"]:.1f}',
+                f'{view["p95"]:.1f}', f'{view["p99"]:.1f}',
+            ))
+        self.stdout.write(row.format(
+            'total', sum(v['count'] for v in report['views'].values()),
+            report['errors'], f'{report["throughput"]:.1f}',
+            f'{report["p50"]:.1f}', f'{report["p95"]:.1f}',
+            f'{report["p99"]:.1f}',
+        ))
+
+    def find_regressions(self, report, baseline, tolerance) -> list:
+        regressions = []
+        if report['throughput'] < baseline['throughput'] * (1 - tolerance):
+            regressions.append(
+                'throughput: {:.1f} req/s против {:.1f}'.format(
+                    report['throughput'], baseline['throughput']
+                )
+            )
+        regressions.extend(self.compare_errors(
+            'total', report['errors'], self.total_count(report),
+            baseline['errors'], self.total_count(baseline),
+        ))
+        for name, view in report['views'].items():
+            base_view = baseline['views'].get(name)
+            if base_view is None:
+                continue
+            regressions.extend(self.compare_errors(
+                name, view['errors'], view['count'],
+                base_view['errors'], base_view['count'],
+            ))
+            for key in ('p50', 'p95', 'p99'):
+                if view[key] > base_view[key] * (1 + tolerance):
+                    regressions.append(
+                        '{} {}: {:.1f} ms против {:.1f} ms'.format(
+                            name, key, view[key], base_view[key]
+                        )
+                    )
+        return regressions
+
+    @staticmethod
+    def total_count(report) -> int:
+        return sum(view['count'] for view in report['views'].values())
+
+    @staticmethod
+    def compare_errors(name, errors, count, base_errors, base_count) -> list:
+        """Ошибки — не шум: допуска нет, растущая доля ошибок — регрессия.
+
+        Сравнивается доля, а не число: прогоны бывают разной длины.
+        """
+        rate = errors / count if count else 0.0
+        base_rate = base_errors / base_count if base_count else 0.0
+        if errors and rate > base_rate:
+            return ['{} errors: {} из {} ({:.1%}) против {} из {} '
+                    '({:.1%})'.format(name, errors, count, rate,
+                                      base_errors, base_count, base_rate)]
+        return []
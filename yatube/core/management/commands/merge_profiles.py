@@ -0,0 +1,90 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bench import summarize
+from core.profiling import parse_profile_name, read_profile
+
+
+class Command(BaseCommand):
+    help = (
+        'Объединяет профили запросов из PROFILING_DIR в один collapsed-файл '
+        'и печатает самые затратные функции'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--view', action='append', default=[],
+            help='Только профили указанного view, например posts:post_detail'
+        )
+        parser.add_argument(
+            '--min-duration', type=int, default=0,
+            help='Только запросы длиннее указанного числа мс'
+        )
+        parser.add_argument(
+            '--output',
+            help='Куда записать объединённый профиль для flamegraph.pl'
+        )
+        parser.add_argument('--top', type=int, default=20)
+
+    def handle(self, *args, **options):
+        directory = settings.PROFILING_DIR
+        if not os.path.isdir(directory):
+            raise CommandError(f'Нет каталога с профилями {directory}')
+        merged = {}
+        durations = {}
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.folded'):
+                continue
+            view_name, duration = parse_profile_name(filename)
+            if options['view'] and view_name not in options['view']:
+                continue
+            if duration < options['min_duration']:
+                continue
+            durations.setdefault(view_name, []).append(duration)
+            path = os.path.join(directory, filename)
+            for stack, count in read_profile(path).items():
+                merged[stack] = merged.get(stack, 0) + count
+        if not durations:
+            raise CommandError('Подходящих профилей не найдено')
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                for stack, count in sorted(merged.items()):
+                    output_file.write(f'{stack} {count}\n')
+        self.print_views(durations)
+        self.print_top(merged, options['top'])
+
+    def print_views(self, durations: dict):
+        row = '{:<32} {:>8} {:>10} {:>10}'
+        self.stdout.write(row.format('view', 'profiles', 'p50 ms', 'max ms'))
+        for view_name, values in sorted(durations.items()):
+            stats = summarize(values)
+            self.stdout.write(row.format(
+                view_name, stats['count'], f'{stats["p50"]:.0f}',
+                f'{stats["max"]:.0f}',
+            ))
+
+    def print_top(self, merged: dict, top: int):
+        """Собственные и включающие сэмплы по каждой функции."""
+        total = sum(merged.values())
+        if not total:
+            return
+        own = {}
+        inclusive = {}
+        for stack, count in merged.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for frame in set(frames):
+                inclusive[frame] = inclusive.get(frame, 0) + count
+        row = '{:>7} {:>7}  {}'
+        self.stdout.write('')
+        self.stdout.write(row.format('own %', 'incl %', 'function'))
+        ranked = sorted(own.items(), key=lambda item: item[1], reverse=True)
+        for frame, count in ranked[:top]:
+            self.stdout.write(row.format(
+                f'{100 * count / total:.1f}',
+                f'{100 * inclusive[frame] / total:.1f}',
+                frame,
+            ))
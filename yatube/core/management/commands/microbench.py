@@ -0,0 +1,149 @@
+"""Микро-бенчмарки горячих помощников, фрагментов шаблонов и форм.
+
+Бенчмарки объявляются в модулях benchmarks.py приложений через
+core.bench.register. Пример:
+    python manage.py microbench --save-baseline benchmarks/micro.json
+    python manage.py microbench --baseline benchmarks/micro.json
+"""
+import gc
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.module_loading import autodiscover_modules
+
+from core.bench import (BENCHMARKS, load_json, save_json, summarize,
+                        temporary_cache, temporary_metrics_dirs, welch_t)
+
+# Порог t-статистики: при десятках раундов это около p < 0.01
+SIGNIFICANT_T = 3.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает микро-бенчмарки с прогревом, сравнивает их с базовой '
+        'линией по t-критерию Уэлча и пишет результаты в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help='Подстроки имён бенчмарков, по умолчанию все'
+        )
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument(
+            '--round-time', type=float, default=0.05,
+            help='Минимальная длительность раунда, секунды'
+        )
+        parser.add_argument(
+            '--warmup-time', type=float, default=0.2,
+            help='Длительность прогрева, секунды'
+        )
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--baseline')
+        parser.add_argument('--save-baseline')
+        parser.add_argument('--output', help='Куда записать JSON')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.05,
+            help='Допустимое замедление среднего относительно базовой линии'
+        )
+
+    def handle(self, *args, **options):
+        autodiscover_modules('benchmarks')
+        names = [
+            name for name in sorted(BENCHMARKS)
+            if not options['names']
+            or any(part in name for part in options['names'])
+        ]
+        if not names:
+            raise CommandError('Нет подходящих бенчмарков')
+
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with temporary_cache(), temporary_metrics_dirs():
+                call_command(
+                    'generate_data', users=50, posts=options['posts'],
+                    comments=options['posts'], seed=42, stdout=StringIO(),
+                )
+                results = {
+                    name: self.run_benchmark(name, options)
+                    for name in names
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        baseline = load_json(options['baseline']) or {}
+        regressions = self.report(results, baseline, options['tolerance'])
+        if options['output']:
+            save_json(options['output'], results)
+        if options['save_baseline']:
+            save_json(options['save_baseline'], results)
+        if regressions:
+            raise CommandError(
+                'Замедлились: ' + ', '.join(regressions)
+            )
+
+    def run_benchmark(self, name: str, options) -> dict:
+        func = BENCHMARKS[name]()
+        loops = self.calibrate(func, options['round_time'])
+        deadline = time.perf_counter() + options['warmup_time']
+        while time.perf_counter() < deadline:
+            func()
+        samples = []
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(options['rounds']):
+                start = time.perf_counter()
+                for _ in range(loops):
+                    func()
+                samples.append((time.perf_counter() - start) / loops)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        stats = summarize(samples)
+        stats['loops'] = loops
+        stats['samples'] = samples
+        return stats
+
+    def calibrate(self, func, round_time: float) -> int:
+        """Подбирает число повторов, как timeit.Timer.autorange."""
+        loops = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            if time.perf_counter() - start >= round_time:
+                return loops
+            loops *= 2
+
+    def report(self, results: dict, baseline: dict, tolerance: float):
+        regressions = []
+        row = '{:<28} {:>12} {:>10} {:>12} {:>10}'
+        self.stdout.write(row.format(
+            'benchmark', 'mean us', 'stdev', 'median us', 'change'
+        ))
+        for name, stats in results.items():
+            change = ''
+            base = baseline.get(name)
+            if base is not None:
+                ratio = stats['mean'] / base['mean'] - 1
+                t_value = welch_t(stats['samples'], base['samples'])
+                significant = abs(t_value) >= SIGNIFICANT_T
+                change = '{:+.1%}{}'.format(ratio, '*' if significant else '')
+                if significant and ratio > tolerance:
+                    regressions.append(name)
+            self.stdout.write(row.format(
+                name,
+                '{:.2f}'.format(stats['mean'] * 1e6),
+                '{:.2f}'.format(stats['stdev'] * 1e6),
+                '{:.2f}'.format(stats['p50'] * 1e6),
+                change,
+            ))
+        if baseline:
+            self.stdout.write('* — статистически значимое изменение')
+        return regressions
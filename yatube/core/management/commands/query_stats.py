@@ -0,0 +1,72 @@
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import db
+from core.metrics import fold_dead_snapshots, read_snapshots
+
+
+def merge_stats(snapshots: list) -> dict:
+    merged = {}
+    for snapshot in snapshots:
+        for key, entry in snapshot.items():
+            total = merged.setdefault(key, {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0,
+                'views': {}, 'locations': {},
+            })
+            total['count'] += entry['count']
+            total['total_ms'] += entry['total_ms']
+            total['max_ms'] = max(total['max_ms'], entry['max_ms'])
+            total['slow'] += entry['slow']
+            for field in ('views', 'locations'):
+                for name, count in entry[field].items():
+                    total[field][name] = total[field].get(name, 0) + count
+    return merged
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает статистику запросов к БД по отпечаткам SQL, '
+        'отсортированную по суммарному времени'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Удалить накопленную статистику'
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            shutil.rmtree(settings.QUERY_STATS_DIR, ignore_errors=True)
+            db.reset()
+            return
+        db.flush(force=True)
+        fold_dead_snapshots(settings.QUERY_STATS_DIR, merge_stats)
+        merged = merge_stats(read_snapshots(settings.QUERY_STATS_DIR))
+        if not merged:
+            raise CommandError('Статистика запросов пока не собрана')
+        ranked = sorted(
+            merged.items(), key=lambda item: item[1]['total_ms'],
+            reverse=True,
+        )
+        for key, entry in ranked[:options['top']]:
+            self.stdout.write(self.style.SQL_KEYWORD(key))
+            self.stdout.write(
+                '  всего {:.1f} ms, запросов {}, среднее {:.2f} ms, '
+                'максимум {:.1f} ms, медленных {}'.format(
+                    entry['total_ms'], entry['count'],
+                    entry['total_ms'] / entry['count'], entry['max_ms'],
+                    entry['slow'],
+                )
+            )
+            # Места вызова — по выборке и медленным запросам
+            for field, title in (('views', 'view'), ('locations', 'откуда')):
+                ordered = sorted(
+                    entry[field].items(), key=lambda item: item[1],
+                    reverse=True,
+                )
+                for name, count in ordered[:3]:
+                    self.stdout.write(f'  {title}: {name} ({count})')
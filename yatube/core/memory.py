@@ -0,0 +1,90 @@
+"""Диагностика памяти на основе tracemalloc.
+
+При MEMORY_PROFILING = True каждый запрос пишет в лог пиковое и
+оставшееся после запроса потребление памяти, а также строки кода,
+на которых выделено больше всего оставшейся памяти. Режим заметно
+замедляет работу и рассчитан на однопоточный dev-сервер: tracemalloc
+видит выделения всех потоков процесса.
+"""
+import gc
+import logging
+import sys
+import tracemalloc
+from types import FunctionType, ModuleType
+
+from django.conf import settings
+
+from .middleware import get_view_name
+
+logger = logging.getLogger('yatube.memory')
+
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+# Объекты, общие для всех экземпляров: в размер экземпляра не входят
+SHARED_TYPES = (type, ModuleType, FunctionType)
+
+
+def deep_sizeof(obj) -> int:
+    """Размер объекта вместе со всем, на что он ссылается.
+
+    Классы, модули и функции считаются общими и пропускаются.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, SHARED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        stack.extend(gc.get_referents(current))
+    return size
+
+
+def format_statistics(statistics, limit: int) -> str:
+    lines = []
+    for stat in statistics[:limit]:
+        frame = stat.traceback[0]
+        lines.append('  {}:{} {:+.1f} KiB ({:+d} блоков)'.format(
+            frame.filename, frame.lineno,
+            stat.size_diff / 1024, stat.count_diff,
+        ))
+    return '\n'.join(lines)
+
+
+class MemoryProfilingMiddleware:
+    """Пиковая и оставшаяся память на запрос, по строкам кода."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.MEMORY_PROFILING:
+            return self.get_response(request)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        start_size, _ = tracemalloc.get_traced_memory()
+
+        response = self.get_response(request)
+
+        current_size, peak_size = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        retained = [
+            stat for stat in after.compare_to(before, 'lineno')
+            if stat.size_diff > 0
+        ]
+        logger.info(
+            '%s: пик %+.1f KiB, осталось %+.1f KiB\n%s',
+            get_view_name(request),
+            (peak_size - start_size) / 1024,
+            (current_size - start_size) / 1024,
+            format_statistics(retained, settings.MEMORY_PROFILING_TOP),
+        )
+        return response
@@ -0,0 +1,365 @@
+"""Реестр метрик приложения в текстовом формате Prometheus.
+
+Каждый процесс копит счётчики и гистограммы у себя в памяти и
+периодически сбрасывает снимок в отдельный файл
+METRICS_DIR/<pid>-<время старта>.json. Эндпоинт /metrics/ складывает
+снимки всех воркеров, поэтому цифры получаются общими для всех
+процессов без внешнего сервиса. Снимки завершившихся процессов
+складываются в totals.json и удаляются, так что каталог не растёт с
+перезапусками, а счётчики не убывают.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Границы корзин гистограммы задержек, в секундах
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Границы корзин гистограммы числа запросов к БД
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+METRICS_HELP = {
+    'http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса по имени URL'
+    ),
+    'http_responses_total': (
+        'counter', 'Количество ответов по коду статуса'
+    ),
+    'db_queries_per_request': (
+        'histogram', 'Количество запросов к БД за один HTTP-запрос'
+    ),
+    'db_queries_total': (
+        'counter', 'Количество запросов к БД по имени URL'
+    ),
+    'cache_requests_total': (
+        'counter',
+        'Обращения к кешам: hit, miss, а также stale, early, refresh, '
+        'wait, timeout при защите от одновременного пересчёта'
+    ),
+    'cache_set_failures_total': (
+        'counter', 'Записи, не попавшие в общий кеш, по причине'
+    ),
+    'cache_read_failures_total': (
+        'counter', 'Записи общего кеша, которые не удалось прочитать'
+    ),
+    'cache_layer_requests_total': (
+        'counter', 'Чтения двухуровневого кеша по уровню и результату'
+    ),
+    'template_renders_total': (
+        'counter', 'Количество рендерингов шаблона или тега'
+    ),
+    'template_render_seconds_total': (
+        'counter', 'Включающее и собственное время рендеринга шаблона'
+    ),
+    'trending_events_total': (
+        'counter', 'События популярности постов: view, comment'
+    ),
+    'post_views_total': (
+        'counter',
+        'Просмотры постов: counted, dropped при переполнении, '
+        'deleted для удалённых постов',
+    ),
+    'post_views_flushes_total': (
+        'counter', 'Сбросы накопленных просмотров в БД по результату'
+    ),
+    'post_views_flushed_total': (
+        'counter', 'Просмотры, сохранённые в БД'
+    ),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_last_flush = 0.0
+# (pid, имя файла снимка)
+_process_name = None
+TOTALS_FILE = 'totals.json'
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Увеличивает счётчик."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS,
+            **labels) -> None:
+    """Добавляет наблюдение в гистограмму."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                'buckets': list(buckets),
+                'counts': [0] * len(buckets),
+                'sum': 0.0,
+                'count': 0,
+            }
+        for index, bound in enumerate(histogram['buckets']):
+            if value <= bound:
+                histogram['counts'][index] += 1
+                break
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def snapshot() -> dict:
+    """Снимок метрик текущего процесса в виде, пригодном для JSON."""
+    with _lock:
+        return {
+            'counters': [
+                [name, list(labels), value]
+                for (name, labels), value in _counters.items()
+            ],
+            'histograms': [
+                [name, list(labels), dict(histogram,
+                                          counts=list(histogram['counts']))]
+                for (name, labels), histogram in _histograms.items()
+            ],
+        }
+
+
+def snapshot_name() -> str:
+    """Имя файла снимка процесса: pid и время старта.
+
+    pid завершившегося воркера ОС может выдать новому процессу; время
+    старта не даёт новому процессу перезаписать чужой снимок. После
+    fork у потомка свой pid, и имя строится заново.
+    """
+    global _process_name
+    pid = os.getpid()
+    if _process_name is None or _process_name[0] != pid:
+        _process_name = (pid, f'{pid}-{time.time_ns()}.json')
+    return _process_name[1]
+
+
+def _write_json(path: str, data) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as snapshot_file:
+        json.dump(data, snapshot_file)
+    # Замена атомарна, поэтому читатель не увидит недописанный файл
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(directory: str, data) -> None:
+    """Пишет JSON-снимок процесса в directory."""
+    os.makedirs(directory, exist_ok=True)
+    _write_json(os.path.join(directory, snapshot_name()), data)
+
+
+def _snapshot_pid(filename: str):
+    if not filename.endswith('.json') or filename == TOTALS_FILE:
+        return None
+    try:
+        return int(filename[:-len('.json')].split('-')[0])
+    except ValueError:
+        return None
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс есть, но чужой
+        return True
+    return True
+
+
+@contextmanager
+def _directory_lock(directory: str):
+    with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _load_json(path: str):
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def fold_dead_snapshots(directory: str, merge) -> None:
+    """Складывает снимки завершившихся процессов в totals.json.
+
+    merge получает список снимков и возвращает один снимок того же вида.
+    """
+    if not directory or not os.path.isdir(directory):
+        return
+    with _directory_lock(directory):
+        dead = [
+            os.path.join(directory, filename)
+            for filename in os.listdir(directory)
+            if _snapshot_pid(filename) not in (None, os.getpid())
+            and not _is_alive(_snapshot_pid(filename))
+        ]
+        if not dead:
+            return
+        totals_path = os.path.join(directory, TOTALS_FILE)
+        snapshots = [
+            data for data in map(_load_json, [totals_path] + dead)
+            if data is not None
+        ]
+        _write_json(totals_path, merge(snapshots))
+        for path in dead:
+            os.remove(path)
+
+
+def read_snapshots(directory: str) -> list:
+    """Снимки всех процессов и итог завершившихся из directory."""
+    snapshots = []
+    if not os.path.isdir(directory):
+        return snapshots
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        data = _load_json(os.path.join(directory, filename))
+        if data is not None:
+            snapshots.append(data)
+    return snapshots
+
+
+def flush(force: bool = False) -> None:
+    """Сбрасывает снимок процесса в METRICS_DIR не чаще интервала."""
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    write_snapshot(settings.METRICS_DIR, snapshot())
+
+
+atexit.register(lambda: flush(force=True))
+
+
+def _read_snapshots() -> list:
+    if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+        return [snapshot()]
+    flush(force=True)
+    fold_dead_snapshots(settings.METRICS_DIR, merge_snapshots)
+    return read_snapshots(settings.METRICS_DIR)
+
+
+def _merge(snapshots) -> dict:
+    counters = {}
+    histograms = {}
+    for data in snapshots:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = dict(
+                    histogram, counts=list(histogram['counts'])
+                )
+                continue
+            for index, count in enumerate(histogram['counts']):
+                merged['counts'][index] += count
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+    return {'counters': counters, 'histograms': histograms}
+
+
+def merge_snapshots(snapshots) -> dict:
+    """Сумма снимков в виде снимка — для totals.json."""
+    merged = _merge(snapshots)
+    return {
+        'counters': [
+            [name, [list(pair) for pair in labels], value]
+            for (name, labels), value in merged['counters'].items()
+        ],
+        'histograms': [
+            [name, [list(pair) for pair in labels], histogram]
+            for (name, labels), histogram in merged['histograms'].items()
+        ],
+    }
+
+
+def collect() -> dict:
+    """Складывает снимки всех процессов.
+
+    Итог завершившихся воркеров из totals.json тоже учитывается, чтобы
+    счётчики не убывали при перезапуске процессов.
+    """
+    return _merge(_read_snapshots())
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(
+            key, value.replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for key, value in pairs
+    )
+    return '{' + body + '}'
+
+
+def _format_number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def render_prometheus(data: dict) -> str:
+    """Текстовый формат экспозиции Prometheus 0.0.4."""
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name in described:
+            return
+        described.add(name)
+        kind, help_text = METRICS_HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in sorted(data['counters'].items()):
+        describe(name)
+        lines.append(
+            f'{name}{_format_labels(labels)} {_format_number(value)}'
+        )
+    for (name, labels), histogram in sorted(data['histograms'].items()):
+        describe(name)
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            le = _format_labels(labels, [('le', _format_number(bound))])
+            lines.append(f'{name}_bucket{le} {cumulative}')
+        inf = _format_labels(labels, [('le', '+Inf')])
+        lines.append(f'{name}_bucket{inf} {histogram["count"]}')
+        lines.append(
+            f'{name}_sum{_format_labels(labels)} {histogram["sum"]}'
+        )
+        lines.append(
+            f'{name}_count{_format_labels(labels)} {histogram["count"]}'
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def reset() -> None:
+    """Очищает метрики процесса (используется в тестах)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
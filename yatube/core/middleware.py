@@ -0,0 +1,47 @@
+import time
+
+from django.db import connection
+
+from . import metrics
+
+
+def get_view_name(request) -> str:
+    """Имя URL вида 'posts:index' или 'unresolved' для 404."""
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unresolved'
+    return resolver_match.view_name
+
+
+class MetricsMiddleware:
+    """Собирает задержку, коды ответов и число запросов к БД."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(1)
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view_name = get_view_name(request)
+        metrics.observe(
+            'http_request_duration_seconds', duration, view=view_name
+        )
+        metrics.inc('http_responses_total', status=response.status_code)
+        metrics.observe(
+            'db_queries_per_request',
+            len(queries),
+            buckets=metrics.QUERY_COUNT_BUCKETS,
+            view=view_name,
+        )
+        metrics.inc('db_queries_total', len(queries), view=view_name)
+        metrics.flush()
+        return response
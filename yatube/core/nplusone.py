@@ -0,0 +1,122 @@
+"""Поиск N+1 запросов.
+
+NPlusOneMiddleware следит за запросами, которые выполняются при
+ленивом обращении к связи: post.author, post.group, author.posts.count
+и т. п. Если за один HTTP-запрос одинаковый по отпечатку запрос от
+одной и той же связи повторился NPLUSONE_THRESHOLD раз, в лог
+yatube.db.nplusone пишется предупреждение с местом в коде и шаблоне и
+подсказкой, какого select_related/prefetch_related не хватает. При
+NPLUSONE_RAISE = True вместо предупреждения бросается NPlusOneError.
+"""
+import logging
+import sys
+
+from django.conf import settings
+from django.db import connection
+
+from .db import fingerprint, query_location
+
+logger = logging.getLogger('yatube.db.nplusone')
+
+DESCRIPTORS_FILE = 'related_descriptors.py'
+MANAGER_FILE = 'manager.py'
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def _relation_hint(frame):
+    """Подсказка для кадра ленивого обращения к связи или None."""
+    code = frame.f_code
+    owner = frame.f_locals.get('self')
+    if code.co_filename.endswith(DESCRIPTORS_FILE):
+        if code.co_name not in ('__get__', 'get_object'):
+            return None
+        field = getattr(owner, 'field', None)
+        if field is not None:
+            # post.author: ForwardManyToOneDescriptor и один-к-одному
+            return '{}.objects.select_related({!r})'.format(
+                field.model.__name__, field.name
+            )
+        related = getattr(owner, 'related', None)
+        if related is not None:
+            # Обратная сторона OneToOneField
+            return '{}.objects.select_related({!r})'.format(
+                related.model.__name__, related.get_accessor_name()
+            )
+    elif (code.co_filename.endswith(MANAGER_FILE)
+          and code.co_name == 'manager_method'):
+        instance = getattr(owner, 'instance', None)
+        if instance is None:
+            return None
+        accessor = getattr(owner, 'prefetch_cache_name', None)
+        if accessor is None:
+            # author.posts.count(): менеджер обратной связи ForeignKey
+            accessor = owner.field.remote_field.get_accessor_name()
+        return '{}.objects.prefetch_related({!r}) или annotate()'.format(
+            type(instance).__name__, accessor
+        )
+    return None
+
+
+def lazy_relation():
+    """Подсказка для ближайшего ленивого обращения к связи в стеке."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        hint = _relation_hint(frame)
+        if hint is not None:
+            return hint
+        frame = frame.f_back
+    return None
+
+
+class NPlusOneDetector:
+    """Обёртка execute, считающая запросы от ленивых обращений к связям."""
+
+    def __init__(self):
+        self.queries = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        hint = lazy_relation()
+        if hint is not None:
+            key = (fingerprint(sql), hint)
+            entry = self.queries.get(key)
+            if entry is None:
+                entry = self.queries[key] = {
+                    'count': 0, 'location': query_location(),
+                }
+            entry['count'] += 1
+        return execute(sql, params, many, context)
+
+    def problems(self, threshold: int) -> list:
+        """Описания повторившихся запросов."""
+        messages = []
+        for (key, hint), entry in self.queries.items():
+            if entry['count'] < threshold:
+                continue
+            code_line, template_line = entry['location']
+            messages.append(
+                f'N+1: {entry["count"]} одинаковых запросов\n'
+                f'запрос: {key}\nкод: {code_line}\n'
+                f'шаблон: {template_line}\nне хватает: {hint}'
+            )
+        return messages
+
+
+class NPlusOneMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.NPLUSONE_DETECTION:
+            return self.get_response(request)
+        detector = NPlusOneDetector()
+        with connection.execute_wrapper(detector):
+            response = self.get_response(request)
+        problems = detector.problems(settings.NPLUSONE_THRESHOLD)
+        if problems and settings.NPLUSONE_RAISE:
+            raise NPlusOneError('\n\n'.join(problems))
+        for message in problems:
+            logger.warning('%s %s', request.path, message)
+        return response
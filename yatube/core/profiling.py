@@ -0,0 +1,127 @@
+"""Выборочное статистическое профилирование запросов.
+
+Профилируется доля запросов PROFILING_SAMPLE_RATE, а также запросы
+сотрудников с подписанным заголовком X-Profile (значение выдаёт
+make_profile_token). Стек потока запроса снимается каждые
+PROFILING_INTERVAL секунд и сохраняется в формате collapsed stacks,
+который понимают flamegraph.pl и speedscope.
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+
+from .middleware import get_view_name
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_SALT = 'core.profiling'
+# Срок действия подписанного заголовка, секунды
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+
+def make_profile_token(user) -> str:
+    """Значение заголовка X-Profile для сотрудника."""
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(user.username)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.split(os.sep)
+    return '{}:{}'.format('/'.join(path[-2:]), code.co_name)
+
+
+class Sampler(threading.Thread):
+    """Поток, периодически снимающий стек другого потока."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                stack = ';'.join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def stop(self) -> dict:
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+def write_profile(stacks: dict, view_name: str, duration: float) -> str:
+    """Пишет профиль в PROFILING_DIR, в имени файла — view и длительность."""
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    filename = '{}__{}ms__{}_{}.folded'.format(
+        view_name.replace(':', '.'),
+        int(duration * 1000),
+        int(time.time() * 1000),
+        os.getpid(),
+    )
+    path = os.path.join(settings.PROFILING_DIR, filename)
+    with open(path, 'w') as profile_file:
+        for stack, count in sorted(stacks.items()):
+            profile_file.write(f'{stack} {count}\n')
+    return path
+
+
+def read_profile(path: str) -> dict:
+    stacks = {}
+    with open(path) as profile_file:
+        for line in profile_file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+
+def parse_profile_name(filename: str):
+    """Имя view и длительность в мс из имени файла профиля."""
+    view_name, duration, _ = filename.split('__', 2)
+    return view_name.replace('.', ':'), int(duration[:-2])
+
+
+class ProfilingMiddleware:
+    """Профилирует выборку запросов или запросы с заголовком X-Profile."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request) -> bool:
+        token = request.META.get(PROFILE_HEADER)
+        if token and request.user.is_staff:
+            try:
+                username = signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+                    token, max_age=PROFILE_TOKEN_MAX_AGE
+                )
+            except signing.BadSignature:
+                return False
+            return username == request.user.username
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        sampler = Sampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        duration = time.perf_counter() - start
+        path = write_profile(stacks, get_view_name(request), duration)
+        response['X-Profile-File'] = os.path.basename(path)
+        return response
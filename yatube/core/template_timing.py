@@ -0,0 +1,172 @@
+"""Время рендеринга шаблонов, include и пользовательских тегов.
+
+install() оборачивает Template.render (страницы и {% include %}),
+ExtendsNode.render (родительский шаблон из {% extends %}), а также
+теги и фильтры подключаемых библиотек ({% thumbnail %}, |addclass).
+Блоки дочернего шаблона выполняются внутри родителя, поэтому их время
+входит в собственное время родителя.
+
+TemplateTimingMiddleware собирает для каждого запроса число вызовов,
+включающее и собственное время по каждому шаблону и тегу, отдаёт их
+в заголовке Server-Timing и добавляет в метрики /metrics/.
+"""
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.template.base import Template
+from django.template.loader_tags import ExtendsNode
+
+from . import metrics
+
+_local = threading.local()
+
+
+class RenderTimer:
+    """Стек рендеринга одного запроса и накопленная статистика."""
+
+    def __init__(self):
+        # имя -> [вызовы, включающее время, собственное время]
+        self.stats = {}
+        # [имя, начало, время вложенных]
+        self.stack = []
+
+    def enter(self, name: str) -> None:
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self) -> None:
+        name, start, children = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        # Рекурсивный вызов уже учтён во включающем времени внешнего
+        if all(frame[0] != name for frame in self.stack):
+            entry[1] += elapsed
+        entry[2] += elapsed - children
+
+    def server_timing(self) -> str:
+        ranked = sorted(
+            self.stats.items(), key=lambda item: item[1][2], reverse=True
+        )
+        return ', '.join(
+            't{};desc="{} x{}, incl {:.1f}ms";dur={:.1f}'.format(
+                index, name, count, inclusive * 1000, exclusive * 1000
+            )
+            for index, (name, (count, inclusive, exclusive))
+            in enumerate(ranked)
+        )
+
+    def record_metrics(self) -> None:
+        for name, (count, inclusive, exclusive) in self.stats.items():
+            metrics.inc('template_renders_total', count, template=name)
+            metrics.inc(
+                'template_render_seconds_total', inclusive,
+                template=name, time='inclusive',
+            )
+            metrics.inc(
+                'template_render_seconds_total', exclusive,
+                template=name, time='exclusive',
+            )
+
+
+def timed(name: str, func, *args, **kwargs):
+    """Вызывает func, учитывая время, если идёт замер запроса."""
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        return func(*args, **kwargs)
+    timer.enter(name)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timer.exit()
+
+
+def template_label(template) -> str:
+    # Шаблон бэкенда оборачивает шаблон движка
+    template = getattr(template, 'template', template)
+    origin = getattr(template, 'origin', None)
+    return (
+        getattr(origin, 'template_name', None)
+        or getattr(template, 'name', None)
+        or '<string>'
+    )
+
+
+def _timed_tag(label: str, compile_func):
+    @functools.wraps(compile_func)
+    def compile_timed(parser, token):
+        node = compile_func(parser, token)
+        node.render = functools.partial(timed, label, node.render)
+        return node
+    compile_timed.timed = True
+    return compile_timed
+
+
+def _timed_filter(label: str, filter_func):
+    @functools.wraps(filter_func)
+    def filter_timed(*args, **kwargs):
+        return timed(label, filter_func, *args, **kwargs)
+    filter_timed.timed = True
+    return filter_timed
+
+
+def install_libraries(engine) -> None:
+    """Оборачивает теги и фильтры подключаемых через {% load %} библиотек."""
+    for library in engine.template_libraries.values():
+        for name, compile_func in library.tags.items():
+            if not getattr(compile_func, 'timed', False):
+                library.tags[name] = _timed_tag(
+                    f'{{% {name} %}}', compile_func
+                )
+        for name, filter_func in library.filters.items():
+            if not getattr(filter_func, 'timed', False):
+                library.filters[name] = _timed_filter(
+                    f'|{name}', filter_func
+                )
+
+
+def install() -> None:
+    if getattr(Template.render, 'timed', False):
+        return
+    template_render = Template.render
+    extends_render = ExtendsNode.render
+
+    def render(self, context):
+        return timed(template_label(self), template_render, self, context)
+
+    def render_extends(self, context):
+        parent = self.parent_name.resolve(context)
+        label = parent if isinstance(parent, str) else template_label(parent)
+        return timed(label, extends_render, self, context)
+
+    render.timed = True
+    Template.render = render
+    ExtendsNode.render = render_extends
+    for backend in engines.all():
+        if isinstance(backend, DjangoTemplates):
+            install_libraries(backend.engine)
+
+
+class TemplateTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.TEMPLATE_TIMING:
+            return self.get_response(request)
+        timer = _local.timer = RenderTimer()
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.timer = None
+        if timer.stats:
+            response['Server-Timing'] = ', '.join(filter(None, (
+                response.get('Server-Timing'), timer.server_timing()
+            )))
+            timer.record_metrics()
+        return response
@@ -1,6 +1,38 @@
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 from http import HTTPStatus
 
-from django.test import TestCase
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post, User
+
+from . import db, metrics
+from .cache.layered import LayeredCache
+from .cache.shared import SLOT_HEADER, SharedMemoryCache, key_hash
+from .management.commands.loadtest import Command as LoadtestCommand
+from .memory import deep_sizeof
+from .nplusone import NPlusOneError, NPlusOneMiddleware
+from .profiling import make_profile_token, write_profile
+from .template_timing import RenderTimer
+
+TEMP_METRICS_DIR = tempfile.mkdtemp()
+TEMP_PROFILING_DIR = tempfile.mkdtemp()
+TEMP_QUERY_STATS_DIR = tempfile.mkdtemp()
+METRICS_TOKEN = 'metrics-token'
+METRICS_AUTH = f'Bearer {METRICS_TOKEN}'
 
 
 class ViewTestClass(TestCase):
@@ -8,3 +40,555 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+@override_settings(METRICS_DIR=TEMP_METRICS_DIR, METRICS_TOKEN=METRICS_TOKEN)
+class MetricsTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_METRICS_DIR, ignore_errors=True)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        Post.objects.create(text='Тестовый пост', author=cls.user)
+
+    def setUp(self):
+        metrics.reset()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_metrics_endpoint(self):
+        """Эндпоинт отдаёт гистограммы задержек, коды и обращения к кешу"""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION=METRICS_AUTH
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        content = response.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{view="posts:index"} 2',
+            content
+        )
+        self.assertIn('http_responses_total{status="200"}', content)
+        self.assertIn('db_queries_total{view="posts:index"}', content)
+        self.assertIn(
+            'cache_requests_total{cache="index_posts_cache",result="hit"} 1',
+            content
+        )
+
+    def test_metrics_aggregated_across_processes(self):
+        """Снимки других воркеров складываются с текущим процессом"""
+        metrics.inc('http_responses_total', status=200)
+        other_worker = {
+            'counters': [
+                ['http_responses_total', [['status', '200']], 4],
+            ],
+            'histograms': [],
+        }
+        # Родительский процесс жив, его снимок не сворачивается в итог
+        path = os.path.join(TEMP_METRICS_DIR, f'{os.getppid()}-1.json')
+        with open(path, 'w') as snapshot_file:
+            json.dump(other_worker, snapshot_file)
+        self.addCleanup(os.remove, path)
+        collected = metrics.collect()
+        self.assertEqual(
+            collected['counters'][
+                ('http_responses_total', (('status', '200'),))
+            ],
+            5
+        )
+
+    def test_dead_process_snapshots_folded_into_totals(self):
+        """Снимки завершившихся процессов складываются в totals.json"""
+        finished = subprocess.Popen([sys.executable, '-c', ''])
+        finished.wait()
+        dead_worker = {
+            'counters': [['http_responses_total', [['status', '500']], 3]],
+            'histograms': [],
+        }
+        for start in (1, 2):
+            # Тот же pid после перезапуска пишет в другой файл
+            path = os.path.join(
+                TEMP_METRICS_DIR, f'{finished.pid}-{start}.json'
+            )
+            with open(path, 'w') as snapshot_file:
+                json.dump(dead_worker, snapshot_file)
+        key = ('http_responses_total', (('status', '500'),))
+        for _ in range(2):
+            self.assertEqual(metrics.collect()['counters'][key], 6)
+        self.addCleanup(
+            os.remove, os.path.join(TEMP_METRICS_DIR, metrics.TOTALS_FILE)
+        )
+        self.assertEqual(
+            sorted(
+                name for name in os.listdir(TEMP_METRICS_DIR)
+                if name.endswith('.json')
+            ),
+            sorted([metrics.snapshot_name(), metrics.TOTALS_FILE]),
+        )
+
+    def test_metrics_forbidden_without_token(self):
+        """Адрес клиента не даёт доступа: за прокси он у всех внутренний"""
+        for auth in ('', 'Bearer wrong-token', METRICS_TOKEN):
+            with self.subTest(auth=auth):
+                response = self.client.get(
+                    reverse('metrics'), REMOTE_ADDR='127.0.0.1',
+                    HTTP_AUTHORIZATION=auth,
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.FORBIDDEN
+                )
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_for_staff_without_token(self):
+        """Без настроенного токена метрики видят только сотрудники"""
+        response = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer '
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        self.client.force_login(
+            User.objects.create_user(username='staff', is_staff=True)
+        )
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+@override_settings(PROFILING_DIR=TEMP_PROFILING_DIR, PROFILING_INTERVAL=0.0001)
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_PROFILING_DIR, ignore_errors=True)
+
+    def test_signed_header_profiles_staff_request(self):
+        """Подписанный заголовок сотрудника включает профилирование"""
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            reverse('about:author'),
+            HTTP_X_PROFILE=make_profile_token(self.staff),
+        )
+        filename = response['X-Profile-File']
+        self.assertTrue(filename.startswith('about.author__'))
+        self.assertTrue(
+            os.path.exists(os.path.join(TEMP_PROFILING_DIR, filename))
+        )
+
+    def test_merge_profiles(self):
+        """Профили одного view складываются в общий отчёт"""
+        stacks = {'views.py:post_detail;base.py:render': 3}
+        write_profile(stacks, 'posts:post_detail', 0.2)
+        write_profile(stacks, 'posts:post_detail', 0.4)
+        merged_path = os.path.join(TEMP_PROFILING_DIR, 'merged.txt')
+        output = StringIO()
+        call_command(
+            'merge_profiles', view=['posts:post_detail'],
+            output=merged_path, stdout=output,
+        )
+        self.assertIn('posts:post_detail', output.getvalue())
+        with open(merged_path) as merged_file:
+            self.assertEqual(
+                merged_file.read(), 'views.py:post_detail;base.py:render 6\n'
+            )
+
+    def test_header_ignored_for_regular_user(self):
+        """Обычный пользователь не может включить профилирование"""
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('about:author'),
+            HTTP_X_PROFILE=make_profile_token(self.user),
+        )
+        self.assertFalse(response.has_header('X-Profile-File'))
+
+
+class MemoryProfilingTests(TestCase):
+    @override_settings(MEMORY_PROFILING=True)
+    def test_memory_report_logged_per_view(self):
+        """В режиме диагностики пик и остаток памяти пишутся в лог"""
+        with self.assertLogs('yatube.memory', level='INFO') as logs:
+            self.client.get(reverse('about:author'))
+        self.assertIn('about:author: пик', logs.output[0])
+
+    def test_deep_sizeof_counts_referenced_objects(self):
+        payload = 'x' * 1000
+        self.assertGreater(deep_sizeof([payload]), deep_sizeof([]) + 1000)
+
+
+@override_settings(
+    QUERY_STATS_DIR=TEMP_QUERY_STATS_DIR, SLOW_QUERY_THRESHOLD=0
+)
+class QueryInstrumentationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(text='Тестовый пост', author=cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_QUERY_STATS_DIR, ignore_errors=True)
+
+    def setUp(self):
+        db.reset()
+
+    def test_fingerprint(self):
+        """Значения и списки IN не влияют на отпечаток"""
+        self.assertEqual(
+            db.fingerprint(
+                "SELECT * FROM t WHERE a = 'x' AND b IN (%s, %s) LIMIT 21"
+            ),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?'
+        )
+
+    def test_slow_query_logged_with_plan_and_location(self):
+        """Медленный запрос попадает в лог с view, шаблоном и планом"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        with self.assertLogs('yatube.db.slow', level='WARNING') as logs:
+            self.client.get(url)
+        output = '\n'.join(logs.output)
+        self.assertIn('view: posts:post_detail', output)
+        self.assertIn('posts/views.py', output)
+        self.assertIn('шаблон: posts/post_detail.html', output)
+        self.assertIn('SEARCH', output)
+
+    @override_settings(SLOW_QUERY_THRESHOLD=10 ** 6,
+                       QUERY_LOCATION_SAMPLE_RATE=0)
+    def test_fast_query_location_not_sampled(self):
+        """Стек обычного запроса вне выборки не обходится"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        with patch.object(db, 'query_location') as query_location:
+            self.client.get(url)
+        query_location.assert_not_called()
+        self.assertTrue(db._stats)
+        for entry in db._stats.values():
+            self.assertEqual(entry['locations'], {})
+
+    @override_settings(SLOW_QUERY_THRESHOLD=10 ** 6,
+                       QUERY_LOCATION_SAMPLE_RATE=1)
+    def test_sampled_query_location_recorded(self):
+        self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        )
+        locations = [
+            where for entry in db._stats.values()
+            for where in entry['locations']
+        ]
+        self.assertTrue(any('posts/views.py' in where for where in locations))
+
+    def test_query_stats_command(self):
+        with self.assertLogs('yatube.db.slow', level='WARNING'):
+            self.client.get(
+                reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+            )
+        output = StringIO()
+        call_command('query_stats', stdout=output)
+        self.assertIn('view: posts:post_detail', output.getvalue())
+
+
+class NPlusOneTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for number in range(3):
+            author = User.objects.create_user(username=f'author{number}')
+            Post.objects.create(text='Тестовый пост', author=author)
+
+    @staticmethod
+    def lazy_authors_view(request):
+        names = [post.author.username for post in Post.objects.all()]
+        return HttpResponse(' '.join(names))
+
+    @staticmethod
+    def selected_authors_view(request):
+        posts = Post.objects.select_related('author')
+        return HttpResponse(' '.join(post.author.username for post in posts))
+
+    def get(self, view):
+        middleware = NPlusOneMiddleware(view)
+        return middleware(RequestFactory().get('/'))
+
+    @override_settings(NPLUSONE_RAISE=True)
+    def test_lazy_relation_raises_with_hint(self):
+        """Ленивое обращение к автору в цикле — ошибка с подсказкой"""
+        with self.assertRaisesMessage(
+            NPlusOneError, "Post.objects.select_related('author')"
+        ):
+            self.get(self.lazy_authors_view)
+
+    @override_settings(NPLUSONE_RAISE=False)
+    def test_lazy_relation_warns_in_development(self):
+        with self.assertLogs('yatube.db.nplusone', level='WARNING') as logs:
+            self.get(self.lazy_authors_view)
+        self.assertIn('N+1: 3 одинаковых запросов', logs.output[0])
+
+    @override_settings(NPLUSONE_RAISE=True)
+    def test_select_related_passes(self):
+        response = self.get(self.selected_authors_view)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+@override_settings(METRICS_DIR=TEMP_METRICS_DIR)
+class TemplateTimingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        Post.objects.create(text='Тестовый пост', author=cls.user)
+
+    def setUp(self):
+        metrics.reset()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_server_timing_header(self):
+        """Server-Timing содержит страницу, родителя и include"""
+        response = self.client.get(reverse('posts:index'))
+        header = response['Server-Timing']
+        for name in (
+            'posts/index.html x1', 'base.html x1', 'includes/header.html',
+            'includes/post.html x1', 'includes/paginator.html',
+        ):
+            with self.subTest(name=name):
+                self.assertIn(name, header)
+
+    def test_custom_filter_timed(self):
+        response = self.client.get(reverse('users:signup'))
+        self.assertIn('|addclass x', response['Server-Timing'])
+
+    @override_settings(METRICS_TOKEN=METRICS_TOKEN)
+    def test_render_time_in_metrics(self):
+        self.client.get(reverse('posts:index'))
+        content = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION=METRICS_AUTH
+        ).content.decode()
+        self.assertIn(
+            'template_renders_total{template="includes/post.html"} 1',
+            content
+        )
+        self.assertIn(
+            'template_render_seconds_total'
+            '{template="base.html",time="exclusive"}',
+            content
+        )
+
+    def test_exclusive_time_excludes_nested(self):
+        timer = RenderTimer()
+        timer.enter('outer')
+        timer.enter('inner')
+        timer.exit()
+        timer.exit()
+        count, inclusive, exclusive = timer.stats['outer']
+        self.assertEqual(count, 1)
+        self.assertAlmostEqual(
+            inclusive - exclusive, timer.stats['inner'][1]
+        )
+
+
+def increment_shared(path: str, times: int):
+    cache = SharedMemoryCache(path, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SharedMemoryCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache')
+        self.cache = SharedMemoryCache(self.path, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_values_visible_to_other_instances(self):
+        """Другой процесс с тем же файлом видит запись и удаление"""
+        other = SharedMemoryCache(self.path, {})
+        self.cache.set('key', {'posts': [1, 2, 3]})
+        self.assertEqual(other.get('key'), {'posts': [1, 2, 3]})
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_get_many_set_many(self):
+        self.cache.set_many({'a': 1, 'b': 'x' * 5000})
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 'x' * 5000}
+        )
+
+    def test_add_and_expiry(self):
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+        self.cache.set('expired', 1, timeout=-1)
+        self.assertFalse(self.cache.has_key('expired'))
+
+    def test_too_large_value_reported(self):
+        """Не влезшая в слот запись не теряется молча"""
+        metrics.reset()
+        value = 'x' * (2 * 1024 * 1024)
+        with self.assertLogs('yatube.cache', level='WARNING'):
+            self.assertFalse(self.cache.set('big', value))
+            self.assertEqual(self.cache.set_many({'big': value}), ['big'])
+        self.assertIsNone(self.cache.get('big'))
+        counters = metrics.collect()['counters']
+        self.assertEqual(counters[(
+            'cache_set_failures_total', (('reason', 'too_large'),)
+        )], 2)
+
+    def corrupt(self, name: str) -> None:
+        """Затирает байты значения, как при падении посреди записи."""
+        key = self.cache._key(name, None)
+        with self.cache._locked() as mm:
+            position = self.cache._find(mm, key_hash(key), key, time.time())
+            value = self.cache._read(mm, position, time.time())
+            start = position + SLOT_HEADER.size + len(key)
+            mm[start:start + len(value)] = b'\xff' * len(value)
+
+    def test_corrupt_entry_is_miss(self):
+        """Испорченная запись читается как промах и удаляется"""
+        metrics.reset()
+        self.cache.set_many({'broken': [1, 2, 3], 'good': 1})
+        self.corrupt('broken')
+        with self.assertLogs('yatube.cache', level='WARNING'):
+            self.assertEqual(
+                self.cache.get_many(['broken', 'good']), {'good': 1}
+            )
+        self.assertFalse(self.cache.has_key('broken'))
+        self.cache.set('broken', 0)
+        self.corrupt('broken')
+        with self.assertLogs('yatube.cache', level='WARNING'):
+            self.assertEqual(self.cache.get('broken', 'default'), 'default')
+            self.cache.set('counter', 0)
+            self.corrupt('counter')
+            with self.assertRaises(ValueError):
+                self.cache.incr('counter')
+        self.assertFalse(self.cache.has_key('counter'))
+        counters = metrics.collect()['counters']
+        self.assertEqual(counters[(
+            'cache_read_failures_total', (('reason', 'corrupt'),)
+        )], 3)
+
+    def test_least_recently_read_evicted(self):
+        """При переполнении набора вытесняется давно не читавшийся ключ"""
+        cache = SharedMemoryCache(self.path + '-small', {'OPTIONS': {
+            'SIZE': 4 * 1024, 'WAYS': 4, 'SLOT_SIZES': (1024,),
+        }})
+        for number in range(4):
+            cache.set(f'key{number}', number)
+        cache.get('key0')
+        cache.set('key4', 4)
+        self.assertEqual(cache.get('key0'), 0)
+        self.assertIsNone(cache.get('key1'))
+
+    def test_oversized_value_not_cached(self):
+        failed = self.cache.set_many({'huge': b'x' * 2 * 1024 * 1024})
+        self.assertEqual(failed, ['huge'])
+        self.assertIsNone(self.cache.get('huge'))
+
+    def test_incr_atomic_across_processes(self):
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=increment_shared, args=(self.path, 200))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 800)
+
+
+class LayeredCacheTests(TestCase):
+    def make_worker(self, name: str, **options) -> LayeredCache:
+        """L1 отдельного воркера перед общим кешем default."""
+        options = {'L2': 'default', 'GENERATION_CHECK_INTERVAL': 0, **options}
+        return LayeredCache(f'{self.id()}-{name}', {'OPTIONS': options})
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_hot_key_served_from_l1(self):
+        worker = self.make_worker('first')
+        worker.set('key', 'старое')
+        cache.set('key', 'новое')
+        self.assertEqual(worker.get('key'), 'старое')
+
+    def test_delete_invalidates_l1_in_other_workers(self):
+        """Удаление в одном воркере сбрасывает L1 остальных"""
+        first = self.make_worker('first')
+        second = self.make_worker('second')
+        first.set('key', 'старое')
+        self.assertEqual(second.get('key'), 'старое')
+        cache.set('other', 1)
+        first.delete('other')
+        cache.set('key', 'новое')
+        self.assertEqual(second.get('key'), 'новое')
+
+    def test_l1_bounded(self):
+        worker = self.make_worker('first', L1_SIZE=2)
+        worker.set_many({'a': 1, 'b': 2})
+        worker.get('a')
+        worker.set('c', 3)
+        self.assertEqual(list(worker._l1.entries), [
+            worker.make_key('a'), worker.make_key('c')
+        ])
+
+    def test_get_many_merges_levels(self):
+        worker = self.make_worker('first')
+        worker.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(worker.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+
+
+class LoadtestRegressionTests(TestCase):
+    @staticmethod
+    def make_report(count, errors, p99=10.0):
+        view = {'count': count, 'errors': errors, 'throughput': 100.0,
+                'p50': 5.0, 'p95': 8.0, 'p99': p99}
+        return {'throughput': 100.0, 'errors': errors,
+                'views': {'index': view}}
+
+    def find_regressions(self, report, baseline):
+        return LoadtestCommand().find_regressions(report, baseline, 0.2)
+
+    def test_new_errors_fail(self):
+        """Ошибки, которых не было в базовой линии, — регрессия"""
+        regressions = self.find_regressions(
+            self.make_report(1000, 3), self.make_report(1000, 0)
+        )
+        self.assertEqual(len(regressions), 2)
+
+    def test_error_rate_compared_not_count(self):
+        """Длинный прогон с той же долей ошибок регрессией не считается"""
+        self.assertEqual(self.find_regressions(
+            self.make_report(2000, 2), self.make_report(1000, 1)
+        ), [])
+
+    def test_p99_compared(self):
+        regressions = self.find_regressions(
+            self.make_report(1000, 0, p99=50.0), self.make_report(1000, 0)
+        )
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('p99', regressions[0])
+
+    def test_report_without_elapsed_time(self):
+        """Отчёт строится и при нулевой длительности прогона"""
+        report = LoadtestCommand().build_report([('index', 0.01, True)], 0)
+        self.assertEqual(report['throughput'], 0.0)
+        self.assertEqual(report['views']['index']['throughput'], 0.0)
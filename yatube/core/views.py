@@ -1,5 +1,12 @@
+import hmac
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from . import metrics
+
 
 def page_not_found(request, exception):
     # Переменная exception содержит отладочную информацию,
@@ -17,3 +24,25 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def has_metrics_token(request) -> bool:
+    token = settings.METRICS_TOKEN
+    if not token:
+        return False
+    scheme, _, value = request.META.get('HTTP_AUTHORIZATION', '').partition(
+        ' '
+    )
+    return scheme == 'Bearer' and hmac.compare_digest(
+        value.encode(), token.encode()
+    )
+
+
+def metrics_view(request):
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    if not (has_metrics_token(request) or request.user.is_staff):
+        raise PermissionDenied
+    return HttpResponse(
+        metrics.render_prometheus(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
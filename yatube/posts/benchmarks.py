@@ -0,0 +1,142 @@
+import pickle
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from core.bench import register
+
+from .follows import is_following
+from .forms import CommentForm, PostForm
+from .hll import HyperLogLog
+from .models import Follow, Group, Post
+from .records import decode_posts, encode_posts
+from .utils import (NUMBER_OF_POSTS, hydrate_posts, pagination,
+                    posts_cacher)
+
+
+@register('posts.pagination')
+def pagination_page():
+    request = RequestFactory().get('/', {'page': 2})
+    posts_list = Post.objects.select_related('group', 'author')
+
+    def run():
+        list(pagination(request, posts_list))
+    return run
+
+
+@register('posts.posts_cacher_hit')
+def posts_cacher_hit():
+    posts_list = Post.objects.select_related('group', 'author')
+    cache.delete('bench_posts_cache')
+    posts_cacher(posts_list, 'bench_posts_cache', 600)
+    return lambda: posts_cacher(posts_list, 'bench_posts_cache', 600)
+
+
+@register('posts.hydrate_page')
+def hydrate_page():
+    post_ids = list(
+        Post.objects.values_list('id', flat=True)[:NUMBER_OF_POSTS]
+    )
+    hydrate_posts(post_ids)
+    return lambda: hydrate_posts(post_ids)
+
+
+@register('posts.is_following')
+def is_following_hit():
+    follow = Follow.objects.first()
+    if follow is None:
+        return lambda: is_following(0, 0)
+    is_following(follow.user_id, follow.author_id)
+    return lambda: is_following(follow.user_id, follow.author_id)
+
+
+@register('posts.render_post')
+def render_post():
+    post = Post.objects.select_related('group', 'author').first()
+    return lambda: render_to_string('includes/post.html', {'post': post})
+
+
+@register('posts.render_paginator')
+def render_paginator():
+    paginator = Paginator(
+        Post.objects.values_list('id', flat=True), NUMBER_OF_POSTS
+    )
+    page_obj = paginator.get_page(2)
+    return lambda: render_to_string(
+        'includes/paginator.html', {'page_obj': page_obj}
+    )
+
+
+@register('posts.post_form')
+def post_form_validation():
+    data = {
+        'text': 'Текст поста для проверки формы',
+        'group': Group.objects.values_list('id', flat=True).first(),
+    }
+    return lambda: PostForm(data).is_valid()
+
+
+@register('posts.comment_form')
+def comment_form_validation():
+    data = {'text': 'Текст комментария'}
+    return lambda: CommentForm(data).is_valid()
+
+
+# Сто постов ленты: компактные записи против pickle моделей
+FEED_SAMPLE = 100
+
+
+def feed_sample() -> list:
+    return list(Post.objects.select_related('author', 'group')[:FEED_SAMPLE])
+
+
+@register('posts.feed_encode')
+def feed_encode():
+    posts = feed_sample()
+    return lambda: encode_posts(posts)
+
+
+@register('posts.feed_decode')
+def feed_decode():
+    data = encode_posts(feed_sample())
+    return lambda: decode_posts(data)
+
+
+@register('posts.feed_pickle_dumps')
+def feed_pickle_dumps():
+    posts = feed_sample()
+    return lambda: pickle.dumps(posts, pickle.HIGHEST_PROTOCOL)
+
+
+@register('posts.feed_pickle_loads')
+def feed_pickle_loads():
+    data = pickle.dumps(feed_sample(), pickle.HIGHEST_PROTOCOL)
+    return lambda: pickle.loads(data)
+
+
+def filled_sketch(size: int, offset: int = 0) -> HyperLogLog:
+    sketch = HyperLogLog()
+    for value in range(offset, offset + size):
+        sketch.add(f'user:{value}')
+    return sketch
+
+
+@register('posts.hll_add')
+def hll_add():
+    sketch = HyperLogLog()
+    return lambda: sketch.add('user:42')
+
+
+@register('posts.hll_count')
+def hll_count():
+    sketch = filled_sketch(10000)
+    return sketch.count
+
+
+@register('posts.hll_merge')
+def hll_merge():
+    first = filled_sketch(10000)
+    second = filled_sketch(10000, offset=5000)
+    return lambda: HyperLogLog(first.to_bytes()).merge(second)
@@ -0,0 +1,453 @@
+"""Граф подписок в кеше.
+
+Для каждого пользователя в кеше лежит отсортированный массив id
+авторов, на которых он подписан (4 байта на подписку), поэтому
+«подписан ли A на B» и «на кого подписан A» отвечаются без SQL:
+бинарным поиском и чтением массива.
+
+Массив загружается из БД при первом обращении, а дальше подписки и
+отписки правят его на месте после фиксации транзакции. Загрузка и
+правка идут под блокировкой cache.add на ключ пользователя и читают
+мимо L1 процесса, поэтому две одновременные подписки (две вкладки,
+два воркера) не затирают друг друга. Не дождавшись блокировки,
+правка удаляет набор, и он перечитывается из БД. Состояние
+подписки при этом берётся из БД, а не из графа: follow и unfollow
+всегда выполняют свой INSERT или DELETE, и если по rowcount подписка
+уже была (или её уже не было), отставший граф чинится.
+
+Запись подписок идёт одним INSERT, пропускающим конфликт с
+unique_follows, поэтому двойной клик не падает и не делает лишнего
+SELECT. Для импорта графов с других площадок есть bulk_follow и
+bulk_unfollow, пишущие пачками. Счётчики FollowStats ведутся здесь же.
+
+Списки подписчиков и подписок листаются курсором по id подписки,
+а не OFFSET: страница читается из индекса (автор, id, подписчик) или
+(подписчик, id, автор) за одно и то же время на любой глубине.
+"""
+import bisect
+import time
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from .models import Follow, FollowStats, FollowSuggestion, User
+from .utils import acquire_lock, follow_feed_key, release_lock
+
+FOLLOW_GRAPH_SEC = 60 * 60
+# Строк подписок на один запрос при массовых операциях: у SQLite
+# не больше 999 параметров в запросе
+BULK_BATCH_SIZE = 400
+FOLLOW_PAGE_SIZE = 50
+# Ожидание блокировки набора: правка короткая, ждать долго незачем
+GRAPH_LOCK_WAIT_SEC = 0.2
+GRAPH_LOCK_POLL_SEC = 0.005
+TYPECODE = 'I'
+
+
+def following_key(user_id: int) -> str:
+    # Ключ сменился вместе с форматом: записи старого вида (массив и
+    # фильтр Блума) не должны читаться как массив
+    return f'following_ids:{user_id}'
+
+
+class FollowSet:
+    """Отсортированные id авторов."""
+
+    __slots__ = ('ids',)
+
+    def __init__(self, ids: array):
+        self.ids = ids
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'FollowSet':
+        ids = array(TYPECODE)
+        ids.frombytes(data)
+        return cls(ids)
+
+    def to_bytes(self) -> bytes:
+        return self.ids.tobytes()
+
+    def __contains__(self, author_id: int) -> bool:
+        index = bisect.bisect_left(self.ids, author_id)
+        return index < len(self.ids) and self.ids[index] == author_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, author_id: int) -> bool:
+        index = bisect.bisect_left(self.ids, author_id)
+        if index < len(self.ids) and self.ids[index] == author_id:
+            return False
+        self.ids.insert(index, author_id)
+        return True
+
+    def remove(self, author_id: int) -> bool:
+        index = bisect.bisect_left(self.ids, author_id)
+        if index == len(self.ids) or self.ids[index] != author_id:
+            return False
+        del self.ids[index]
+        return True
+
+
+@contextmanager
+def _graph_locked(user_id: int):
+    """Блокировка набора пользователя; отдаёт False, если не дождались."""
+    key = following_key(user_id)
+    deadline = time.monotonic() + GRAPH_LOCK_WAIT_SEC
+    acquired = acquire_lock(key)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(GRAPH_LOCK_POLL_SEC)
+        acquired = acquire_lock(key)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            release_lock(key)
+
+
+def _shared():
+    # Под блокировкой читаем мимо L1: в нём может лежать набор, который
+    # другой воркер уже переписал
+    return getattr(cache, 'l2', cache)
+
+
+def load_following(user_id: int) -> FollowSet:
+    with _graph_locked(user_id) as acquired:
+        # Под блокировкой: правка, пришедшая во время чтения из БД,
+        # дождётся записи и применится к ней
+        ids = array(TYPECODE, Follow.objects.filter(
+            user_id=user_id
+        ).order_by('author_id').values_list('author_id', flat=True))
+        follow_set = FollowSet(ids)
+        if acquired:
+            cache.set(
+                following_key(user_id), follow_set.to_bytes(),
+                FOLLOW_GRAPH_SEC,
+            )
+    return follow_set
+
+
+def get_following(user_id: int) -> FollowSet:
+    """Набор подписок пользователя; при промахе один запрос к БД."""
+    data = cache.get(following_key(user_id))
+    if data is None:
+        return load_following(user_id)
+    return FollowSet.from_bytes(data)
+
+
+def following_ids(user_id: int) -> list:
+    """На кого подписан пользователь, по возрастанию id."""
+    return get_following(user_id).ids.tolist()
+
+
+def is_following(user_id: int, author_id: int) -> bool:
+    return author_id in get_following(user_id)
+
+
+def _update(user_id: int, author_id: int, add: bool) -> bool:
+    """Правит набор в кеше; True, если он был и изменился."""
+    key = following_key(user_id)
+    with _graph_locked(user_id) as acquired:
+        if not acquired:
+            # Пусть следующее чтение загрузит набор из БД
+            cache.delete(key)
+            return True
+        data = _shared().get(key)
+        if data is None:
+            # Не загружен — загрузится из БД при следующем чтении
+            return False
+        follow_set = FollowSet.from_bytes(data)
+        changed = (
+            follow_set.add(author_id) if add
+            else follow_set.remove(author_id)
+        )
+        if changed:
+            cache.set(key, follow_set.to_bytes(), FOLLOW_GRAPH_SEC)
+    return changed
+
+
+def add_following(user_id: int, author_id: int) -> None:
+    _update(user_id, author_id, add=True)
+
+
+def remove_following(user_id: int, author_id: int) -> None:
+    _update(user_id, author_id, add=False)
+
+
+def _batches(items: list, size: int = BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _change_counters(field: str, counts: Counter, sign: int) -> None:
+    by_delta = defaultdict(list)
+    for user_id, count in counts.items():
+        by_delta[sign * count].append(user_id)
+    for delta, user_ids in by_delta.items():
+        for batch in _batches(user_ids):
+            # Greatest: разошедшийся счётчик не уйдёт ниже нуля
+            FollowStats.objects.filter(user_id__in=batch).update(
+                **{field: Greatest(F(field) + delta, 0)}
+            )
+
+
+def _mark_suggestions_stale(user_ids: list, create: bool) -> None:
+    """Рекомендации пользователей и их подписчиков надо пересчитать."""
+    for batch in _batches(user_ids):
+        if create:
+            # Без строки --stale пользователя не увидит, а у нового
+            # пользователя её ещё нет. Строка нужна только самому
+            # подписавшемуся: подписчики автора уже подписаны, строки у
+            # них есть. При отписке не создаём: строка сослалась бы на
+            # удаляемого каскадом пользователя
+            FollowSuggestion.objects.bulk_create(
+                [FollowSuggestion(user_id=user_id, stale=True)
+                 for user_id in batch],
+                ignore_conflicts=True,
+            )
+        # Подписчики — подзапросом: у автора их может быть миллион
+        FollowSuggestion.objects.filter(
+            Q(user_id__in=batch)
+            | Q(user_id__in=Follow.objects.filter(
+                author_id__in=batch
+            ).values('user_id'))
+        ).update(stale=True)
+
+
+def follows_changed(pairs: list, added: bool) -> None:
+    """Счётчики, граф и ленты после записи пар (подписчик, автор)."""
+    if not pairs:
+        return
+    if added:
+        # У пользователя без подписок строки счётчиков ещё нет. При
+        # отписке строка уже есть, а её создание могло бы сослаться на
+        # удаляемого каскадом пользователя
+        user_ids = {user_id for pair in pairs for user_id in pair}
+        FollowStats.objects.bulk_create(
+            [FollowStats(user_id=user_id) for user_id in user_ids],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True,
+        )
+    sign = 1 if added else -1
+    _change_counters(
+        'followers', Counter(author_id for _, author_id in pairs), sign
+    )
+    _change_counters(
+        'following', Counter(user_id for user_id, _ in pairs), sign
+    )
+    followers = {user_id for user_id, _ in pairs}
+    _mark_suggestions_stale(sorted(followers), create=added)
+    # Кеш правится после фиксации: при откате он не должен видеть
+    # подписок, которых нет в БД
+    transaction.on_commit(partial(_follows_cached, pairs, added))
+
+
+def _follows_cached(pairs: list, added: bool) -> None:
+    followers = {user_id for user_id, _ in pairs}
+    if len(pairs) == 1:
+        _update(*pairs[0], add=added)
+        keys = []
+    else:
+        keys = [following_key(user_id) for user_id in followers]
+    keys.extend(follow_feed_key(user_id) for user_id in followers)
+    cache.delete_many(keys)
+
+
+def _repair(user_id: int, author_id: int, following: bool) -> None:
+    """БД не изменилась, но граф в кеше мог отстать от неё."""
+    if _update(user_id, author_id, add=following):
+        cache.delete(follow_feed_key(user_id))
+
+
+def _follow_columns():
+    quote = connection.ops.quote_name
+    return (
+        quote(Follow._meta.db_table),
+        quote(Follow._meta.get_field('user').column),
+        quote(Follow._meta.get_field('author').column),
+    )
+
+
+def follow(user_id: int, author_id: int) -> bool:
+    """Подписывает; True, если подписки раньше не было."""
+    if user_id == author_id:
+        return False
+    table, user_column, author_column = _follow_columns()
+    sql = '{} {} ({}, {}) VALUES (%s, %s) {}'.format(
+        connection.ops.insert_statement(ignore_conflicts=True),
+        table, user_column, author_column,
+        connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id, author_id])
+            created = cursor.rowcount == 1
+        if created:
+            follows_changed([(user_id, author_id)], added=True)
+        else:
+            transaction.on_commit(partial(_repair, user_id, author_id, True))
+    return created
+
+
+def unfollow(user_id: int, author_id: int) -> bool:
+    """Отписывает; True, если подписка была."""
+    if user_id == author_id:
+        return False
+    table, user_column, author_column = _follow_columns()
+    sql = (
+        f'DELETE FROM {table} '
+        f'WHERE {user_column} = %s AND {author_column} = %s'
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id, author_id])
+            deleted = cursor.rowcount == 1
+        if deleted:
+            follows_changed([(user_id, author_id)], added=False)
+        else:
+            transaction.on_commit(
+                partial(_repair, user_id, author_id, False)
+            )
+    return deleted
+
+
+def _clean_pairs(pairs) -> list:
+    return sorted({
+        (int(user_id), int(author_id)) for user_id, author_id in pairs
+        if user_id != author_id
+    })
+
+
+def _existing_pairs(batch: list) -> dict:
+    """Уже существующие подписки из пачки: пара -> id строки."""
+    condition = Q()
+    for user_id, author_id in batch:
+        condition |= Q(user_id=user_id, author_id=author_id)
+    return {
+        (user_id, author_id): follow_id
+        for follow_id, user_id, author_id in Follow.objects.filter(
+            condition
+        ).values_list('id', 'user_id', 'author_id')
+    }
+
+
+def bulk_follow(pairs) -> int:
+    """Массовая подписка по парам (подписчик, автор).
+
+    Пары с неизвестными пользователями и подписки на себя пропускаются,
+    уже существующие не дублируются. Возвращает число новых подписок.
+    """
+    created = 0
+    for batch in _batches(_clean_pairs(pairs), BULK_BATCH_SIZE // 2):
+        user_ids = {user_id for pair in batch for user_id in pair}
+        known = set(
+            User.objects.filter(id__in=user_ids).values_list('id', flat=True)
+        )
+        batch = [
+            pair for pair in batch
+            if pair[0] in known and pair[1] in known
+        ]
+        if not batch:
+            continue
+        with transaction.atomic():
+            existing = _existing_pairs(batch)
+            new_pairs = [pair for pair in batch if pair not in existing]
+            Follow.objects.bulk_create(
+                [Follow(user_id=user_id, author_id=author_id)
+                 for user_id, author_id in new_pairs],
+                ignore_conflicts=True,
+            )
+            follows_changed(new_pairs, added=True)
+        created += len(new_pairs)
+    return created
+
+
+def bulk_unfollow(pairs) -> int:
+    """Массовая отписка; возвращает число удалённых подписок."""
+    deleted = 0
+    for batch in _batches(_clean_pairs(pairs), BULK_BATCH_SIZE // 2):
+        with transaction.atomic():
+            existing = _existing_pairs(batch)
+            if not existing:
+                continue
+            table = _follow_columns()[0]
+            placeholders = ', '.join(['%s'] * len(existing))
+            # Без сигналов на каждую строку: счётчики и кеш правятся
+            # одной пачкой
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE id IN ({placeholders})',
+                    list(existing.values()),
+                )
+            follows_changed(sorted(existing), added=False)
+        deleted += len(existing)
+    return deleted
+
+
+def follow_stats(user_id: int) -> tuple:
+    """(подписчиков, подписок) пользователя."""
+    return FollowStats.objects.filter(user_id=user_id).values_list(
+        'followers', 'following'
+    ).first() or (0, 0)
+
+
+def rebuild_follow_stats() -> int:
+    """Пересчитывает все счётчики по таблице подписок.
+
+    Нужен после записи подписок в обход posts.follows, например
+    генератором данных. Возвращает число строк счётчиков.
+    """
+    stats = {}
+    for field, column in (('author', 'followers'), ('user', 'following')):
+        for row in Follow.objects.values(field).annotate(total=Count('id')):
+            stats.setdefault(row[field], {})[column] = row['total']
+    with transaction.atomic():
+        FollowStats.objects.all().delete()
+        FollowStats.objects.bulk_create(
+            [FollowStats(user_id=user_id, **counts)
+             for user_id, counts in stats.items()],
+            batch_size=BULK_BATCH_SIZE,
+        )
+    return len(stats)
+
+
+def parse_cursor(value) -> int:
+    """Курсор из GET-параметра; мусор означает первую страницу."""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def _follow_page(filters: dict, other: str, cursor: int = None,
+                 limit: int = FOLLOW_PAGE_SIZE) -> tuple:
+    follows = Follow.objects.filter(**filters)
+    if cursor is not None:
+        follows = follows.filter(id__lt=cursor)
+    rows = list(
+        follows.order_by('-id').values_list('id', other)[:limit + 1]
+    )
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    user_ids = [user_id for _, user_id in rows[:limit]]
+    users = User.objects.only(
+        'id', 'username', 'first_name', 'last_name'
+    ).in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids], next_cursor
+
+
+def followers_page(author_id: int, cursor: int = None,
+                   limit: int = FOLLOW_PAGE_SIZE) -> tuple:
+    """Подписчики автора, новые первыми, и курсор следующей страницы."""
+    return _follow_page({'author_id': author_id}, 'user_id', cursor, limit)
+
+
+def following_page(user_id: int, cursor: int = None,
+                   limit: int = FOLLOW_PAGE_SIZE) -> tuple:
+    """Авторы, на которых подписан пользователь, и курсор дальше."""
+    return _follow_page({'user_id': user_id}, 'author_id', cursor, limit)
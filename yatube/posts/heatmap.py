@@ -0,0 +1,109 @@
+"""Тепловая карта публикаций автора за год, как на GitHub.
+
+В кеше у автора лежит пара (последний день, bytes): HEATMAP_DAYS
+байт — число постов за каждый день, насыщающееся на 255. Это 371
+байт на автора, а показ профиля — одно чтение кеша. Создание и
+удаление поста меняют байт своего дня; когда наступает новый день,
+массив сдвигается при чтении без обращения к БД.
+
+При промахе массив строится из дневных сводок DailyAuthorActivity
+(posts.rollups) одним запросом не больше чем на HEATMAP_DAYS строк.
+Правки без блокировок: гонка двух воркеров может потерять пост, но
+срок хранения HEATMAP_CACHE_SEC ограничивает расхождение.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import DailyAuthorActivity
+from .rollups import activity_day
+
+# 53 недели — год с небольшим, как на GitHub
+HEATMAP_DAYS = 53 * 7
+HEATMAP_CACHE_SEC = 24 * 60 * 60
+MAX_DAY_COUNT = 255
+# Границы уровней цвета: 0, 1, 2–3, 4–6, 7+ постов
+LEVELS = (1, 2, 4, 7)
+
+
+def heatmap_key(author_id: int) -> str:
+    return f'heatmap:{author_id}'
+
+
+def _today() -> datetime.date:
+    return activity_day(timezone.now())
+
+
+def _shift(end: datetime.date, counts: bytes,
+           today: datetime.date) -> bytes:
+    """Сдвигает массив, заканчивающийся днём end, к дню today."""
+    gap = (today - end).days
+    if gap <= 0:
+        return counts
+    return (counts + bytes(min(gap, HEATMAP_DAYS)))[-HEATMAP_DAYS:]
+
+
+def _load(author_id: int, today: datetime.date) -> bytearray:
+    start = today - datetime.timedelta(days=HEATMAP_DAYS - 1)
+    counts = bytearray(HEATMAP_DAYS)
+    for day, posts in DailyAuthorActivity.objects.filter(
+        author_id=author_id, day__gte=start, day__lte=today, posts__gt=0
+    ).values_list('day', 'posts'):
+        counts[(day - start).days] = min(posts, MAX_DAY_COUNT)
+    return counts
+
+
+def daily_counts(author_id: int) -> bytes:
+    """Постов по дням за HEATMAP_DAYS дней, последний — сегодня."""
+    today = _today()
+    cached = cache.get(heatmap_key(author_id))
+    if cached is not None:
+        end, counts = cached
+        return _shift(end, counts, today)
+    counts = bytes(_load(author_id, today))
+    cache.set(heatmap_key(author_id), (today, counts), HEATMAP_CACHE_SEC)
+    return counts
+
+
+def post_changed(post, sign: int = 1) -> None:
+    """Правит день поста в кешированном массиве автора, если он есть."""
+    key = heatmap_key(post.author_id)
+    cached = cache.get(key)
+    if cached is None:
+        # Следующий показ построит массив из сводок, уже с этим постом
+        return
+    today = max(cached[0], _today())
+    counts = bytearray(_shift(*cached, today))
+    index = HEATMAP_DAYS - 1 - (today - activity_day(post.pub_date)).days
+    if 0 <= index < HEATMAP_DAYS:
+        counts[index] = max(0, min(counts[index] + sign, MAX_DAY_COUNT))
+        cache.set(key, (today, bytes(counts)), HEATMAP_CACHE_SEC)
+
+
+def level(count: int) -> int:
+    return sum(count >= bound for bound in LEVELS)
+
+
+def heatmap_weeks(counts: bytes, today: datetime.date = None) -> list:
+    """Столбцы-недели с понедельника: [(день, постов, уровень) | None].
+
+    Дни до начала периода и после сегодняшнего — None.
+    """
+    today = today or _today()
+    start = today - datetime.timedelta(days=HEATMAP_DAYS - 1)
+    # Первая неделя начинается с понедельника не позже start
+    first = start - datetime.timedelta(days=start.weekday())
+    weeks = []
+    day = first
+    while day <= today:
+        week = []
+        for _ in range(7):
+            if start <= day <= today:
+                count = counts[(day - start).days]
+                week.append((day, count, level(count)))
+            else:
+                week.append(None)
+            day += datetime.timedelta(days=1)
+        weeks.append(week)
+    return weeks
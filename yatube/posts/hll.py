@@ -0,0 +1,82 @@
+"""HyperLogLog: оценка числа уникальных значений в фиксированном объёме.
+
+Скетч — REGISTERS байтовых регистров (2 КБ при PRECISION = 11),
+стандартная ошибка около 1.04 / sqrt(REGISTERS), то есть 2.3%,
+независимо от того, сколько значений в него добавлено. Скетчи
+объединяются поразрядным максимумом, поэтому сумма по автору или
+группе получается слиянием скетчей постов без повторного подсчёта.
+"""
+import hashlib
+import math
+
+PRECISION = 11
+REGISTERS = 1 << PRECISION
+# Ранг считается по оставшимся 64 - PRECISION битам хеша
+MAX_RANK = 64 - PRECISION + 1
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def hash_value(value) -> int:
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def register_update(value) -> tuple:
+    """(номер регистра, ранг) для значения."""
+    hashed = hash_value(value)
+    index = hashed >> (64 - PRECISION)
+    rest = (hashed << PRECISION) & 0xFFFFFFFFFFFFFFFF
+    return index, min(64 - rest.bit_length(), MAX_RANK - 1) + 1
+
+
+class HyperLogLog:
+    __slots__ = ('registers',)
+
+    def __init__(self, data: bytes = b''):
+        # Пустые байты — пустой скетч: так его хранит БД по умолчанию
+        self.registers = bytearray(data or REGISTERS)
+        if len(self.registers) != REGISTERS:
+            raise ValueError(
+                f'Скетч должен занимать {REGISTERS} байт, '
+                f'а не {len(self.registers)}'
+            )
+
+    def add(self, value) -> None:
+        self.update(*register_update(value))
+
+    def update(self, index: int, rank: int) -> None:
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other) -> 'HyperLogLog':
+        """Объединяет скетч с другим на месте."""
+        self.registers[:] = bytes(
+            map(max, self.registers, other.registers)
+        )
+        return self
+
+    def __len__(self):
+        return self.count()
+
+    def count(self) -> int:
+        registers = self.registers
+        estimate = ALPHA * REGISTERS * REGISTERS / sum(
+            2.0 ** -rank for rank in registers
+        )
+        zeros = registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Малые множества: линейный подсчёт по пустым регистрам
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+def merge_all(sketches) -> HyperLogLog:
+    result = HyperLogLog()
+    for sketch in sketches:
+        result.merge(
+            sketch if isinstance(sketch, HyperLogLog) else HyperLogLog(sketch)
+        )
+    return result
@@ -0,0 +1,39 @@
+"""Пересчёт дневных сводок активности по постам и комментариям.
+
+Пример (после первого развёртывания — без --since):
+    python manage.py backfill_activity
+    python manage.py backfill_activity --since 2026-10-01
+"""
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает дневные сводки постов и комментариев по авторам '
+        'и группам из исходных таблиц'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Первый пересчитываемый день, ГГГГ-ММ-ДД; по умолчанию все'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since ожидает дату ГГГГ-ММ-ДД')
+        start = time.perf_counter()
+        count = backfill(since)
+        self.stdout.write(
+            f'Записано строк сводок: {count} '
+            f'за {time.perf_counter() - start:.2f} с'
+        )
@@ -0,0 +1,130 @@
+"""Нагрузка на горячий ключ кеша в момент истечения его срока.
+
+Пример:
+    python manage.py cache_stampede --threads 32 --ttl 1 --duration 5
+    python manage.py cache_stampede --threads 32 --ttl 1 --naive
+"""
+import threading
+import time
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core import metrics
+from core.bench import temporary_cache, temporary_metrics_dirs
+from posts.models import Post
+from posts.utils import posts_cacher
+
+CACHE_KEY = 'stampede_posts_cache'
+
+
+def naive_cacher(posts_list, cache_name: str, cache_timer: int) -> list:
+    """Кеширование без защиты от одновременного пересчёта."""
+    value = cache.get(cache_name)
+    if value is None:
+        value = list(posts_list)
+        cache.set(cache_name, value, cache_timer)
+    return value
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоки читают ленту главной через posts_cacher, пока у ключа '
+        'истекает срок, и печатают число запросов к БД по интервалам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument(
+            '--duration', type=float, default=5.0,
+            help='Длительность нагрузки, секунды'
+        )
+        parser.add_argument(
+            '--ttl', type=int, default=1, help='Срок жизни ключа, секунды'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0.25,
+            help='Ширина интервала в отчёте, секунды'
+        )
+        parser.add_argument('--posts', type=int, default=300)
+        parser.add_argument(
+            '--naive', action='store_true',
+            help='Кешировать без защиты, для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            # Свой кеш и каталог метрик: нагрузка не должна трогать кеш
+            # сайта и попадать в его /metrics/
+            with temporary_cache(), temporary_metrics_dirs():
+                call_command(
+                    'generate_data', users=50, posts=options['posts'],
+                    comments=0, seed=42, stdout=StringIO(),
+                )
+                metrics.reset()
+                query_times, elapsed = self.run_load(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.report(query_times, elapsed, options['interval'])
+
+    def run_load(self, options):
+        """Время каждого запроса к БД от начала нагрузки."""
+        cacher = naive_cacher if options['naive'] else posts_cacher
+        query_times = []
+        lock = threading.Lock()
+        start = time.monotonic()
+        deadline = start + options['duration']
+
+        def count_query(execute, sql, params, many, context):
+            with lock:
+                query_times.append(time.monotonic() - start)
+            return execute(sql, params, many, context)
+
+        def worker():
+            posts_list = Post.objects.select_related('group', 'author')
+            try:
+                with connection.execute_wrapper(count_query):
+                    while time.monotonic() < deadline:
+                        cacher(posts_list, CACHE_KEY, options['ttl'])
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker) for _ in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return query_times, time.monotonic() - start
+
+    def report(self, query_times: list, elapsed: float, interval: float):
+        buckets = [0] * (int(elapsed / interval) + 1)
+        for moment in query_times:
+            buckets[int(moment / interval)] += 1
+        row = '{:>10} {:>10}'
+        self.stdout.write(row.format('от, с', 'запросов'))
+        for index, count in enumerate(buckets):
+            self.stdout.write(row.format(f'{index * interval:.2f}', count))
+        self.stdout.write(
+            'всего запросов: {}, максимум за интервал: {}'.format(
+                len(query_times), max(buckets)
+            )
+        )
+        results = {
+            dict(labels)['result']: value
+            for name, labels, value in metrics.snapshot()['counters']
+            if name == 'cache_requests_total'
+            and dict(labels).get('cache') == CACHE_KEY
+        }
+        if results:
+            self.stdout.write('обращения к кешу: ' + ', '.join(
+                f'{result}={count}'
+                for result, count in sorted(results.items())
+            ))
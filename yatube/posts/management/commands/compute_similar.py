@@ -0,0 +1,37 @@
+"""Пересчёт похожих постов по TF-IDF.
+
+Пример (по расписанию: полный пересчёт раз в сутки, новые и
+правленные посты каждые несколько минут). --new экономит поиск
+соседей и запись, но не построение индекса:
+    python manage.py compute_similar
+    python manage.py compute_similar --new
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.similar import refresh_similar
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит TF-IDF текстов постов и сохраняет для каждого поста '
+        'самые похожие'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--new', action='store_true',
+            help=(
+                'Записать соседей только новых и правленных постов; '
+                'TF-IDF всё равно строится по всем постам'
+            )
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = refresh_similar(new_only=options['new'])
+        self.stdout.write(
+            f'Пересчитано постов: {count} '
+            f'за {time.perf_counter() - start:.2f} с'
+        )
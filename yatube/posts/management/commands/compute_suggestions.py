@@ -0,0 +1,36 @@
+"""Пересчёт рекомендаций «на кого подписаться».
+
+Пример (по расписанию: полный пересчёт раз в сутки, устаревшие строки
+каждые несколько минут):
+    python manage.py compute_suggestions
+    python manage.py compute_suggestions --stale
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.suggestions import refresh_suggestions
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает рекомендации авторов по графу подписок и группам '
+        'и сохраняет лучшие для каждого пользователя'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale', action='store_true',
+            help=(
+                'Записать только строки, устаревшие после подписок; граф '
+                'подписок всё равно загружается целиком'
+            )
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = refresh_suggestions(stale_only=options['stale'])
+        self.stdout.write(
+            f'Пересчитано пользователей: {count} '
+            f'за {time.perf_counter() - start:.2f} с'
+        )
@@ -0,0 +1,275 @@
+"""Генератор синтетической социальной сети для нагрузочных замеров.
+
+Пример (миллион пользователей и 50 млн постов):
+    python manage.py generate_data --users 1000000 --posts 50000000 \
+        --comments 20000000 --follows-per-user 30 --images 0.05
+"""
+import math
+import os
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from posts.follows import rebuild_follow_stats
+from posts.models import Comment, Follow, Group, Post, User
+from posts.rollups import backfill as backfill_activity
+
+# Размер пулов заранее сгенерированных строк: Faker слишком медленный,
+# чтобы вызывать его для каждого из миллионов объектов
+TEXT_POOL_SIZE = 5000
+NAME_POOL_SIZE = 1000
+PLACEHOLDER_COLORS = (
+    '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+    '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',
+)
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Отключает auto_now_add, чтобы даты можно было задать вручную."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def zipf_rank(rng: random.Random, size: int) -> int:
+    """Ранг 0..size-1 со степенным распределением P(r) ~ 1/r.
+
+    Обратная функция распределения непрерывного закона 1/x даёт
+    выборку за O(1) без таблиц, что важно для миллионов объектов.
+    """
+    return min(int(math.exp(rng.random() * math.log(size + 1))) - 1,
+               size - 1)
+
+
+def next_id(model) -> int:
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет БД реалистичным социальным графом: пользователи, группы, '
+        'посты, подписки со степенным распределением и комментарии'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows-per-user', type=float, default=20,
+            help='Среднее число подписок пользователя'
+        )
+        parser.add_argument(
+            '--images', type=float, default=0,
+            help='Доля постов с картинкой-заглушкой, от 0 до 1'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней раскидать даты публикаций'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--prefix', default='user',
+            help='Префикс имён пользователей'
+        )
+        parser.add_argument(
+            '--password', default='password',
+            help='Пароль всех созданных пользователей'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.period = timedelta(days=options['days']).total_seconds()
+        fake = Faker('ru_RU')
+        fake.seed_instance(options['seed'])
+        self.texts = [
+            fake.paragraph(nb_sentences=4) for _ in range(TEXT_POOL_SIZE)
+        ]
+        self.first_names = [
+            fake.first_name() for _ in range(NAME_POOL_SIZE)
+        ]
+        self.last_names = [fake.last_name() for _ in range(NAME_POOL_SIZE)]
+        if User.objects.filter(
+            username=f'{options["prefix"]}0'
+        ).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {options["prefix"]} уже есть, '
+                'задайте другой --prefix'
+            )
+
+        users = self.create_users(
+            options['users'], options['prefix'], options['password']
+        )
+        groups = self.create_groups(options['groups'], fake)
+        images = self.create_placeholders() if options['images'] else []
+        with explicit_dates(
+            Post._meta.get_field('pub_date'),
+            Comment._meta.get_field('created'),
+        ):
+            posts = self.create_posts(
+                options['posts'], users, groups, images, options['images']
+            )
+            self.create_comments(options['comments'], users, posts)
+        self.create_follows(users, options['follows_per_user'])
+        # Подписки, посты и комментарии вставлены в обход сигналов
+        rebuild_follow_stats()
+        backfill_activity()
+        self.reset_sequences()
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def batches(self, total: int):
+        for start in range(0, total, self.batch_size):
+            yield range(start, min(start + self.batch_size, total))
+
+    def bulk_insert(self, model, objects, label: str, done: int, total: int):
+        with transaction.atomic():
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+        self.stdout.write(f'{label}: {done}/{total}')
+
+    def random_date(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.period)
+
+    def create_users(self, total: int, prefix: str, password: str) -> range:
+        """Пользователи получают явные id, чтобы не перечитывать их из БД."""
+        first_id = next_id(User)
+        # Хеш пароля считается один раз: PBKDF2 на каждого — часы работы
+        password = make_password(password)
+        for batch in self.batches(total):
+            self.bulk_insert(User, [
+                User(
+                    id=first_id + index,
+                    username=f'{prefix}{index}',
+                    first_name=self.rng.choice(self.first_names),
+                    last_name=self.rng.choice(self.last_names),
+                    password=password,
+                )
+                for index in batch
+            ], 'Пользователи', batch.stop, total)
+        return range(first_id, first_id + total)
+
+    def create_groups(self, total: int, fake: Faker) -> range:
+        first_id = next_id(Group)
+        self.bulk_insert(Group, [
+            Group(
+                id=first_id + index,
+                title=fake.sentence(nb_words=3)[:200],
+                slug=f'group-{first_id + index}',
+                description=fake.paragraph(),
+            )
+            for index in range(total)
+        ], 'Группы', total, total)
+        return range(first_id, first_id + total)
+
+    def create_placeholders(self) -> list:
+        """Несколько JPEG-заглушек, общих для всех постов с картинкой."""
+        directory = os.path.join(settings.MEDIA_ROOT, 'posts')
+        os.makedirs(directory, exist_ok=True)
+        names = []
+        for index, color in enumerate(PLACEHOLDER_COLORS):
+            name = f'posts/placeholder_{index}.jpg'
+            Image.new('RGB', (960, 540), color).save(
+                os.path.join(settings.MEDIA_ROOT, name), 'JPEG'
+            )
+            names.append(name)
+        return names
+
+    def create_posts(self, total, users, groups, images, image_share):
+        """Активность авторов распределена по степенному закону."""
+        first_id = next_id(Post)
+        for batch in self.batches(total):
+            posts = []
+            for index in batch:
+                group_id = None
+                if groups and self.rng.random() < 0.6:
+                    group_id = groups[zipf_rank(self.rng, len(groups))]
+                image = ''
+                if images and self.rng.random() < image_share:
+                    image = self.rng.choice(images)
+                posts.append(Post(
+                    id=first_id + index,
+                    text=self.rng.choice(self.texts),
+                    author_id=users[zipf_rank(self.rng, len(users))],
+                    group_id=group_id,
+                    image=image,
+                    pub_date=self.random_date(),
+                ))
+            self.bulk_insert(Post, posts, 'Посты', batch.stop, total)
+        return range(first_id, first_id + total)
+
+    def create_comments(self, total, users, posts):
+        if not posts:
+            return
+        for batch in self.batches(total):
+            self.bulk_insert(Comment, [
+                Comment(
+                    post_id=posts[zipf_rank(self.rng, len(posts))],
+                    author_id=self.rng.choice(users),
+                    text=self.rng.choice(self.texts)[:300],
+                    created=self.random_date(),
+                )
+                for _ in batch
+            ], 'Комментарии', batch.stop, total)
+
+    def create_follows(self, users, mean: float):
+        """Число подписок и популярность авторов — степенные законы.
+
+        Распределение Парето с alpha=1.5 имеет среднее 3, поэтому
+        выборка масштабируется на mean / 3.
+        """
+        follows = []
+        done = 0
+        for user_id in users:
+            count = min(
+                int(self.rng.paretovariate(1.5) * mean / 3),
+                len(users) - 1,
+            )
+            authors = set()
+            # Ограничение попыток: хвост распределения выбирается редко
+            for _ in range(count * 20):
+                if len(authors) >= count:
+                    break
+                author_id = users[zipf_rank(self.rng, len(users))]
+                if author_id != user_id:
+                    authors.add(author_id)
+            follows.extend(
+                Follow(user_id=user_id, author_id=author_id)
+                for author_id in sorted(authors)
+            )
+            done += 1
+            if len(follows) >= self.batch_size:
+                self.bulk_insert(Follow, follows, 'Подписки (пользователи)',
+                                 done, len(users))
+                follows = []
+        if follows:
+            self.bulk_insert(Follow, follows, 'Подписки (пользователи)',
+                             done, len(users))
+
+    def reset_sequences(self):
+        """Сдвигает последовательности id после вставки явных ключей."""
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Group, Post, Comment, Follow]
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
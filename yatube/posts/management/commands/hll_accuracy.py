@@ -0,0 +1,59 @@
+"""Точность и память HyperLogLog против точного множества.
+
+Пример:
+    python manage.py hll_accuracy --trials 20
+"""
+import random
+
+from django.core.management.base import BaseCommand
+
+from core.memory import deep_sizeof
+from posts.hll import REGISTERS, HyperLogLog
+
+CARDINALITIES = (10, 100, 1000, 10000, 100000)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает оценку HyperLogLog с точным числом уникальных '
+        'зрителей и размер скетча с размером множества id'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trials', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--max', type=int, default=max(CARDINALITIES),
+            help='Наибольшее число уникальных зрителей'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        row = '{:>8} {:>12} {:>12} {:>10} {:>14}'
+        self.stdout.write(row.format(
+            'зрителей', 'ошибка ср.', 'ошибка макс.', 'скетч, Б',
+            'множество, Б',
+        ))
+        for cardinality in CARDINALITIES:
+            if cardinality > options['max']:
+                break
+            errors = []
+            exact = set()
+            for _ in range(options['trials']):
+                start = rng.randrange(10 ** 9)
+                exact = set(range(start, start + cardinality))
+                sketch = HyperLogLog()
+                for viewer in exact:
+                    sketch.add(f'user:{viewer}')
+                errors.append(abs(sketch.count() - cardinality) / cardinality)
+            self.stdout.write(row.format(
+                cardinality,
+                f'{sum(errors) / len(errors):.2%}',
+                f'{max(errors):.2%}',
+                len(sketch.to_bytes()),
+                deep_sizeof(exact),
+            ))
+        self.stdout.write(
+            f'Скетч: {REGISTERS} регистров, '
+            f'ожидаемая ошибка {1.04 / REGISTERS ** 0.5:.2%}'
+        )
@@ -0,0 +1,82 @@
+import pickle
+
+from django.core.management.base import BaseCommand
+
+from core.memory import deep_sizeof
+from posts.models import Comment, Follow, Post
+from posts.records import decode_post, encode_post
+from posts.utils import INDEX_CACHE_KEY, load_ids, post_cache_key
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает средний размер экземпляров Post, Comment и Follow в памяти '
+        'и в кеше, а также размер значений, которые кладут в кеш вьюхи'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sample', type=int, default=200,
+            help='Сколько объектов каждой модели измерить'
+        )
+
+    def handle(self, *args, **options):
+        sample = options['sample']
+        querysets = {
+            # Такие же выборки, как во вьюхах
+            'Post (с author и group)':
+                Post.objects.select_related('author', 'group'),
+            'Comment (с post)': Comment.objects.select_related('post'),
+            'Follow': Follow.objects.all(),
+        }
+        row = '{:<28} {:>8} {:>14} {:>14}'
+        self.stdout.write(row.format(
+            'объект', 'штук', 'память, байт', 'pickle, байт'
+        ))
+        for label, queryset in querysets.items():
+            objects = list(queryset[:sample])
+            if not objects:
+                self.stdout.write(row.format(label, 0, '-', '-'))
+                continue
+            memory = sum(deep_sizeof(obj) for obj in objects)
+            pickled = sum(len(pickle.dumps(obj, -1)) for obj in objects)
+            self.stdout.write(row.format(
+                label, len(objects),
+                memory // len(objects), pickled // len(objects),
+            ))
+
+        self.stdout.write('')
+        self.report_cached_values(sample)
+
+    def report_cached_values(self, sample: int):
+        """Размер значений, которые views кладут в кеш.
+
+        Главная хранит список id первых страниц, а сами посты лежат
+        отдельными записями post:<id>; они измеряются на sample постах.
+        """
+        post_ids = load_ids(Post.objects.all())
+        # Запись posts_cacher: (id, срок, время расчёта)
+        entry = (post_ids, 0.0, 0.0)
+        self.stdout.write(
+            '{}: {} id из {}, {} байт в кеше, {} байт в памяти '
+            'воркера'.format(
+                INDEX_CACHE_KEY, len(post_ids), post_ids.total,
+                len(pickle.dumps(entry, -1)), deep_sizeof(post_ids),
+            )
+        )
+        posts = list(Post.objects.select_related('group', 'author')[:sample])
+        if not posts:
+            return
+        records = [encode_post(post) for post in posts]
+        encoded = sum(map(len, records))
+        pickled = sum(len(pickle.dumps(post, -1)) for post in posts)
+        memory = sum(deep_sizeof(decode_post(data)) for data in records)
+        self.stdout.write(
+            '{}: {} постов, на пост {} байт в кеше (pickle моделей {} '
+            'байт), {} байт в памяти воркера; все посты — около {} '
+            'байт'.format(
+                post_cache_key('<id>'), len(posts),
+                encoded // len(posts), pickled // len(posts),
+                memory // len(posts), encoded * post_ids.total // len(posts),
+            )
+        )
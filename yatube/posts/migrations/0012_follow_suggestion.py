@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-19 09:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_follow_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowSuggestion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='follow_suggestion', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('authors', models.TextField(default='[]', verbose_name='Рекомендованные авторы')),
+                ('stale', models.BooleanField(default=False, verbose_name='Нужно пересчитать')),
+                ('computed', models.DateTimeField(auto_now=True, verbose_name='Посчитано')),
+            ],
+        ),
+    ]
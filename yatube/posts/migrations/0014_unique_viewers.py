@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0013_post_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorViewers',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='viewers', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('viewers', models.BinaryField(default=b'', verbose_name='Скетч зрителей')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='postviews',
+            name='viewers',
+            field=models.BinaryField(default=b'', verbose_name='Скетч зрителей'),
+        ),
+    ]
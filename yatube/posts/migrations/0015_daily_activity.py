@@ -0,0 +1,44 @@
+# Generated by Django 2.2.16 on 2026-10-19 10:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0014_unique_viewers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyGroupActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('posts', models.IntegerField(default=0, verbose_name='Постов')),
+                ('comments', models.IntegerField(default=0, verbose_name='Комментариев')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activity', to='posts.Group', verbose_name='Группа')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyAuthorActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('posts', models.IntegerField(default=0, verbose_name='Постов')),
+                ('comments', models.IntegerField(default=0, verbose_name='Комментариев')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activity', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailygroupactivity',
+            constraint=models.UniqueConstraint(fields=('day', 'group'), name='unique_group_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyauthoractivity',
+            constraint=models.UniqueConstraint(fields=('day', 'author'), name='unique_author_day'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.16 on 2026-10-19 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_daily_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPosts',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar', serialize=False, to='posts.Post', verbose_name='Пост')),
+                ('neighbors', models.TextField(default='[]', verbose_name='Похожие посты')),
+                ('stale', models.BooleanField(default=False, verbose_name='Нужно пересчитать')),
+                ('computed', models.DateTimeField(auto_now=True, verbose_name='Посчитано')),
+            ],
+        ),
+    ]
@@ -98,6 +98,154 @@ class Follow(models.Model):
                                     name='unique_follows'
                                     )
         ]
+        # Покрывающие индексы для списков подписчиков и подписок
+        # с курсором по id
+        indexes = [
+            models.Index(fields=['author', 'id', 'user'],
+                         name='follow_followers_idx'),
+            models.Index(fields=['user', 'id', 'author'],
+                         name='follow_following_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} -> {self.author.username}'
+
+
+class FollowStats(models.Model):
+    """Счётчики подписок пользователя, чтобы не считать их COUNT(*)."""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='follow_stats',
+        verbose_name='Пользователь',
+    )
+    followers = models.PositiveIntegerField('Подписчиков', default=0)
+    following = models.PositiveIntegerField('Подписок', default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.followers}/{self.following}'
+
+
+class FollowSuggestion(models.Model):
+    """Заранее посчитанные рекомендации авторов для пользователя."""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='follow_suggestion',
+        verbose_name='Пользователь',
+    )
+    # JSON-список [id, username] по убыванию оценки: для показа не
+    # нужно читать пользователей
+    authors = models.TextField('Рекомендованные авторы', default='[]')
+    stale = models.BooleanField('Нужно пересчитать', default=False)
+    computed = models.DateTimeField('Посчитано', auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.authors}'
+
+
+class PostViews(models.Model):
+    """Сохранённое число просмотров и скетч зрителей поста.
+
+    Пишется пачками из posts.view_counts, а не на каждый просмотр.
+    """
+
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='view_count',
+        verbose_name='Пост',
+    )
+    views = models.PositiveIntegerField('Просмотров', default=0)
+    # HyperLogLog уникальных зрителей, см. posts.hll
+    viewers = models.BinaryField('Скетч зрителей', default=b'')
+
+    def __str__(self):
+        return f'{self.post_id}: {self.views}'
+
+
+class AuthorViewers(models.Model):
+    """Скетч уникальных зрителей всех постов автора."""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='viewers',
+        verbose_name='Автор',
+    )
+    viewers = models.BinaryField('Скетч зрителей', default=b'')
+
+    def __str__(self):
+        return f'{self.user_id}'
+
+
+class DailyAuthorActivity(models.Model):
+    """Посты и комментарии автора за день; ведётся posts.rollups."""
+
+    day = models.DateField('День')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='daily_activity',
+        verbose_name='Автор',
+    )
+    posts = models.IntegerField('Постов', default=0)
+    comments = models.IntegerField('Комментариев', default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'author'],
+                                    name='unique_author_day')
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.author_id}: {self.posts}/{self.comments}'
+
+
+class DailyGroupActivity(models.Model):
+    """Посты и комментарии к постам группы за день."""
+
+    day = models.DateField('День')
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='daily_activity',
+        verbose_name='Группа',
+    )
+    posts = models.IntegerField('Постов', default=0)
+    comments = models.IntegerField('Комментариев', default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'group'],
+                                    name='unique_group_day')
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.group_id}: {self.posts}/{self.comments}'
+
+
+class SimilarPosts(models.Model):
+    """Заранее посчитанные похожие посты."""
+
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='similar',
+        verbose_name='Пост',
+    )
+    # JSON-список [id, сходство] по убыванию сходства: оценки нужны,
+    # чтобы дополнять список новыми постами без пересчёта
+    neighbors = models.TextField('Похожие посты', default='[]')
+    stale = models.BooleanField('Нужно пересчитать', default=False)
+    computed = models.DateTimeField('Посчитано', auto_now=True)
+
+    def __str__(self):
+        return f'{self.post_id}: {self.neighbors}'
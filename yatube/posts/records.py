@@ -0,0 +1,139 @@
+"""Компактное представление постов ленты для кеша.
+
+Вместо pickle экземпляров Post с автором и группой в кеш кладётся
+marshal кортежа (или списка кортежей) только с теми полями, которые
+выводят шаблоны ленты. При чтении кортежи превращаются в лёгкие
+объекты со __slots__, которые шаблоны используют так же, как модели.
+"""
+import datetime
+import marshal
+
+from django.utils import timezone
+
+from .models import Post
+
+# Версия формата marshal, одинаковая во всех поддерживаемых Python
+MARSHAL_VERSION = 4
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+IMAGE_FIELD = Post._meta.get_field('image')
+
+
+class FeedAuthor:
+    __slots__ = ('id', 'username', 'first_name', 'last_name')
+
+    def __init__(self, id, username, first_name, last_name):
+        self.id = id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_full_name(self) -> str:
+        return f'{self.first_name} {self.last_name}'.strip()
+
+    def __str__(self):
+        return self.username
+
+
+class FeedGroup:
+    __slots__ = ('id', 'slug', 'title')
+
+    def __init__(self, id, slug, title):
+        self.id = id
+        self.slug = slug
+        self.title = title
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.title
+
+
+class FeedPost:
+    """Пост ленты; равен экземпляру Post с тем же pk."""
+
+    # views проставляется при показе, в кеш не попадает
+    __slots__ = (
+        'id', 'text', 'pub_date', 'image_name', 'author', 'group', 'views'
+    )
+
+    def __init__(self, id, text, pub_date, image_name, author, group):
+        self.id = id
+        self.text = text
+        self.pub_date = pub_date
+        self.image_name = image_name
+        self.author = author
+        self.group = group
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def image(self):
+        return IMAGE_FIELD.attr_class(None, IMAGE_FIELD, self.image_name)
+
+    def __eq__(self, other):
+        if not isinstance(other, (FeedPost, Post)):
+            return NotImplemented
+        return self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.text[:15]
+
+
+def _timestamp(value: datetime.datetime) -> int:
+    """Микросекунды от начала эпохи: marshal не умеет datetime."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def to_row(post) -> tuple:
+    author = post.author
+    group = post.group
+    return (
+        post.pk, post.text, _timestamp(post.pub_date), post.image.name or '',
+        author.pk, author.username, author.first_name, author.last_name,
+        group.pk if group else None,
+        group.slug if group else None,
+        group.title if group else None,
+    )
+
+
+def from_row(row: tuple) -> FeedPost:
+    (post_id, text, pub_date, image_name, author_id, username, first_name,
+     last_name, group_id, group_slug, group_title) = row
+    return FeedPost(
+        post_id, text,
+        EPOCH + datetime.timedelta(microseconds=pub_date),
+        image_name,
+        FeedAuthor(author_id, username, first_name, last_name),
+        FeedGroup(group_id, group_slug, group_title)
+        if group_id is not None else None,
+    )
+
+
+def encode_post(post) -> bytes:
+    return marshal.dumps(to_row(post), MARSHAL_VERSION)
+
+
+def decode_post(data: bytes) -> FeedPost:
+    return from_row(marshal.loads(data))
+
+
+def encode_posts(posts) -> bytes:
+    """Посты с подгруженными author и group в байты для кеша."""
+    return marshal.dumps([to_row(post) for post in posts], MARSHAL_VERSION)
+
+
+def decode_posts(data: bytes) -> list:
+    return [from_row(row) for row in marshal.loads(data)]
@@ -0,0 +1,194 @@
+"""Дневные сводки активности по авторам и группам.
+
+Каждый новый или удалённый пост и комментарий сразу меняет счётчик
+своего дня в DailyAuthorActivity и DailyGroupActivity одним upsert
+(INSERT ... ON CONFLICT DO UPDATE), поэтому отчёты читают сотни строк
+сводок, а не таблицы постов и комментариев целиком. Комментарий
+засчитывается своему автору и группе поста; при переносе поста в
+другую группу вместе с ним переносятся и его комментарии. Дни — по
+TIME_ZONE.
+
+backfill пересчитывает сводки с заданного дня по исходным таблицам:
+после первого развёртывания или ручной правки данных.
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (Comment, DailyAuthorActivity, DailyGroupActivity,
+                     Post)
+
+BACKFILL_BATCH_SIZE = 200
+
+
+def activity_day(moment: datetime.datetime) -> datetime.date:
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date()
+
+
+def _upsert_sql(model, key: str, rows: int) -> str:
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    day = quote('day')
+    key = quote(model._meta.get_field(key).column)
+    posts, comments = quote('posts'), quote('comments')
+    values = ', '.join(['(%s, %s, %s, %s)'] * rows)
+    return (
+        f'INSERT INTO {table} ({day}, {key}, {posts}, {comments}) '
+        f'VALUES {values} ON CONFLICT ({day}, {key}) DO UPDATE SET '
+        f'{posts} = {table}.{posts} + excluded.{posts}, '
+        f'{comments} = {table}.{comments} + excluded.{comments}'
+    )
+
+
+def _add(model, key: str, rows: list) -> None:
+    """Прибавляет (день, id, посты, комментарии) к сводкам model."""
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+            batch = rows[start:start + BACKFILL_BATCH_SIZE]
+            cursor.execute(
+                _upsert_sql(model, key, len(batch)),
+                [value for row in batch for value in row],
+            )
+
+
+def _subtract(model, key: str, row: tuple) -> None:
+    # Только UPDATE: при каскадном удалении автора или группы новая
+    # строка сослалась бы на удаляемую запись
+    day, key_id, posts, comments = row
+    model.objects.filter(day=day, **{key: key_id}).update(
+        posts=F('posts') + posts, comments=F('comments') + comments
+    )
+
+
+def _apply(model, key: str, row: tuple) -> None:
+    if row[2] < 0 or row[3] < 0:
+        _subtract(model, key, row)
+    else:
+        _add(model, key, [row])
+
+
+def record(day: datetime.date, author_id: int, group_id: int,
+           posts: int = 0, comments: int = 0) -> None:
+    _apply(DailyAuthorActivity, 'author', (day, author_id, posts, comments))
+    if group_id is not None:
+        _apply(DailyGroupActivity, 'group', (day, group_id, posts, comments))
+
+
+def post_created(post, sign: int = 1) -> None:
+    record(activity_day(post.pub_date), post.author_id, post.group_id,
+           posts=sign)
+
+
+def post_moved(post, old_group_id: int) -> None:
+    """Пост перешёл в другую группу: переносим его и его комментарии."""
+    changes = {activity_day(post.pub_date): [1, 0]}
+    for (day, _), total in _daily_counts(
+        Comment.objects.filter(post=post), 'created', 'post'
+    ).items():
+        changes.setdefault(day, [0, 0])[1] = total
+    for group_id, sign in ((old_group_id, -1), (post.group_id, 1)):
+        if group_id is None:
+            continue
+        for day, (posts, total) in sorted(changes.items()):
+            _apply(DailyGroupActivity, 'group',
+                   (day, group_id, sign * posts, sign * total))
+
+
+def comment_created(comment, group_id: int, sign: int = 1) -> None:
+    record(activity_day(comment.created), comment.author_id, group_id,
+           comments=sign)
+
+
+def _daily_counts(queryset, date_field: str, key: str) -> dict:
+    return {
+        (row['day'], row[key]): row['total']
+        for row in queryset.annotate(
+            day=TruncDate(date_field)
+        ).values('day', key).annotate(total=Count('id')).order_by()
+    }
+
+
+def backfill(since: datetime.date = None) -> int:
+    """Пересчитывает сводки начиная с дня since; возвращает число строк."""
+    posts = Post.objects.all()
+    comments = Comment.objects.all()
+    author_rows = DailyAuthorActivity.objects.all()
+    group_rows = DailyGroupActivity.objects.all()
+    if since is not None:
+        start = timezone.make_aware(
+            datetime.datetime.combine(since, datetime.time.min)
+        )
+        posts = posts.filter(pub_date__gte=start)
+        comments = comments.filter(created__gte=start)
+        author_rows = author_rows.filter(day__gte=since)
+        group_rows = group_rows.filter(day__gte=since)
+    counts = (
+        (DailyAuthorActivity, 'author', author_rows,
+         _daily_counts(posts, 'pub_date', 'author'),
+         _daily_counts(comments, 'created', 'author')),
+        (DailyGroupActivity, 'group', group_rows,
+         _daily_counts(posts.filter(group__isnull=False),
+                       'pub_date', 'group'),
+         _daily_counts(comments.filter(post__group__isnull=False),
+                       'created', 'post__group')),
+    )
+    total = 0
+    with transaction.atomic():
+        for model, key, existing, post_counts, comment_counts in counts:
+            existing.delete()
+            keys = sorted(set(post_counts) | set(comment_counts))
+            rows = [
+                (day, key_id, post_counts.get((day, key_id), 0),
+                 comment_counts.get((day, key_id), 0))
+                for day, key_id in keys
+            ]
+            _add(model, key, rows)
+            total += len(rows)
+    return total
+
+
+def activity_series(by: str, days: int, metric: str = 'posts',
+                    today: datetime.date = None) -> dict:
+    """Ряды по дням за последние days дней: id -> [число за день, ...].
+
+    Пропущенные дни заполняются нулями, последний элемент — today.
+    """
+    model = DailyAuthorActivity if by == 'author' else DailyGroupActivity
+    today = today or activity_day(timezone.now())
+    start = today - datetime.timedelta(days=days - 1)
+    series = {}
+    for day, key_id, value in model.objects.filter(
+        day__gte=start, day__lte=today
+    ).values_list('day', by, metric).iterator():
+        row = series.setdefault(key_id, [0] * days)
+        row[(day - start).days] += value
+    return series
+
+
+def moving_average(values: list, window: int) -> list:
+    """Скользящее среднее за window дней, по бегущей сумме."""
+    averages = []
+    total = 0
+    for position, value in enumerate(values):
+        total += value
+        if position >= window:
+            total -= values[position - window]
+        averages.append(total / min(position + 1, window))
+    return averages
+
+
+def growth(values: list, window: int) -> float:
+    """Изменение суммы последних window дней к предыдущим window дням.
+
+    None, если в предыдущем окне ничего не было.
+    """
+    recent = sum(values[-window:])
+    previous = sum(values[-2 * window:-window])
+    if not previous:
+        return None
+    return (recent - previous) / previous
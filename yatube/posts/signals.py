@@ -0,0 +1,107 @@
+"""Сброс кешированных лент и постов.
+
+Списки id лент групп и авторов сбрасываются при появлении и удалении
+поста. Ленты подписок при этом не сбрасываются, а сверяются с
+отметкой времени автора; сбрасываются они при подписке и отписке.
+Правка поста сбрасывает только его собственную запись, если пост не
+перешёл в другую группу. Главная обновляется по истечении срока.
+Подписки и отписки через ORM передаются в posts.follows, где правятся
+граф подписок и счётчики. Посты и комментарии попадают в дневные
+сводки posts.rollups, а посты — ещё и в тепловую карту автора.
+Удаление и перенос поста в другую группу правят наборы популярного.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import heatmap, rollups, trending, view_counts
+from .follows import follows_changed
+from .models import Comment, Follow, Post
+from .similar import mark_stale
+from .utils import (author_posts_changed, group_feed_key, post_cache_key,
+                    profile_feed_key)
+
+
+def feed_keys(post) -> list:
+    """Ленты группы и автора, в которые входит пост.
+
+    Ленты подписок не перечисляются: они сверяются с отметкой автора
+    (author_posts_changed).
+    """
+    keys = [profile_feed_key(post.author_id)]
+    if post.group_id is not None:
+        keys.append(group_feed_key(post.group_id))
+    return keys
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_group(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def drop_cached_post_on_save(sender, instance, created, **kwargs):
+    if created:
+        cache.delete_many(feed_keys(instance))
+        author_posts_changed(instance.author_id)
+        rollups.post_created(instance)
+        heatmap.post_changed(instance)
+        return
+    keys = [post_cache_key(instance.pk)]
+    mark_stale(instance.pk)
+    old_group_id = getattr(instance, '_old_group_id', instance.group_id)
+    if old_group_id != instance.group_id:
+        rollups.post_moved(instance, old_group_id)
+        trending.post_moved(instance.pk, old_group_id, instance.group_id)
+        keys.extend(
+            group_feed_key(group_id)
+            for group_id in (old_group_id, instance.group_id)
+            if group_id is not None
+        )
+    cache.delete_many(keys)
+
+
+@receiver(post_delete, sender=Post)
+def drop_cached_post_on_delete(sender, instance, **kwargs):
+    cache.delete_many([post_cache_key(instance.pk)] + feed_keys(instance))
+    author_posts_changed(instance.author_id)
+    trending.forget_post(instance.pk, instance.group_id)
+    view_counts.discard(instance.pk)
+    rollups.post_created(instance, -1)
+    heatmap.post_changed(instance, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_for_trending(sender, instance, created, **kwargs):
+    if created:
+        trending.record_comment(instance)
+        rollups.comment_created(instance, instance.post.group_id)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    # При каскадном удалении поста объекта поста в комментарии может не
+    # быть, а строка поста ещё есть: комментарии удаляются раньше
+    group_id = Post.objects.filter(pk=instance.post_id).values_list(
+        'group_id', flat=True
+    ).first()
+    rollups.comment_created(instance, group_id, -1)
+
+
+# Подписки из views пишутся через posts.follows без сигналов, а
+# сюда попадают записи через ORM: админка, каскадное удаление
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        follows_changed(
+            [(instance.user_id, instance.author_id)], added=True
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    follows_changed([(instance.user_id, instance.author_id)], added=False)
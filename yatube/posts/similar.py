@@ -0,0 +1,236 @@
+"""Похожие посты по TF-IDF.
+
+Офлайн-задача (manage.py compute_similar) строит по текстам постов
+разреженную матрицу TF-IDF X в формате CSR: массивы indptr, indices и
+data, как в scipy.sparse, но на array из стандартной библиотеки. К ней
+строится транспонированная — обратный индекс «слово -> посты». Строки
+X нормированы, поэтому сходство постов — скалярное произведение, а
+строка X·Xᵀ считается построчным умножением, как в posts.suggestions.
+
+Поиск приближённый: у поста берутся MAX_QUERY_TERMS самых весомых
+слов, а слова, которые есть больше чем в MAX_POSTING постах, почти
+ничего не различают и пропускаются. Лучшие SIMILAR_COUNT соседей с
+оценками пишутся в SimilarPosts пачками по BATCH_SIZE постов.
+
+Запуск с --new ищет соседей только для постов без строки и правленных
+(stale) и дописывает их в списки найденных соседей: сходство
+симметрично. Индекс TF-IDF при этом всё равно строится по всем постам,
+так что время уходит в основном на него; экономится поиск соседей и
+запись. Остальные списки не пересчитываются — их поправит регулярный
+полный пересчёт.
+
+Показ — одно чтение из кеша (при промахе строка по первичному ключу)
+и один запрос id__in.
+"""
+import heapq
+import json
+import math
+import re
+from array import array
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Post, SimilarPosts
+
+SIMILAR_COUNT = 10
+SIMILAR_SHOWN = 5
+SIMILAR_CACHE_SEC = 60 * 60
+BATCH_SIZE = 500
+MAX_QUERY_TERMS = 20
+MAX_POSTING = 5000
+# Слова из букв не короче трёх: отсекает предлоги, союзы и числа
+TOKEN_RE = re.compile(r'[^\W\d_]{3,}')
+
+
+def similar_key(post_id: int) -> str:
+    return f'similar:{post_id}'
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+
+class TfidfIndex:
+    """TF-IDF постов в CSR: строка — пост, столбец — слово."""
+
+    def __init__(self, documents):
+        # documents — пары (id поста, текст)
+        self.vocabulary = {}
+        self.ids = array('I')
+        self.indptr = array('L', [0])
+        self.indices = array('I')
+        self.data = array('f')
+        for post_id, text in documents:
+            counts = Counter(
+                self.vocabulary.setdefault(word, len(self.vocabulary))
+                for word in tokenize(text)
+            )
+            self.ids.append(post_id)
+            for term, count in sorted(counts.items()):
+                self.indices.append(term)
+                # Сублинейный TF: десятый повтор слова весит меньше первого
+                self.data.append(1 + math.log(count))
+            self.indptr.append(len(self.indices))
+        self.row_of = {post_id: row for row, post_id in enumerate(self.ids)}
+        frequency = array('L', [0]) * len(self.vocabulary)
+        for term in self.indices:
+            frequency[term] += 1
+        total = len(self.ids)
+        self.idf = array('f', (
+            math.log((1 + total) / (1 + count)) + 1 for count in frequency
+        ))
+        for row in range(total):
+            self._normalize(self.indptr[row], self.indptr[row + 1])
+        self._transpose(frequency)
+
+    def _normalize(self, start: int, end: int) -> None:
+        for position in range(start, end):
+            self.data[position] *= self.idf[self.indices[position]]
+        norm = math.sqrt(sum(value * value for value in self.data[start:end]))
+        if norm:
+            for position in range(start, end):
+                self.data[position] /= norm
+
+    def _transpose(self, frequency) -> None:
+        """Обратный индекс: посты каждого слова с весами, тоже CSR."""
+        self.term_ptr = array('L', [0]) * (len(frequency) + 1)
+        for term, count in enumerate(frequency):
+            self.term_ptr[term + 1] = self.term_ptr[term] + count
+        fill = array('L', self.term_ptr[:-1])
+        self.term_rows = array('I', [0]) * len(self.indices)
+        self.term_data = array('f', [0]) * len(self.indices)
+        for row in range(len(self.ids)):
+            for position in range(self.indptr[row], self.indptr[row + 1]):
+                term = self.indices[position]
+                self.term_rows[fill[term]] = row
+                self.term_data[fill[term]] = self.data[position]
+                fill[term] += 1
+
+    def neighbors(self, row: int, count: int = SIMILAR_COUNT) -> list:
+        """[id поста, сходство] лучших соседей строки по убыванию."""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        query = heapq.nlargest(
+            MAX_QUERY_TERMS,
+            zip(self.data[start:end], self.indices[start:end]),
+        )
+        scores = defaultdict(float)
+        for weight, term in query:
+            first, last = self.term_ptr[term], self.term_ptr[term + 1]
+            if last - first > MAX_POSTING:
+                continue
+            for other, other_weight in zip(self.term_rows[first:last],
+                                           self.term_data[first:last]):
+                scores[other] += weight * other_weight
+        scores.pop(row, None)
+        best = heapq.nlargest(
+            count, scores.items(), key=lambda item: (item[1], -item[0])
+        )
+        return [[self.ids[other], round(score, 4)] for other, score in best]
+
+
+def load_index() -> TfidfIndex:
+    return TfidfIndex(
+        Post.objects.order_by('id').values_list('id', 'text').iterator()
+    )
+
+
+def _cache_ids(neighbors: dict) -> None:
+    cache.set_many(
+        {similar_key(post_id): [other for other, _ in items]
+         for post_id, items in neighbors.items()},
+        SIMILAR_CACHE_SEC,
+    )
+
+
+def store_similar(neighbors: dict) -> None:
+    """Записывает списки соседей в таблицу и сразу id в кеш."""
+    post_ids = sorted(neighbors)
+    with transaction.atomic():
+        SimilarPosts.objects.filter(post_id__in=post_ids).delete()
+        SimilarPosts.objects.bulk_create([
+            SimilarPosts(
+                post_id=post_id, neighbors=json.dumps(neighbors[post_id])
+            )
+            for post_id in post_ids
+        ])
+    _cache_ids(neighbors)
+
+
+def add_to_neighbors(neighbors: dict) -> None:
+    """Дописывает посты из neighbors в списки их соседей."""
+    incoming = defaultdict(dict)
+    for post_id, items in neighbors.items():
+        for other, score in items:
+            # Соседи из этой же пачки уже посчитаны по полному индексу
+            if other not in neighbors:
+                incoming[other][post_id] = score
+    changed = {}
+    rows = []
+    for row in SimilarPosts.objects.filter(post_id__in=sorted(incoming)):
+        current = json.loads(row.neighbors)
+        merged = dict(current)
+        merged.update(incoming[row.post_id])
+        best = heapq.nlargest(
+            SIMILAR_COUNT, merged.items(),
+            key=lambda item: (item[1], -item[0]),
+        )
+        items = [[other, score] for other, score in best]
+        if items != current:
+            row.neighbors = json.dumps(items)
+            rows.append(row)
+            changed[row.post_id] = items
+    SimilarPosts.objects.bulk_update(rows, ['neighbors'])
+    _cache_ids(changed)
+
+
+def refresh_similar(new_only: bool = False) -> int:
+    """Пересчитывает всех или только новые и правленные; их число."""
+    index = load_index()
+    if new_only:
+        post_ids = Post.objects.filter(
+            Q(similar__isnull=True) | Q(similar__stale=True)
+        ).order_by('id').values_list('id', flat=True)
+        rows = [index.row_of[post_id] for post_id in post_ids
+                if post_id in index.row_of]
+    else:
+        rows = range(len(index.ids))
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = {
+            index.ids[row]: index.neighbors(row)
+            for row in rows[start:start + BATCH_SIZE]
+        }
+        store_similar(batch)
+        if new_only:
+            add_to_neighbors(batch)
+    return len(rows)
+
+
+def mark_stale(post_id: int) -> None:
+    """Текст поста мог измениться: --new пересчитает его соседей."""
+    SimilarPosts.objects.filter(post_id=post_id).update(stale=True)
+
+
+def similar_ids(post_id: int) -> list:
+    key = similar_key(post_id)
+    ids = cache.get(key)
+    if ids is None:
+        row = SimilarPosts.objects.filter(
+            post_id=post_id
+        ).values_list('neighbors', flat=True).first()
+        ids = [other for other, _ in json.loads(row)] if row else []
+        cache.set(key, ids, SIMILAR_CACHE_SEC)
+    return ids
+
+
+def similar_posts(post_id: int, limit: int = SIMILAR_SHOWN) -> list:
+    """Похожие посты для показа, самые похожие первыми."""
+    # Берём весь список: удалённые посты просто не найдутся
+    ids = similar_ids(post_id)
+    if not ids:
+        return []
+    posts = Post.objects.filter(id__in=ids).select_related('author')
+    found = {post.id: post for post in posts}
+    return [found[other] for other in ids if other in found][:limit]
@@ -0,0 +1,265 @@
+"""Рекомендации «на кого подписаться».
+
+Офлайн-задача (manage.py compute_suggestions) строит по таблице
+подписок разреженную матрицу смежности A в формате CSR: массивы
+indptr и indices, как в scipy.sparse, но на array из стандартной
+библиотеки. Строка A·A считается построчным умножением (алгоритм
+Густавсона): оценка кандидата — число людей, на которых подписан
+пользователь и которые подписаны на кандидата. К ней добавляются
+популярные авторы групп, в которых пользователь пишет. Лучшие
+SUGGESTIONS_COUNT кандидатов записываются в FollowSuggestion.
+
+Подписка и отписка помечают строки пользователя и его подписчиков
+устаревшими, запуск с --stale пересчитывает только их. Граф при этом
+всё равно загружается целиком: --stale экономит запись, а не расчёт.
+Пометки снимаются до расчёта, поэтому подписка, сделанная во время
+него, оставит строку устаревшей до следующего запуска. Показ — одно
+чтение из кеша (при промахе строка по первичному ключу), из которого
+выбрасываются авторы, на которых пользователь уже подписан.
+"""
+import heapq
+import json
+from array import array
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .follows import BULK_BATCH_SIZE, get_following
+from .models import Follow, FollowSuggestion, Post, User
+
+SUGGESTIONS_COUNT = 20
+SUGGESTIONS_SHOWN = 5
+SUGGESTIONS_CACHE_SEC = 60 * 60
+# Вклад популярного автора группы относительно одного общего знакомого
+GROUP_WEIGHT = 0.5
+GROUP_TOP_AUTHORS = 20
+# Подписки «хабов» с огромным числом подписок почти ничего не говорят
+# о вкусе и делают строку A·A дорогой
+MAX_FANOUT = 5000
+
+
+def suggestions_key(user_id: int) -> str:
+    return f'suggestions:{user_id}'
+
+
+class FollowGraph:
+    """Матрица подписок в CSR: строка — подписчик, столбец — автор."""
+
+    def __init__(self, pairs):
+        # pairs — (подписчик, автор), отсортированные по подписчику
+        followers_column = array('I')
+        authors_column = array('I')
+        for user_id, author_id in pairs:
+            followers_column.append(user_id)
+            authors_column.append(author_id)
+        # Номера строк и столбцов идут в порядке id, поэтому строки
+        # отсортированных пар уже лежат подряд
+        self.ids = array(
+            'I', sorted(set(followers_column) | set(authors_column))
+        )
+        self.index = {user_id: node for node, user_id in enumerate(self.ids)}
+        self.indptr = array('L', [0]) * (len(self.ids) + 1)
+        for user_id in followers_column:
+            self.indptr[self.index[user_id] + 1] += 1
+        for node in range(len(self.ids)):
+            self.indptr[node + 1] += self.indptr[node]
+        self.indices = array(
+            'I', (self.index[author_id] for author_id in authors_column)
+        )
+        self.followers = array('I', [0]) * len(self.ids)
+        for column in self.indices:
+            self.followers[column] += 1
+
+    def row(self, node: int):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def friends_of_friends(self, node: int) -> dict:
+        """Строка A·A: номер столбца -> число общих знакомых."""
+        scores = defaultdict(float)
+        for middle in self.row(node):
+            row = self.row(middle)
+            if len(row) > MAX_FANOUT:
+                continue
+            for candidate in row:
+                scores[candidate] += 1
+        return scores
+
+
+def load_graph() -> FollowGraph:
+    return FollowGraph(
+        Follow.objects.order_by('user_id', 'author_id').values_list(
+            'user_id', 'author_id'
+        ).iterator()
+    )
+
+
+def group_candidates(graph: FollowGraph) -> tuple:
+    """Группы пользователей и популярные авторы каждой группы.
+
+    Популярность — доля подписчиков автора от самого популярного
+    автора группы, от 0 до 1.
+    """
+    user_groups = defaultdict(set)
+    group_authors = defaultdict(set)
+    for author_id, group_id in Post.objects.filter(
+        group__isnull=False
+    ).values_list('author_id', 'group_id').distinct().iterator():
+        user_groups[author_id].add(group_id)
+        group_authors[group_id].add(author_id)
+    popular = {}
+    for group_id, authors in group_authors.items():
+        ranked = heapq.nlargest(
+            GROUP_TOP_AUTHORS,
+            ((graph.followers[graph.index[author_id]], author_id)
+             for author_id in authors if author_id in graph.index),
+        )
+        top = ranked[0][0] if ranked else 0
+        popular[group_id] = [
+            (author_id, count / top) for count, author_id in ranked if count
+        ]
+    return user_groups, popular
+
+
+def score_user(graph: FollowGraph, user_id: int, groups: set,
+               popular: dict) -> list:
+    """id лучших кандидатов для пользователя по убыванию оценки."""
+    scores = defaultdict(float)
+    followed = {user_id}
+    node = graph.index.get(user_id)
+    if node is not None:
+        # Ключи — id пользователей, а не номера столбцов матрицы
+        for column, score in graph.friends_of_friends(node).items():
+            scores[graph.ids[column]] = score
+        followed.update(graph.ids[column] for column in graph.row(node))
+    for group_id in groups:
+        for author_id, share in popular.get(group_id, ()):
+            scores[author_id] += GROUP_WEIGHT * share
+    best = heapq.nlargest(
+        SUGGESTIONS_COUNT,
+        ((author_id, score) for author_id, score in scores.items()
+         if author_id not in followed),
+        key=lambda item: (item[1], -item[0]),
+    )
+    return [author_id for author_id, _ in best]
+
+
+def compute_suggestions(user_ids=None) -> dict:
+    """Рекомендации для user_ids или для всех, у кого есть данные."""
+    graph = load_graph()
+    user_groups, popular = group_candidates(graph)
+    if user_ids is None:
+        user_ids = set(graph.index) | set(user_groups)
+    return {
+        user_id: score_user(
+            graph, user_id, user_groups.get(user_id, ()), popular
+        )
+        for user_id in user_ids
+    }
+
+
+def store_suggestions(suggestions: dict, replace_all: bool = False) -> None:
+    """Записывает рекомендации в таблицу и сразу в кеш."""
+    author_ids = {
+        author_id for authors in suggestions.values() for author_id in authors
+    }
+    usernames = {}
+    author_ids = sorted(author_ids)
+    for start in range(0, len(author_ids), BULK_BATCH_SIZE):
+        usernames.update(User.objects.filter(
+            id__in=author_ids[start:start + BULK_BATCH_SIZE]
+        ).values_list('id', 'username'))
+    values = {
+        user_id: [
+            [author_id, usernames[author_id]]
+            for author_id in authors if author_id in usernames
+        ]
+        for user_id, authors in suggestions.items()
+    }
+    user_ids = sorted(values)
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+            batch = user_ids[start:start + BULK_BATCH_SIZE]
+            # Строки правятся, а не пересоздаются: пометку stale, которую
+            # поставила подписка во время расчёта, трогать нельзя
+            existing = set(FollowSuggestion.objects.filter(
+                user_id__in=batch
+            ).values_list('user_id', flat=True))
+            FollowSuggestion.objects.bulk_create([
+                FollowSuggestion(
+                    user_id=user_id, authors=json.dumps(values[user_id])
+                )
+                for user_id in batch if user_id not in existing
+            ], ignore_conflicts=True)
+            FollowSuggestion.objects.bulk_update([
+                FollowSuggestion(
+                    user_id=user_id, authors=json.dumps(values[user_id]),
+                    computed=now,
+                )
+                for user_id in batch if user_id in existing
+            ], ['authors', 'computed'])
+        if replace_all:
+            # Пользователи, для которых расчёту нечего сказать
+            FollowSuggestion.objects.filter(
+                computed__lt=now, stale=False
+            ).delete()
+    for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+        cache.set_many(
+            {suggestions_key(user_id): values[user_id]
+             for user_id in user_ids[start:start + BULK_BATCH_SIZE]},
+            SUGGESTIONS_CACHE_SEC,
+        )
+
+
+def _claim_stale() -> list:
+    """Снимает пометки stale; возвращает id помеченных пользователей."""
+    with transaction.atomic():
+        user_ids = list(FollowSuggestion.objects.filter(
+            stale=True
+        ).values_list('user_id', flat=True))
+        for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+            FollowSuggestion.objects.filter(
+                user_id__in=user_ids[start:start + BULK_BATCH_SIZE]
+            ).update(stale=False)
+    return user_ids
+
+
+def _mark_stale(user_ids: list) -> None:
+    for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+        FollowSuggestion.objects.filter(
+            user_id__in=user_ids[start:start + BULK_BATCH_SIZE]
+        ).update(stale=True)
+
+
+def refresh_suggestions(stale_only: bool = False) -> int:
+    """Пересчитывает все или только устаревшие строки; их число."""
+    # Пометки снимаются до расчёта, который уже видит их подписки
+    claimed = _claim_stale()
+    if stale_only and not claimed:
+        return 0
+    try:
+        suggestions = compute_suggestions(claimed if stale_only else None)
+        store_suggestions(suggestions, replace_all=not stale_only)
+    except Exception:
+        _mark_stale(claimed)
+        raise
+    return len(suggestions)
+
+
+def get_suggestions(user_id: int, limit: int = SUGGESTIONS_SHOWN) -> list:
+    """Рекомендации для показа: [id, username] по убыванию оценки."""
+    key = suggestions_key(user_id)
+    authors = cache.get(key)
+    if authors is None:
+        row = FollowSuggestion.objects.filter(
+            user_id=user_id
+        ).values_list('authors', flat=True).first()
+        authors = json.loads(row) if row else []
+        cache.set(key, authors, SUGGESTIONS_CACHE_SEC)
+    # Подписки после расчёта отсекаются по графу в кеше, без SQL
+    following = get_following(user_id)
+    return [
+        author for author in authors if author[0] not in following
+    ][:limit]
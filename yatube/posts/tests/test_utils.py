@@ -0,0 +1,936 @@
+import pickle
+import threading
+import time
+from array import array
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db.models import Q
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.follows import (FollowSet, bulk_follow, bulk_unfollow, follow,
+                           follow_stats, following_ids, following_key,
+                           is_following, unfollow)
+from posts import heatmap, rollups, suggestions, trending, view_counts
+from posts.hll import REGISTERS, HyperLogLog
+from posts.models import (Comment, DailyAuthorActivity, DailyGroupActivity,
+                          Follow, FollowSuggestion, Group, Post, PostViews,
+                          SimilarPosts, User)
+from posts.records import decode_posts, encode_posts
+from posts.similar import refresh_similar, similar_ids, similar_posts
+from posts.suggestions import get_suggestions, refresh_suggestions
+from posts.trending import (HALF_LIFE_SEC, LOCK_KEY, SITE_SCOPE,
+                            TRENDING_CANDIDATES, decayed, group_scope,
+                            record_event, scope_key, trending_ids)
+from posts.utils import (follow_feed_key, group_feed_key, hydrate_posts,
+                         post_cache_key, posts_cacher)
+
+
+class SlowPosts:
+    """Список постов, который долго считается и помнит число расчётов."""
+
+    def __init__(self, post_ids):
+        self.post_ids = post_ids
+        self.evaluations = 0
+
+    def values_list(self, *fields, flat=False):
+        return self
+
+    def __getitem__(self, index):
+        return self
+
+    def count(self):
+        return len(self.post_ids)
+
+    def __iter__(self):
+        self.evaluations += 1
+        time.sleep(0.05)
+        return iter(self.post_ids)
+
+
+class PostsCacherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_single_flight_on_empty_cache(self):
+        """Пустой кеш пересчитывает только один из одновременных запросов"""
+        posts = SlowPosts([2, 1])
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    posts_cacher(posts, 'test_cache', 20)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(posts.evaluations, 1)
+        self.assertEqual(results, [[2, 1]] * 8)
+
+    def test_stale_value_served_while_recomputing(self):
+        """Пока другой воркер пересчитывает, отдаётся устаревшее значение"""
+        posts = SlowPosts([2, 1])
+        cache.set('test_cache', ([1], time.time() - 1, 0.01), 60)
+        cache.add('test_cache:lock', 1, 10)
+        self.assertEqual(posts_cacher(posts, 'test_cache', 20), [1])
+        self.assertEqual(posts.evaluations, 0)
+
+    def test_expired_value_recomputed_by_lock_holder(self):
+        posts = SlowPosts([2, 1])
+        cache.set('test_cache', ([1], time.time() - 1, 0.01), 60)
+        self.assertEqual(posts_cacher(posts, 'test_cache', 20), [2, 1])
+        self.assertEqual(posts_cacher(posts, 'test_cache', 20), [2, 1])
+        self.assertEqual(posts.evaluations, 1)
+
+
+class FeedCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {number}', author=cls.author, group=cls.group
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.follower)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_hydration_single_query_for_misses(self):
+        """Промахи догружаются одним запросом, потом — без запросов"""
+        post_ids = [post.id for post in reversed(self.posts)]
+        with self.assertNumQueries(1):
+            first = hydrate_posts(post_ids)
+        with self.assertNumQueries(0):
+            second = hydrate_posts(post_ids)
+        self.assertEqual(first, list(reversed(self.posts)))
+        self.assertEqual(second, first)
+
+    @patch('posts.utils.NUMBER_OF_POSTS', 1)
+    @patch('posts.utils.MAX_CACHED_IDS', 2)
+    def test_long_feed_caches_first_pages(self):
+        """В кеше только начало ленты, дальние страницы — из БД"""
+        url = reverse('posts:group_list', args=[self.group.slug])
+        response = self.client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 3)
+        cached = cache.get(group_feed_key(self.group.id))[0]
+        self.assertEqual(cached, [self.posts[2].id, self.posts[1].id])
+        self.assertEqual(cached.total, 3)
+        response = self.client.get(url, {'page': 3})
+        self.assertEqual(
+            [post.id for post in response.context['page_obj']],
+            [self.posts[0].id],
+        )
+
+    def test_edit_touches_one_entry(self):
+        post = self.posts[0]
+        with patch.object(
+            caches['default'], 'delete_many',
+            wraps=caches['default'].delete_many,
+        ) as delete_many:
+            post.text = 'Изменённый текст'
+            post.save()
+        delete_many.assert_called_once_with([post_cache_key(post.id)])
+
+    def test_new_post_in_cached_feeds(self):
+        """Новый пост сразу появляется в ленте группы, автора и подписок"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        urls = [
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:follow_index'),
+        ]
+        for url in urls:
+            self.client.get(url)
+        post = Post.objects.create(
+            text='Свежий пост', author=self.author, group=self.group
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.context['page_obj'][0], post)
+
+    def test_new_post_keeps_follow_feed_keys(self):
+        """Ленты подписчиков не удаляются по одной, а сверяются с отметкой"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        url = reverse('posts:follow_index')
+        self.client.get(url)
+        with patch.object(
+            caches['default'], 'delete_many',
+            wraps=caches['default'].delete_many,
+        ) as delete_many:
+            post = Post.objects.create(text='Свежий пост', author=self.author)
+        deleted = [key for call in delete_many.call_args_list
+                   for key in call[0][0]]
+        self.assertNotIn(follow_feed_key(self.follower.id), deleted)
+        self.assertIsNotNone(cache.get(follow_feed_key(self.follower.id)))
+        response = self.client.get(url)
+        self.assertEqual(response.context['page_obj'][0], post)
+
+
+# TestCase не фиксирует транзакции, поэтому правки кеша после фиксации
+# выполняются сразу
+run_on_commit_now = patch(
+    'django.db.transaction.on_commit', lambda func: func()
+)
+
+
+@run_on_commit_now
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.authors = [
+            User.objects.create_user(username=f'author{number}')
+            for number in range(3)
+        ]
+        Follow.objects.create(user=cls.user, author=cls.authors[1])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_membership_without_queries(self):
+        """После загрузки подписки проверяются без запросов к БД"""
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                following_ids(self.user.id), [self.authors[1].id]
+            )
+        with self.assertNumQueries(0):
+            self.assertTrue(is_following(self.user.id, self.authors[1].id))
+            self.assertFalse(is_following(self.user.id, self.authors[0].id))
+
+    def test_follow_and_unfollow_update_graph(self):
+        """Подписка и отписка правят загруженный граф на месте"""
+        following_ids(self.user.id)
+        author = self.authors[2]
+        self.client.get(
+            reverse('posts:profile_follow', args=[author.username])
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                following_ids(self.user.id),
+                sorted([self.authors[1].id, author.id]),
+            )
+        self.client.get(
+            reverse('posts:profile_unfollow', args=[author.username])
+        )
+        with self.assertNumQueries(0):
+            self.assertFalse(is_following(self.user.id, author.id))
+
+    def test_follow_keeps_update_from_other_worker(self):
+        """Подписка правит набор из общего кеша, а не устаревший L1"""
+        following_ids(self.user.id)
+        # Другой воркер уже добавил подписку, L1 этого о ней не знает
+        cache.l2.set(following_key(self.user.id), FollowSet(array(
+            'I', sorted([self.authors[0].id, self.authors[1].id])
+        )).to_bytes())
+        follow(self.user.id, self.authors[2].id)
+        self.assertEqual(
+            following_ids(self.user.id),
+            sorted(author.id for author in self.authors),
+        )
+
+    def test_follow_without_lock_drops_graph(self):
+        """Не дождавшись блокировки, подписка сбрасывает набор"""
+        following_ids(self.user.id)
+        cache.add(following_key(self.user.id) + ':lock', 1)
+        follow(self.user.id, self.authors[2].id)
+        self.assertIsNone(cache.get(following_key(self.user.id)))
+        cache.touch(following_key(self.user.id) + ':lock', 0)
+        self.assertEqual(
+            following_ids(self.user.id),
+            sorted([self.authors[1].id, self.authors[2].id]),
+        )
+
+    def test_follow_set_round_trip(self):
+        ids = list(range(2, 200, 2))
+        follow_set = FollowSet.from_bytes(
+            FollowSet(array('I', ids)).to_bytes()
+        )
+        for author_id in ids:
+            self.assertIn(author_id, follow_set)
+        misses = [
+            author_id for author_id in range(1, 200, 2)
+            if author_id in follow_set
+        ]
+        self.assertEqual(misses, [])
+
+
+@run_on_commit_now
+class FollowWriteTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.authors = [
+            User.objects.create_user(username=f'author{number}')
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_follow_is_idempotent(self):
+        """Повторная подписка не создаёт строку и не меняет счётчики"""
+        author = self.authors[0]
+        self.assertTrue(follow(self.user.id, author.id))
+        self.assertFalse(follow(self.user.id, author.id))
+        self.assertFalse(follow(self.user.id, self.user.id))
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(follow_stats(self.user.id), (0, 1))
+        self.assertEqual(follow_stats(author.id), (1, 0))
+
+    def test_stale_graph_repaired_from_rowcount(self):
+        """Граф, отставший от БД, не мешает отписаться и чинится"""
+        author = self.authors[0]
+        following_ids(self.user.id)
+        # Подписка из другого воркера: в графе этого её нет
+        Follow.objects.bulk_create([Follow(user=self.user, author=author)])
+        self.assertFalse(is_following(self.user.id, author.id))
+        self.assertFalse(follow(self.user.id, author.id))
+        self.assertTrue(is_following(self.user.id, author.id))
+        self.assertTrue(unfollow(self.user.id, author.id))
+        # И наоборот: граф помнит подписку, которой в БД уже нет
+        cache.set(
+            following_key(self.user.id),
+            FollowSet(array('I', [author.id])).to_bytes(),
+        )
+        self.assertFalse(unfollow(self.user.id, author.id))
+        self.assertFalse(is_following(self.user.id, author.id))
+
+    def test_unfollow_with_stale_empty_graph_deletes(self):
+        author = self.authors[0]
+        following_ids(self.user.id)
+        Follow.objects.bulk_create([Follow(user=self.user, author=author)])
+        self.assertTrue(unfollow(self.user.id, author.id))
+        self.assertFalse(Follow.objects.filter(user=self.user).exists())
+
+    def test_unfollow_updates_counters(self):
+        author = self.authors[0]
+        follow(self.user.id, author.id)
+        self.assertTrue(unfollow(self.user.id, author.id))
+        self.assertFalse(Follow.objects.filter(user=self.user).exists())
+        self.assertEqual(follow_stats(author.id), (0, 0))
+
+    def test_bulk_follow_and_unfollow(self):
+        """Импорт пропускает дубли, себя и неизвестных пользователей"""
+        follow(self.user.id, self.authors[0].id)
+        pairs = [(self.user.id, author.id) for author in self.authors]
+        pairs += [
+            (self.user.id, self.user.id),
+            (self.user.id, self.authors[1].id),
+            (self.user.id, 10 ** 6),
+            (self.authors[0].id, self.authors[1].id),
+        ]
+        self.assertEqual(bulk_follow(pairs), 3)
+        self.assertEqual(
+            following_ids(self.user.id),
+            sorted(author.id for author in self.authors),
+        )
+        self.assertEqual(follow_stats(self.user.id), (0, 3))
+        self.assertEqual(follow_stats(self.authors[1].id), (2, 0))
+        self.assertEqual(bulk_unfollow(pairs), 4)
+        self.assertEqual(Follow.objects.count(), 0)
+        self.assertEqual(follow_stats(self.user.id), (0, 0))
+        self.assertEqual(follow_stats(self.authors[1].id), (0, 0))
+
+
+class SuggestionsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.users = {
+            name: User.objects.create_user(username=name)
+            for name in ('reader', 'friend', 'other', 'star', 'niche', 'poet')
+        }
+        for user, author in (
+            ('reader', 'friend'), ('reader', 'other'),
+            ('friend', 'star'), ('friend', 'niche'), ('other', 'star'),
+            ('niche', 'poet'),
+        ):
+            follow(cls.users[user].id, cls.users[author].id)
+        group = Group.objects.create(
+            title='Стихи', slug='poems', description='Стихи'
+        )
+        for name in ('reader', 'poet'):
+            Post.objects.create(
+                text='Стихотворение', author=cls.users[name], group=group
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def usernames(self, name: str) -> list:
+        return [
+            username
+            for _, username in get_suggestions(self.users[name].id, 10)
+        ]
+
+    def test_friends_of_friends_ranked(self):
+        """Больше общих знакомых — выше, авторы групп — после них"""
+        refresh_suggestions()
+        with self.assertNumQueries(1):
+            # Граф подписок ещё не в кеше, рекомендации — уже там
+            self.assertEqual(
+                self.usernames('reader'), ['star', 'niche', 'poet']
+            )
+
+    def test_served_from_cache_without_queries(self):
+        refresh_suggestions()
+        self.usernames('reader')
+        with self.assertNumQueries(0):
+            self.usernames('reader')
+
+    def test_follow_marks_stale_and_hides_author(self):
+        """Новая подписка сразу скрыта, строки помечены к пересчёту"""
+        refresh_suggestions()
+        follow(self.users['reader'].id, self.users['star'].id)
+        self.assertEqual(self.usernames('reader'), ['niche', 'poet'])
+        self.assertEqual(
+            set(FollowSuggestion.objects.filter(
+                stale=True
+            ).values_list('user__username', flat=True)),
+            {'reader'},
+        )
+        self.assertEqual(refresh_suggestions(stale_only=True), 1)
+        self.assertFalse(FollowSuggestion.objects.filter(stale=True).exists())
+
+    def test_follow_during_refresh_stays_stale(self):
+        """Подписка во время расчёта не теряет пометку stale"""
+        refresh_suggestions()
+        reader = self.users['reader']
+        follow(reader.id, self.users['star'].id)
+        compute = suggestions.compute_suggestions
+
+        def compute_and_follow(user_ids=None):
+            result = compute(user_ids)
+            follow(reader.id, self.users['poet'].id)
+            return result
+
+        with patch.object(suggestions, 'compute_suggestions',
+                          compute_and_follow):
+            refresh_suggestions(stale_only=True)
+        self.assertTrue(FollowSuggestion.objects.get(user=reader).stale)
+
+    def test_new_user_gets_row_on_follow(self):
+        """У нового пользователя строки нет, --stale всё равно его считает"""
+        refresh_suggestions()
+        newcomer = User.objects.create_user(username='newcomer')
+        for name in ('friend', 'other'):
+            follow(newcomer.id, self.users[name].id)
+        self.assertTrue(
+            FollowSuggestion.objects.get(user=newcomer).stale
+        )
+        refresh_suggestions(stale_only=True)
+        self.assertFalse(FollowSuggestion.objects.get(user=newcomer).stale)
+        self.assertEqual(get_suggestions(newcomer.id)[0][1], 'star')
+
+
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {number}', author=cls.author, group=cls.group
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        trending.reset()
+        view_counts.reset()
+
+    def tearDown(self):
+        cache.clear()
+        trending.reset()
+        view_counts.reset()
+
+    def test_old_activity_decays(self):
+        """Четыре старых события равны одному свежему через 2 периода"""
+        now = 10 ** 9
+        old, fresh = self.posts[0], self.posts[1]
+        for _ in range(4):
+            old_score = record_event(
+                old.id, None, 1.0, 'view', now - 2 * HALF_LIFE_SEC
+            )
+        fresh_score = record_event(fresh.id, None, 1.0, 'view', now)
+        self.assertAlmostEqual(decayed(old_score, now), 1.0)
+        self.assertAlmostEqual(decayed(fresh_score, now), 1.0)
+        record_event(fresh.id, None, 1.0, 'view', now)
+        self.assertEqual(trending_ids(), [fresh.id, old.id])
+
+    def test_candidates_bounded(self):
+        for post_id in range(1, TRENDING_CANDIDATES + 11):
+            record_event(post_id, None, float(post_id), 'view', 0)
+        ids = trending_ids(limit=TRENDING_CANDIDATES + 10)
+        self.assertEqual(len(ids), TRENDING_CANDIDATES)
+        self.assertEqual(ids[0], TRENDING_CANDIDATES + 10)
+        self.assertNotIn(1, ids)
+
+    def test_comment_and_view_feed_site_and_group(self):
+        """Комментарий весит больше просмотра; пост попадает и в группу"""
+        viewed, commented = self.posts[0], self.posts[1]
+        self.client.get(reverse('posts:post_detail', args=[viewed.id]))
+        view_counts.flush()
+        Comment.objects.create(
+            post=commented, author=self.author, text='Комментарий'
+        )
+        for scope in (SITE_SCOPE, group_scope(self.group.id)):
+            with self.subTest(scope=scope):
+                self.assertEqual(
+                    trending_ids(scope), [commented.id, viewed.id]
+                )
+
+    def test_views_applied_on_flush(self):
+        """Просмотры попадают в популярное только при сбросе"""
+        post = self.posts[0]
+        for _ in range(3):
+            self.client.get(reverse('posts:post_detail', args=[post.id]))
+        self.assertEqual(trending_ids(), [])
+        with self.assertNumQueries(1):
+            self.assertEqual(trending.flush(), 1)
+        self.assertEqual(trending_ids(), [post.id])
+        self.assertAlmostEqual(
+            decayed(cache.get(trending.post_score_key(post.id))), 3.0,
+            places=3,
+        )
+
+    def test_other_worker_candidates_kept(self):
+        """Набор читается мимо L1: записи другого воркера не теряются"""
+        first, second = self.posts[0], self.posts[1]
+        record_event(first.id, None, 1.0, 'view')
+        trending_ids()
+        # Другой воркер дописал пост в общий кеш, L1 этого ещё старый
+        candidates = cache.l2.get(scope_key(SITE_SCOPE))
+        candidates[second.id] = candidates[first.id] + 1
+        cache.l2.set(scope_key(SITE_SCOPE), candidates)
+        record_event(self.posts[2].id, None, 1.0, 'view')
+        candidates = cache.l2.get(scope_key(SITE_SCOPE))
+        self.assertCountEqual(candidates, [post.id for post in self.posts])
+
+    def test_busy_lock_defers_event(self):
+        """Пока наборы правит другой воркер, событие ждёт сброса"""
+        post = self.posts[0]
+        cache.add(LOCK_KEY, 1)
+        self.assertIsNone(record_event(post.id, None, 1.0, 'comment'))
+        self.assertEqual(trending_ids(), [])
+        cache.touch(LOCK_KEY, 0)
+        trending.flush()
+        self.assertEqual(trending_ids(), [post.id])
+
+    def test_deleted_post_skipped_on_flush(self):
+        post = Post.objects.create(text='Удалю', author=self.author)
+        post_id = post.id
+        trending.record_view(post)
+        post.delete()
+        # Просмотр, пришедший в воркер, который не видел удаления
+        trending.record_view(Post(id=post_id))
+        self.assertEqual(trending.flush(), 0)
+        self.assertEqual(trending_ids(), [])
+
+    def test_moved_post_leaves_old_group(self):
+        other = Group.objects.create(
+            title='Другая группа', slug='other-slug', description='Описание'
+        )
+        post = self.posts[0]
+        record_event(post.id, self.group.id, 1.0, 'view')
+        post.group = other
+        post.save()
+        self.assertEqual(trending_ids(group_scope(self.group.id)), [])
+        self.assertEqual(trending_ids(group_scope(other.id)), [post.id])
+        trending.record_view(post)
+        trending.flush()
+        self.assertEqual(trending_ids(group_scope(self.group.id)), [])
+
+    def test_trending_page_from_cache(self):
+        record_event(self.posts[2].id, self.group.id, 1.0, 'view')
+        url = reverse('posts:trending')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(list(response.context['page_obj']), [self.posts[2]])
+
+
+@patch.object(view_counts, 'FLUSH_INTERVAL_SEC', 3600)
+class ViewCountsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(text='Пост', author=author)
+
+    def setUp(self):
+        cache.clear()
+        view_counts.reset()
+
+    def tearDown(self):
+        cache.clear()
+        view_counts.reset()
+
+    def test_views_counted_in_memory(self):
+        """Просмотр не пишет в БД, но сразу виден при чтении"""
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                view_counts.count_view(self.post.id)
+        self.assertEqual(view_counts.view_counts([self.post.id]), {
+            self.post.id: 3
+        })
+        self.assertFalse(PostViews.objects.exists())
+
+    def test_flush_upserts_and_keeps_total(self):
+        view_counts.count_view(self.post.id)
+        view_counts.view_counts([self.post.id])
+        self.assertEqual(view_counts.flush(), 1)
+        view_counts.count_view(self.post.id)
+        self.assertEqual(view_counts.flush(), 1)
+        self.assertEqual(
+            PostViews.objects.get(post=self.post).views, 2
+        )
+        # Кешированная сумма поправлена при сбросе, а не удалена
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                view_counts.view_counts([self.post.id])[self.post.id], 2
+            )
+
+    def test_flush_after_max_views(self):
+        with patch.object(view_counts, 'FLUSH_MAX_VIEWS', 2):
+            view_counts.count_view(self.post.id)
+            self.assertFalse(PostViews.objects.exists())
+            view_counts.count_view(self.post.id)
+        self.assertEqual(PostViews.objects.get(post=self.post).views, 2)
+
+    def test_failed_flush_keeps_pending(self):
+        view_counts.count_view(self.post.id)
+        with patch.object(
+            view_counts, '_write', side_effect=DatabaseError
+        ), self.assertLogs('yatube.views', 'ERROR'):
+            self.assertEqual(view_counts.flush(), 0)
+        self.assertEqual(view_counts.flush(), 1)
+        self.assertEqual(PostViews.objects.get(post=self.post).views, 1)
+
+    @patch.object(view_counts, 'FLUSH_MAX_VIEWS', 1)
+    def test_failed_flush_backs_off(self):
+        """После неудачного сброса просмотры не ждут БД каждый раз"""
+        with patch.object(
+            view_counts, '_write', side_effect=DatabaseError
+        ) as write, self.assertLogs('yatube.views', 'ERROR'):
+            for _ in range(3):
+                view_counts.count_view(self.post.id)
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(view_counts.view_counts([self.post.id]),
+                         {self.post.id: 3})
+
+    def test_deleted_post_does_not_block_flush(self):
+        """Просмотры удалённого поста не ломают сброс остальных"""
+        post = Post.objects.create(text='Пост', author=self.post.author)
+        view_counts.count_view(self.post.id, 'user:1', self.post.author_id)
+        view_counts.count_view(post.id, 'user:1', post.author_id)
+        post_id = post.id
+        post.delete()
+        self.assertEqual(view_counts.view_counts([post_id]), {post_id: 0})
+        # Просмотр, начатый до удаления, учтён уже после него
+        view_counts.count_view(post_id, 'user:2', self.post.author_id)
+        self.assertEqual(view_counts.flush(), 1)
+        view_counts.count_view(self.post.id)
+        self.assertEqual(view_counts.flush(), 1)
+        self.assertEqual(PostViews.objects.get(post=self.post).views, 2)
+        self.assertFalse(PostViews.objects.filter(post_id=post_id).exists())
+
+    def test_unique_viewers_merged_on_flush(self):
+        """Скетчи поста и автора копятся в памяти и сливаются при сбросе"""
+        for viewer in ('user:1', 'user:2', 'user:1'):
+            view_counts.count_view(self.post.id, viewer, self.post.author_id)
+        self.assertEqual(view_counts.post_viewers(self.post.id).count(), 2)
+        view_counts.flush()
+        view_counts.count_view(self.post.id, 'user:3', self.post.author_id)
+        view_counts.flush()
+        self.assertEqual(view_counts.post_viewers(self.post.id).count(), 3)
+        self.assertEqual(
+            view_counts.author_viewers(self.post.author_id).count(), 3
+        )
+
+    def test_group_viewers_merge_posts(self):
+        group = Group.objects.create(
+            title='Группа', slug='group', description='Группа'
+        )
+        posts = [
+            Post.objects.create(text='Пост', author=self.post.author,
+                                group=group)
+            for _ in range(2)
+        ]
+        view_counts.count_view(posts[0].id, 'user:1')
+        view_counts.count_view(posts[1].id, 'user:1')
+        view_counts.flush()
+        view_counts.count_view(posts[1].id, 'user:2')
+        view_counts.count_view(self.post.id, 'user:3')
+        self.assertEqual(view_counts.group_viewers(group.id).count(), 2)
+
+    def test_post_detail_shows_views(self):
+        url = reverse('posts:post_detail', args=[self.post.id])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.context['post'].views, 2)
+
+
+class HyperLogLogTests(TestCase):
+    def test_estimate_within_error(self):
+        sketch = HyperLogLog()
+        for value in range(20000):
+            sketch.add(value)
+        self.assertAlmostEqual(sketch.count(), 20000, delta=20000 * 0.07)
+
+    def test_merge_is_union(self):
+        """Слияние пересекающихся скетчей оценивает объединение"""
+        first, second = HyperLogLog(), HyperLogLog()
+        for value in range(3000):
+            first.add(value)
+            second.add(value + 1500)
+        merged = HyperLogLog(first.to_bytes()).merge(second)
+        self.assertAlmostEqual(merged.count(), 4500, delta=4500 * 0.07)
+        self.assertEqual(len(merged.to_bytes()), REGISTERS)
+
+    def test_wrong_size_rejected(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(b'\x00' * 10)
+
+
+class FeedRecordsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='auth', first_name='Лев', last_name='Толстой'
+        )
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.user, group=cls.group,
+            image='posts/small.gif',
+        )
+
+    def test_round_trip_keeps_template_fields(self):
+        """После кеша пост выглядит для шаблона так же, как модель"""
+        post = Post.objects.select_related('author', 'group').get()
+        [record] = decode_posts(encode_posts([post]))
+        self.assertEqual(record, post)
+        self.assertEqual(record.text, post.text)
+        self.assertEqual(record.pub_date, post.pub_date)
+        self.assertEqual(record.image, post.image)
+        self.assertEqual(record.author.get_full_name(), 'Лев Толстой')
+        self.assertEqual(record.author.username, 'auth')
+        self.assertEqual(record.group.slug, 'test-slug')
+
+    def test_smaller_than_pickle(self):
+        posts = list(Post.objects.select_related('author', 'group'))
+        self.assertLess(
+            len(encode_posts(posts)), len(pickle.dumps(posts, -1)) / 2
+        )
+
+
+class ActivityRollupsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа', slug='other-slug',
+            description='Тестовое описание',
+        )
+
+    @staticmethod
+    def snapshot():
+        return (
+            sorted(DailyAuthorActivity.objects.filter(
+                Q(posts__gt=0) | Q(comments__gt=0)
+            ).values_list('day', 'author', 'posts', 'comments')),
+            sorted(DailyGroupActivity.objects.filter(
+                Q(posts__gt=0) | Q(comments__gt=0)
+            ).values_list('day', 'group', 'posts', 'comments')),
+        )
+
+    def test_incremental_matches_backfill(self):
+        """Сводки после правок совпадают с пересчётом с нуля"""
+        posts = [
+            Post.objects.create(text=f'Пост {number}', author=self.user,
+                                group=self.group if number % 2 else None)
+            for number in range(4)
+        ]
+        Post.objects.filter(pk=posts[0].pk).update(
+            pub_date=timezone.now() - timedelta(days=3)
+        )
+        posts[0].refresh_from_db()
+        # Правка в обход сигналов — как раз случай для backfill
+        rollups.backfill()
+        Comment.objects.create(post=posts[0], author=self.reader, text='Да')
+        Comment.objects.create(post=posts[1], author=self.reader, text='Да')
+        posts[1].group = self.other_group
+        posts[1].save()
+        posts[2].delete()
+        Comment.objects.filter(post=posts[0]).delete()
+        incremental = self.snapshot()
+        rollups.backfill()
+        self.assertEqual(self.snapshot(), incremental)
+        self.assertEqual(
+            DailyGroupActivity.objects.get(group=self.other_group).comments,
+            1,
+        )
+
+    def test_moving_average_and_growth(self):
+        values = [0, 2, 4, 6, 2, 2]
+        self.assertEqual(
+            rollups.moving_average(values, 2), [0, 1, 3, 5, 4, 2]
+        )
+        self.assertEqual(rollups.growth(values, 3), 2 / 3)
+        self.assertIsNone(rollups.growth([0, 0, 5], 1))
+
+    def test_report_reads_only_rollups(self):
+        Post.objects.create(text='Пост', author=self.user, group=self.group)
+        out = StringIO()
+        with self.assertNumQueries(2):
+            call_command('activity_report', '--by', 'group', stdout=out)
+        self.assertIn('test-slug', out.getvalue())
+
+
+class HeatmapTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_counts_follow_posts(self):
+        """Создание и удаление поста правят кеш, чтение без запросов"""
+        Post.objects.create(text='Пост', author=self.user)
+        self.assertEqual(heatmap.daily_counts(self.user.id)[-1], 1)
+        post = Post.objects.create(text='Пост', author=self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(heatmap.daily_counts(self.user.id)[-1], 2)
+        post.delete()
+        with self.assertNumQueries(0):
+            counts = heatmap.daily_counts(self.user.id)
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(len(counts), heatmap.HEATMAP_DAYS)
+
+    def test_new_day_shifts_without_queries(self):
+        Post.objects.create(text='Пост', author=self.user)
+        counts = heatmap.daily_counts(self.user.id)
+        yesterday = timezone.localdate() - timedelta(days=1)
+        cache.set(heatmap.heatmap_key(self.user.id), (yesterday, counts))
+        with self.assertNumQueries(0):
+            shifted = heatmap.daily_counts(self.user.id)
+        self.assertEqual(shifted[-2:], bytes([1, 0]))
+
+    def test_weeks_cover_period(self):
+        today = timezone.localdate()
+        weeks = heatmap.heatmap_weeks(bytes(heatmap.HEATMAP_DAYS), today)
+        days = [cell for week in weeks for cell in week if cell]
+        self.assertEqual(len(days), heatmap.HEATMAP_DAYS)
+        self.assertEqual(days[-1][0], today)
+        self.assertTrue(all(len(week) == 7 for week in weeks))
+        self.assertEqual(weeks[0][0] is None, days[0][0].weekday() > 0)
+
+
+class SimilarPostsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        texts = (
+            'Кошки любят рыбу и тёплые подоконники',
+            'Собаки любят долгие прогулки в парке',
+            'Рецепт ухи: рыба, картошка и лук',
+            'Прогулки в парке с собакой по утрам',
+        )
+        cls.posts = [
+            Post.objects.create(text=text, author=cls.user) for text in texts
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_nearest_shares_words(self):
+        refresh_similar()
+        cats, dogs, fish, walks = self.posts
+        self.assertEqual(similar_ids(dogs.pk)[0], walks.pk)
+        self.assertNotIn(cats.pk, similar_ids(cats.pk))
+
+    def test_new_posts_join_neighbors(self):
+        """--new считает только новые и дописывает их к соседям"""
+        refresh_similar()
+        post = Post.objects.create(
+            text='Собаки и прогулки в парке', author=self.user
+        )
+        self.assertEqual(refresh_similar(new_only=True), 1)
+        self.assertIn(post.pk, similar_ids(self.posts[1].pk))
+        cache.clear()
+        self.assertIn(post.pk, similar_ids(self.posts[1].pk))
+
+    def test_edit_marks_stale(self):
+        refresh_similar()
+        post = self.posts[0]
+        post.text = 'Уха из свежей рыбы'
+        post.save()
+        self.assertTrue(SimilarPosts.objects.get(post=post).stale)
+        self.assertEqual(refresh_similar(new_only=True), 1)
+        self.assertFalse(SimilarPosts.objects.get(post=post).stale)
+
+    def test_serving_is_lookup_and_one_query(self):
+        refresh_similar()
+        cache.clear()
+        post = self.posts[1]
+        with self.assertNumQueries(2):
+            shown = similar_posts(post.pk)
+        self.assertEqual(shown[0], self.posts[3])
+        with self.assertNumQueries(1):
+            similar_posts(post.pk)
@@ -7,6 +7,7 @@ from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from posts.follows import follow, followers_page
 from posts.models import Comment, Follow, Group, Post, User
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -106,6 +107,7 @@ class PostPagesTests(TestCase):
             reverse('posts:profile', kwargs={'username': 'auth_client'})))
         self.assertEqual(response.context.get('author'), self.user_author)
         self.assertEqual(response.context.get('page_obj')[0], self.post)
+        self.assertEqual(response.context.get('heatmap_total'), 1)
 
     def test_post_detail_show_correct_context(self):
         """Шаблон post_detail сформирован с правильным контекстом."""
@@ -184,6 +186,17 @@ class PostPagesTests(TestCase):
         # print(clear_response_content)
         self.assertNotEqual(content_response, clear_response_content)
 
+    def test_index_cache_dropped_on_edit(self):
+        """Изменённый пост сразу виден на главной"""
+        url_index = reverse('posts:index')
+        self.authorized_author_client.get(url_index)
+        self.authorized_author_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.id}),
+            data={'text': 'Изменённый текст', 'group': self.group.id},
+        )
+        response = self.authorized_author_client.get(url_index)
+        self.assertContains(response, 'Изменённый текст')
+
     def test_auth_user_follow(self):
         """Подписка на автора"""
         self.authorized_client.get(reverse(
@@ -215,3 +228,55 @@ class PostPagesTests(TestCase):
         )
         response = self.authorized_client.get(reverse('posts:follow_index'))
         self.assertQuerysetEqual(response.context.get('page_obj'), [])
+
+
+class FollowListTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.followers = [
+            User.objects.create_user(username=f'follower{number}')
+            for number in range(5)
+        ]
+        for follower in cls.followers:
+            follow(follower.id, cls.author.id)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_cover_all_followers(self):
+        """Курсор проходит всех подписчиков без повторов, новые первыми"""
+        seen = []
+        cursor = None
+        while True:
+            people, cursor = followers_page(self.author.id, cursor, limit=2)
+            seen.extend(people)
+            if cursor is None:
+                break
+        self.assertEqual(seen, list(reversed(self.followers)))
+
+    def test_json_page_query_count_independent_of_cursor(self):
+        """Глубокая страница стоит столько же запросов, сколько первая"""
+        url = reverse('posts:followers_json', args=[self.author.username])
+        with self.assertNumQueries(4):
+            first = self.client.get(url).json()
+        second_id = Follow.objects.filter(
+            author=self.author
+        ).order_by('id').values_list('id', flat=True)[1]
+        with self.assertNumQueries(4):
+            deep = self.client.get(url, {'after': second_id}).json()
+        self.assertEqual(first['count'], 5)
+        self.assertIsNone(first['next'])
+        self.assertEqual(
+            [person['username'] for person in deep['results']],
+            ['follower0'],
+        )
+
+    def test_following_page(self):
+        response = self.client.get(
+            reverse('posts:following', args=['follower0'])
+        )
+        self.assertTemplateUsed(response, 'posts/follow_list.html')
+        self.assertEqual(response.context['people'], [self.author])
+        self.assertEqual(response.context['count'], 1)
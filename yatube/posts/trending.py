@@ -0,0 +1,257 @@
+"""Популярные посты с экспоненциальным затуханием активности.
+
+Вклад события весом w в момент t к моменту now равен
+w * exp(-(now - t) / TAU). Общий множитель exp(-now / TAU) одинаков
+для всех постов и на порядок не влияет, поэтому хранится логарифм
+суммы sum(w * exp(t / TAU)). Новое событие добавляется к нему через
+logaddexp за O(1), без пересчёта истории и без переполнения.
+
+Оценки постов обновляют ограниченные наборы лучших кандидатов сайта
+и группы поста: не больше TRENDING_CANDIDATES записей, при
+переполнении выбрасывается худшая. Страница популярного — одно
+чтение набора из кеша и сортировка пары сотен чисел.
+
+Просмотр только копится в памяти воркера и попадает в наборы вместе
+со сбросом просмотров (posts.view_counts): одно обновление на пачку,
+группы постов берутся из БД на момент сброса, удалённые посты
+пропускаются. Комментарий обновляет наборы сразу. Наборы — общие
+словари в кеше, поэтому чтение и запись идут под блокировкой
+cache.add и мимо L1 процесса. Не дождавшись блокировки, событие
+остаётся в очереди до следующего сброса.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from core import metrics
+
+from .models import Post
+
+HALF_LIFE_SEC = 6 * 60 * 60
+TAU = HALF_LIFE_SEC / math.log(2)
+VIEW_WEIGHT = 1.0
+COMMENT_WEIGHT = 5.0
+TRENDING_SIZE = 50
+TRENDING_CANDIDATES = 200
+# Через десять периодов полураспада вклад меньше тысячной
+TRENDING_SEC = 10 * HALF_LIFE_SEC
+SITE_SCOPE = 'site'
+LOCK_KEY = 'trending:lock'
+LOCK_SEC = 5
+LOCK_WAIT_SEC = 0.2
+LOCK_POLL_SEC = 0.01
+BATCH_SIZE = 400
+
+_lock = threading.Lock()
+# id поста -> log_add оценок несброшенных событий
+_pending = {}
+
+
+def group_scope(group_id: int) -> str:
+    return f'group:{group_id}'
+
+
+def scope_key(scope: str) -> str:
+    return f'trending:{scope}'
+
+
+def post_score_key(post_id: int) -> str:
+    return f'trending:post:{post_id}'
+
+
+def log_add(first: float, second: float) -> float:
+    """log(exp(first) + exp(second)) без переполнения."""
+    if first is None:
+        return second
+    high, low = max(first, second), min(first, second)
+    return high + math.log1p(math.exp(low - high))
+
+
+def event_score(weight: float, moment: float) -> float:
+    return math.log(weight) + moment / TAU
+
+
+def decayed(score: float, now: float = None) -> float:
+    """Сумма весов с затуханием на момент now — для показа и отладки."""
+    now = time.time() if now is None else now
+    return math.exp(score - now / TAU)
+
+
+def _shared():
+    # Под блокировкой читаем мимо L1: в нём может лежать набор, который
+    # другой воркер уже переписал
+    return getattr(cache, 'l2', cache)
+
+
+@contextmanager
+def _locked():
+    """Блокировка наборов; отдаёт False, если не дождались."""
+    deadline = time.monotonic() + LOCK_WAIT_SEC
+    acquired = cache.add(LOCK_KEY, 1, LOCK_SEC)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SEC)
+        acquired = cache.add(LOCK_KEY, 1, LOCK_SEC)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            # touch с нулевым сроком, а не delete: delete в LayeredCache
+            # сбрасывает L1 во всех воркерах
+            cache.touch(LOCK_KEY, 0)
+
+
+def _push(candidates: dict, post_id: int, score: float) -> None:
+    candidates[post_id] = score
+    if len(candidates) > TRENDING_CANDIDATES:
+        del candidates[min(candidates, key=candidates.get)]
+
+
+def _apply(events: dict):
+    """Добавляет события {id поста: (id группы, оценка)} к наборам.
+
+    Возвращает новые оценки постов или None, если блокировку занял
+    другой воркер.
+    """
+    with _locked() as acquired:
+        if not acquired:
+            return None
+        shared = _shared()
+        stored = shared.get_many([post_score_key(post_id)
+                                  for post_id in events])
+        scores = {
+            post_id: log_add(stored.get(post_score_key(post_id)), score)
+            for post_id, (_, score) in events.items()
+        }
+        keys = {scope_key(SITE_SCOPE)}
+        keys.update(
+            scope_key(group_scope(group_id))
+            for group_id, _ in events.values() if group_id is not None
+        )
+        sets = dict.fromkeys(keys)
+        sets.update(shared.get_many(list(keys)))
+        sets = {key: candidates or {} for key, candidates in sets.items()}
+        for post_id, (group_id, _) in events.items():
+            _push(sets[scope_key(SITE_SCOPE)], post_id, scores[post_id])
+            if group_id is not None:
+                _push(sets[scope_key(group_scope(group_id))],
+                      post_id, scores[post_id])
+        data = {post_score_key(post_id): score
+                for post_id, score in scores.items()}
+        data.update(sets)
+        cache.set_many(data, TRENDING_SEC)
+    return scores
+
+
+def _defer(post_id: int, score: float) -> None:
+    with _lock:
+        _pending[post_id] = log_add(_pending.get(post_id), score)
+
+
+def record_event(post_id: int, group_id: int, weight: float,
+                 kind: str, moment: float = None) -> float:
+    """Учитывает событие поста сразу; возвращает его новую оценку.
+
+    Если блокировка занята, событие откладывается до сброса, и
+    возвращается None.
+    """
+    moment = time.time() if moment is None else moment
+    score = event_score(weight, moment)
+    metrics.inc('trending_events_total', kind=kind)
+    scores = _apply({post_id: (group_id, score)})
+    if scores is None:
+        _defer(post_id, score)
+        return None
+    return scores[post_id]
+
+
+def record_view(post, moment: float = None) -> None:
+    """Откладывает просмотр до сброса просмотров."""
+    moment = time.time() if moment is None else moment
+    _defer(post.pk, event_score(VIEW_WEIGHT, moment))
+    metrics.inc('trending_events_total', kind='view')
+
+
+def record_comment(comment, moment: float = None) -> float:
+    post = comment.post
+    return record_event(
+        post.pk, post.group_id, COMMENT_WEIGHT, 'comment', moment
+    )
+
+
+def flush() -> int:
+    """Переносит отложенные события в наборы; возвращает число постов."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+    post_ids = sorted(pending)
+    groups = {}
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        groups.update(Post.objects.filter(
+            id__in=post_ids[start:start + BATCH_SIZE]
+        ).values_list('id', 'group_id'))
+    events = {
+        post_id: (groups[post_id], score)
+        for post_id, score in pending.items() if post_id in groups
+    }
+    if events and _apply(events) is None:
+        for post_id, (_, score) in events.items():
+            _defer(post_id, score)
+        return 0
+    return len(events)
+
+
+def _removed(scopes, post_id: int) -> dict:
+    """Наборы scopes, из которых пришлось убрать пост, уже без него."""
+    data = {}
+    for scope in scopes:
+        candidates = _shared().get(scope_key(scope))
+        if candidates and candidates.pop(post_id, None) is not None:
+            data[scope_key(scope)] = candidates
+    return data
+
+
+def forget_post(post_id: int, group_id: int = None) -> None:
+    """Убирает удалённый пост из наборов и очереди."""
+    with _lock:
+        _pending.pop(post_id, None)
+    scopes = [SITE_SCOPE]
+    if group_id is not None:
+        scopes.append(group_scope(group_id))
+    # Не дождавшись блокировки, всё равно правим: иначе пост остался
+    # бы в наборах, пока его не вытеснят
+    with _locked():
+        cache.set_many(_removed(scopes, post_id), TRENDING_SEC)
+
+
+def post_moved(post_id: int, old_group_id: int, group_id: int) -> None:
+    """Переносит пост из набора старой группы в набор новой."""
+    with _locked():
+        data = {}
+        if old_group_id is not None:
+            data = _removed([group_scope(old_group_id)], post_id)
+        score = _shared().get(post_score_key(post_id))
+        if group_id is not None and score is not None:
+            key = scope_key(group_scope(group_id))
+            candidates = _shared().get(key) or {}
+            _push(candidates, post_id, score)
+            data[key] = candidates
+        if data:
+            cache.set_many(data, TRENDING_SEC)
+
+
+def trending_ids(scope: str = SITE_SCOPE,
+                 limit: int = TRENDING_SIZE) -> list:
+    """id популярных постов, лучшие первыми; одно чтение кеша."""
+    candidates = cache.get(scope_key(scope)) or {}
+    return sorted(candidates, key=candidates.get, reverse=True)[:limit]
+
+
+def reset() -> None:
+    """Забывает отложенные события (используется в тестах)."""
+    with _lock:
+        _pending.clear()
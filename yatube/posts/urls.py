@@ -13,6 +13,13 @@ urlpatterns = [
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     # Просмотр записей группы
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
+    # Популярное на сайте и в группе
+    path('trending/', views.trending, name='trending'),
+    path(
+        'group/<slug:slug>/trending/',
+        views.trending,
+        name='group_trending'
+    ),
     # Создание поста
     path('create/', views.post_create, name='post_create'),
     # Редактирование поста
@@ -31,6 +38,29 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    # Подписчики автора и его подписки
+    path(
+        'profile/<str:username>/followers/',
+        views.followers,
+        name='followers'
+    ),
+    path(
+        'profile/<str:username>/followers.json',
+        views.followers,
+        {'as_json': True},
+        name='followers_json'
+    ),
+    path(
+        'profile/<str:username>/following/',
+        views.following,
+        name='following'
+    ),
+    path(
+        'profile/<str:username>/following.json',
+        views.following,
+        {'as_json': True},
+        name='following_json'
+    ),
     # Комментарий к посту
     path('posts/<int:post_id>/comment/', views.add_comment, name='add_comment')
 ]
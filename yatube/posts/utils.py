@@ -1,9 +1,38 @@
+import math
+import random
+import time
+
 from django.core.cache import cache
 from django.core.handlers.wsgi import WSGIRequest
 from django.core.paginator import Page, Paginator
 from django.db.models.query import QuerySet
 
+from core import metrics
+
+from .models import Post
+from .records import decode_post, encode_post
+from .view_counts import attach_view_counts
+
 NUMBER_OF_POSTS = 10
+INDEX_CACHE_KEY = 'index_posts_cache'
+# Ленты групп, авторов и подписок сбрасываются сигналами, поэтому
+# живут дольше главной
+FEED_CACHE_SEC = 60 * 10
+POST_CACHE_SEC = 60 * 60
+# Сколько секунд после истечения срока отдавать устаревший список,
+# пока его пересчитывает другой воркер
+STALE_SEC = 60
+# Сколько первых страниц ленты хранить в кеше списком id. Список всей
+# ленты на большой базе не влезет в слот общего кеша, а дальние
+# страницы читаются редко и берутся из БД
+CACHED_PAGES = 100
+MAX_CACHED_IDS = NUMBER_OF_POSTS * CACHED_PAGES
+# Срок блокировки пересчёта и ожидание результата при пустом кеше
+LOCK_SEC = 10
+LOCK_WAIT_SEC = 1
+LOCK_POLL_SEC = 0.02
+# Чем больше, тем раньше начинается досрочный пересчёт
+XFETCH_BETA = 1.0
 
 
 # Паджинанор
@@ -15,11 +44,208 @@ def pagination(request: WSGIRequest, posts_list: QuerySet) -> Page:
     return page_obj
 
 
+def group_feed_key(group_id: int) -> str:
+    return f'group_posts_cache:{group_id}'
+
+
+def profile_feed_key(author_id: int) -> str:
+    return f'profile_posts_cache:{author_id}'
+
+
+def follow_feed_key(user_id: int) -> str:
+    return f'follow_posts_cache:{user_id}'
+
+
+def feed_version_key(author_id: int) -> str:
+    return f'feed_version:{author_id}'
+
+
+def author_posts_changed(author_id: int) -> None:
+    """Отмечает, что у автора появился или пропал пост.
+
+    Ленты подписок читателей не сбрасываются по одной: у автора их
+    может быть миллион. Лента сверяет время своего расчёта с отметками
+    авторов, на которых подписан читатель (feed_changed). Отметка
+    живёт дольше любой ленты, посчитанной до неё.
+    """
+    cache.set(
+        feed_version_key(author_id), time.time(), FEED_CACHE_SEC + STALE_SEC
+    )
+
+
+def feed_changed(author_ids) -> float:
+    """Время последнего изменения постов авторов; одно чтение кеша."""
+    stamps = cache.get_many(
+        [feed_version_key(author_id) for author_id in author_ids]
+    )
+    return max(stamps.values(), default=0.0)
+
+
+def post_cache_key(post_id: int) -> str:
+    return f'post:{post_id}'
+
+
+class CachedIds(list):
+    """Первые MAX_CACHED_IDS id ленты; total — длина всей ленты."""
+
+    total = None
+
+
+class FeedIds:
+    """id ленты для Paginator: начало из кеша, дальше — из БД."""
+
+    def __init__(self, head: list, posts_list: QuerySet):
+        self.head = head
+        self.posts_list = posts_list
+
+    def __len__(self) -> int:
+        total = getattr(self.head, 'total', None)
+        return len(self.head) if total is None else total
+
+    def __getitem__(self, index: slice) -> list:
+        if index.stop is not None and index.stop <= len(self.head):
+            return self.head[index]
+        return list(self.posts_list.values_list('id', flat=True)[index])
+
+
+def load_ids(posts_list) -> CachedIds:
+    """Первые MAX_CACHED_IDS id ленты и её длина."""
+    ids = CachedIds(
+        posts_list.values_list('id', flat=True)[:MAX_CACHED_IDS]
+    )
+    ids.total = (
+        len(ids) if len(ids) < MAX_CACHED_IDS else posts_list.count()
+    )
+    return ids
+
+
+def feed_page(request: WSGIRequest, posts_list: QuerySet, cache_name: str,
+              cache_timer: int, changed: float = 0.0) -> Page:
+    """Страница ленты из кешированного списка id и кешированных постов."""
+    page_obj = pagination(request, FeedIds(
+        posts_cacher(posts_list, cache_name, cache_timer, changed),
+        posts_list,
+    ))
+    page_obj.object_list = hydrate_posts(page_obj.object_list)
+    attach_view_counts(page_obj.object_list)
+    return page_obj
+
+
+def hydrate_posts(post_ids: list) -> list:
+    """Посты по списку id: один get_many, промахи — одним запросом."""
+    cached = cache.get_many([post_cache_key(post_id) for post_id in post_ids])
+    posts = {}
+    missing = []
+    for post_id in post_ids:
+        data = cached.get(post_cache_key(post_id))
+        if data is None:
+            missing.append(post_id)
+        else:
+            posts[post_id] = decode_post(data)
+    metrics.inc('cache_requests_total', len(posts), cache='post', result='hit')
+    if missing:
+        metrics.inc(
+            'cache_requests_total', len(missing), cache='post', result='miss'
+        )
+        loaded = list(Post.objects.select_related('author', 'group').filter(
+            id__in=missing
+        ))
+        cache.set_many(
+            {post_cache_key(post.pk): encode_post(post) for post in loaded},
+            POST_CACHE_SEC,
+        )
+        posts.update((post.pk, post) for post in loaded)
+    # Удалённых постов в списке id уже нет в базе, их пропускаем
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
 # кеширование постов на странице
-def posts_cacher(posts_list, cache_name: str, cache_timer: int) -> QuerySet:
-    """Функция для кеширования списка постов"""
-    cached_posts_list = cache.get(cache_name)
-    if not cached_posts_list:
-        cached_posts_list = posts_list
-        cache.set(cache_name, cached_posts_list, cache_timer)
-    return cached_posts_list
+def posts_cacher(posts_list, cache_name: str, cache_timer: int,
+                 changed: float = 0.0) -> list:
+    """Функция для кеширования списка id постов ленты.
+
+    В кеш попадают только первые MAX_CACHED_IDS id (load_ids). Список,
+    посчитанный раньше момента changed, считается истёкшим.
+
+    Пересчитывает список только один воркер, взявший блокировку:
+    остальные отдают устаревшее значение, пока оно хранится ещё
+    STALE_SEC секунд, а при пустом кеше недолго ждут результата.
+    Незадолго до истечения срока значение с некоторой вероятностью
+    пересчитывается заранее (XFetch), тем чаще, чем дольше расчёт.
+    """
+    # Ленты групп и авторов различаются суффиксом, а в метриках
+    # считаются вместе
+    label = cache_name.partition(':')[0]
+    entry = cache.get(cache_name)
+    if entry is not None:
+        value, expires, delta = entry
+        if expires - cache_timer < changed:
+            expires = 0.0
+        if not should_refresh(expires, delta):
+            metrics.inc('cache_requests_total', cache=label, result='hit')
+            return value
+        if not acquire_lock(cache_name):
+            metrics.inc(
+                'cache_requests_total', cache=label, result='stale'
+            )
+            return value
+        result = 'early' if time.time() < expires else 'refresh'
+    elif acquire_lock(cache_name):
+        result = 'miss'
+    else:
+        entry = wait_for_value(cache_name)
+        if entry is not None:
+            metrics.inc(
+                'cache_requests_total', cache=label, result='wait'
+            )
+            return entry[0]
+        # Пересчитывающий воркер не успел: считаем сами, блокировку
+        # не трогаем
+        metrics.inc(
+            'cache_requests_total', cache=label, result='timeout'
+        )
+        return load_ids(posts_list)
+
+    metrics.inc('cache_requests_total', cache=label, result=result)
+    try:
+        # Срок отсчитывается от начала расчёта: изменение во время него
+        # должно сделать список устаревшим
+        computed = time.time()
+        start = time.perf_counter()
+        value = load_ids(posts_list)
+        delta = time.perf_counter() - start
+        cache.set(
+            cache_name,
+            (value, computed + cache_timer, delta),
+            cache_timer + STALE_SEC,
+        )
+    finally:
+        release_lock(cache_name)
+    return value
+
+
+def should_refresh(expires: float, delta: float) -> bool:
+    """Вероятностное досрочное истечение (XFetch)."""
+    # 1 - random() лежит в (0, 1], логарифм определён
+    early = delta * XFETCH_BETA * -math.log(1 - random.random())
+    return time.time() + early >= expires
+
+
+def acquire_lock(cache_name: str) -> bool:
+    return cache.add(f'{cache_name}:lock', 1, LOCK_SEC)
+
+
+def release_lock(cache_name: str) -> None:
+    # touch с нулевым сроком, а не delete: delete в LayeredCache
+    # сбрасывает L1 во всех воркерах
+    cache.touch(f'{cache_name}:lock', 0)
+
+
+def wait_for_value(cache_name: str):
+    deadline = time.monotonic() + LOCK_WAIT_SEC
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SEC)
+        entry = cache.get(cache_name)
+        if entry is not None:
+            return entry
+    return None
@@ -0,0 +1,366 @@
+"""Счётчики просмотров постов с отложенной записью.
+
+Просмотр только увеличивает счётчик в памяти воркера. Накопленное
+сбрасывается в PostViews одним пакетным upsert
+(INSERT ... ON CONFLICT DO UPDATE), когда с прошлого сброса прошло
+FLUSH_INTERVAL_SEC секунд или накопилось FLUSH_MAX_VIEWS просмотров,
+а также при штатной остановке процесса.
+
+Сброс запускается только очередным просмотром, отдельного таймера
+нет: простаивающий воркер держит несброшенное до следующего
+просмотра или до остановки. При падении воркера теряется всё
+несброшенное — у работающего воркера это примерно FLUSH_MAX_VIEWS
+просмотров или FLUSH_INTERVAL_SEC секунд, а после неудачных сбросов
+и больше. Если сброс не удался, счётчики возвращаются в очередь, а
+следующая попытка будет не раньше чем через FLUSH_RETRY_SEC: иначе
+каждый просмотр ждал бы снятия блокировки БД. Очередь не растёт
+больше MAX_PENDING_POSTS постов — сверх этого просмотры отбрасываются
+и учитываются в метрике. Просмотры постов, удалённых
+до сброса, тоже отбрасываются: удаление поста забывает их в своём
+воркере, а сброс пропускает посты и авторов, которых уже нет в БД.
+
+Чтение складывает сохранённое число (из кеша, промахи — одним
+запросом) с несброшенным в этом воркере.
+
+Вместе с числом просмотров копятся обновления регистров HyperLogLog
+уникальных зрителей поста и его автора (posts.hll). При сбросе они
+сливаются со скетчами в PostViews и AuthorViewers той же транзакцией.
+Тем же сбросом отложенные просмотры попадают в популярное
+(posts.trending).
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+
+from core import metrics
+
+from . import trending
+from .hll import HyperLogLog, merge_all, register_update
+from .models import AuthorViewers, Post, PostViews, User
+
+logger = logging.getLogger('yatube.views')
+
+FLUSH_INTERVAL_SEC = 10
+FLUSH_MAX_VIEWS = 1000
+FLUSH_RETRY_SEC = 30
+MAX_PENDING_POSTS = 100000
+FLUSH_BATCH_SIZE = 400
+VIEWS_CACHE_SEC = 60
+
+_lock = threading.Lock()
+_pending = Counter()
+_pending_views = 0
+# id поста или автора -> {номер регистра: ранг}
+_pending_post_viewers = defaultdict(dict)
+_pending_author_viewers = defaultdict(dict)
+_last_flush = time.monotonic()
+# Раньше этого момента после неудачного сброса не пробуем снова
+_retry_after = 0.0
+
+
+def views_cache_key(post_id: int) -> str:
+    return f'views:{post_id}'
+
+
+def viewer_id(request) -> str:
+    """Кто смотрит: пользователь, сессия или адрес с браузером."""
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    return 'addr:{}:{}'.format(
+        request.META.get('REMOTE_ADDR', ''),
+        request.META.get('HTTP_USER_AGENT', ''),
+    )
+
+
+def _add_registers(pending: dict, updates: dict) -> None:
+    for index, rank in updates.items():
+        if rank > pending.get(index, 0):
+            pending[index] = rank
+
+
+def count_view(post_id: int, viewer: str = None,
+               author_id: int = None) -> None:
+    """Учитывает просмотр; при необходимости сбрасывает накопленное."""
+    global _pending_views
+    update = dict([register_update(viewer)]) if viewer else None
+    with _lock:
+        if post_id in _pending or len(_pending) < MAX_PENDING_POSTS:
+            _pending[post_id] += 1
+            _pending_views += 1
+        else:
+            metrics.inc('post_views_total', result='dropped')
+            return
+        if update:
+            _add_registers(_pending_post_viewers[post_id], update)
+            if author_id is not None:
+                _add_registers(_pending_author_viewers[author_id], update)
+        now = time.monotonic()
+        due = now >= _retry_after and (
+            _pending_views >= FLUSH_MAX_VIEWS
+            or now - _last_flush >= FLUSH_INTERVAL_SEC
+        )
+    metrics.inc('post_views_total', result='counted')
+    if due:
+        flush()
+
+
+def _upsert_sql(rows: int) -> str:
+    quote = connection.ops.quote_name
+    table = quote(PostViews._meta.db_table)
+    post = quote(PostViews._meta.get_field('post').column)
+    views = quote('views')
+    viewers = quote('viewers')
+    # Значения по умолчанию Django знает только сам, в схеме их нет
+    values = ', '.join(['(%s, %s, %s)'] * rows)
+    return (
+        f'INSERT INTO {table} ({post}, {views}, {viewers}) VALUES {values} '
+        f'ON CONFLICT ({post}) '
+        f'DO UPDATE SET {views} = {table}.{views} + excluded.{views}'
+    )
+
+
+def _merge_sketches(model, key: str, pending: dict) -> None:
+    """Сливает регистры в скетчи строк model; строки уже есть."""
+    ids = sorted(pending)
+    for start in range(0, len(ids), FLUSH_BATCH_SIZE):
+        rows = model.objects.filter(
+            **{f'{key}__in': ids[start:start + FLUSH_BATCH_SIZE]}
+        ).values_list(key, 'viewers')
+        objects = []
+        for row_id, data in rows:
+            sketch = HyperLogLog(data)
+            for index, rank in pending[row_id].items():
+                sketch.update(index, rank)
+            objects.append(
+                model(**{key: row_id, 'viewers': sketch.to_bytes()})
+            )
+        model.objects.bulk_update(objects, ['viewers'])
+
+
+def _existing(model, ids) -> set:
+    ids = sorted(ids)
+    found = set()
+    for start in range(0, len(ids), FLUSH_BATCH_SIZE):
+        found.update(model.objects.filter(
+            id__in=ids[start:start + FLUSH_BATCH_SIZE]
+        ).values_list('id', flat=True))
+    return found
+
+
+def _write(counts: dict, post_viewers: dict, author_viewers: dict) -> dict:
+    """Пишет накопленное; возвращает записанные счётчики постов."""
+    with transaction.atomic():
+        # Пост или автор могли быть удалены, пока просмотры копились:
+        # их строки не пройдут проверку внешнего ключа, и пачка будет
+        # падать при каждом сбросе
+        posts = _existing(Post, counts)
+        authors = _existing(User, author_viewers)
+        counts = {
+            post_id: count for post_id, count in counts.items()
+            if post_id in posts
+        }
+        post_viewers = {
+            post_id: registers for post_id, registers in post_viewers.items()
+            if post_id in posts
+        }
+        author_viewers = {
+            author_id: registers
+            for author_id, registers in author_viewers.items()
+            if author_id in authors
+        }
+        items = sorted(counts.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), FLUSH_BATCH_SIZE):
+                batch = items[start:start + FLUSH_BATCH_SIZE]
+                cursor.execute(
+                    _upsert_sql(len(batch)),
+                    [value for post_id, count in batch
+                     for value in (post_id, count, b'')],
+                )
+        # Строки постов созданы upsert выше, строки авторов — здесь
+        AuthorViewers.objects.bulk_create(
+            [AuthorViewers(user_id=author_id) for author_id in author_viewers],
+            batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True,
+        )
+        # Слияние скетчей — чтение и запись. Сброс другого воркера между
+        # ними может потерять часть его регистров; повторные просмотры
+        # тех же зрителей их восстановят
+        _merge_sketches(PostViews, 'post_id', post_viewers)
+        _merge_sketches(AuthorViewers, 'user_id', author_viewers)
+    return counts
+
+
+def flush() -> int:
+    """Сбрасывает накопленные просмотры в БД; возвращает их число."""
+    global _pending, _pending_views, _last_flush, _retry_after
+    global _pending_post_viewers, _pending_author_viewers
+    with _lock:
+        counts, _pending = _pending, Counter()
+        total, _pending_views = _pending_views, 0
+        post_viewers, _pending_post_viewers = (
+            _pending_post_viewers, defaultdict(dict)
+        )
+        author_viewers, _pending_author_viewers = (
+            _pending_author_viewers, defaultdict(dict)
+        )
+        _last_flush = time.monotonic()
+    trending.flush()
+    if not counts:
+        return 0
+    try:
+        written = _write(counts, post_viewers, author_viewers)
+    except DatabaseError:
+        # Например, БД заблокирована: вернём в очередь до следующего раза
+        logger.exception('Не удалось сохранить просмотры')
+        _requeue(counts, post_viewers, author_viewers)
+        _retry_after = time.monotonic() + FLUSH_RETRY_SEC
+        metrics.inc('post_views_flushes_total', result='error')
+        return 0
+    _retry_after = 0.0
+    lost = total - sum(written.values())
+    if lost:
+        metrics.inc('post_views_total', lost, result='deleted')
+    total -= lost
+    # Сброшенное ушло из очереди, поэтому его прибавляем к кешированным
+    # суммам. incr, а не delete: delete в LayeredCache сбрасывает L1
+    # всех воркеров. Чтение из БД между upsert и incr посчитает сброс
+    # дважды, но лишь до истечения VIEWS_CACHE_SEC
+    for post_id, count in written.items():
+        try:
+            cache.incr(views_cache_key(post_id), count)
+        except ValueError:
+            # Нет в кеше: следующее чтение возьмёт сумму из БД
+            pass
+    metrics.inc('post_views_flushes_total', result='ok')
+    metrics.inc('post_views_flushed_total', total)
+    return total
+
+
+def _requeue(counts: dict, post_viewers: dict,
+             author_viewers: dict) -> None:
+    global _pending_views
+    with _lock:
+        dropped = 0
+        for post_id, count in counts.items():
+            if post_id in _pending or len(_pending) < MAX_PENDING_POSTS:
+                _pending[post_id] += count
+                _pending_views += count
+                _add_registers(
+                    _pending_post_viewers[post_id],
+                    post_viewers.get(post_id, {}),
+                )
+            else:
+                dropped += count
+        for author_id, updates in author_viewers.items():
+            _add_registers(_pending_author_viewers[author_id], updates)
+    if dropped:
+        metrics.inc('post_views_total', dropped, result='dropped')
+
+
+if not settings.TESTING:
+    # В тестах к выходу тестовой БД уже нет
+    atexit.register(flush)
+
+
+def view_counts(post_ids) -> dict:
+    """Просмотры постов: сохранённые плюс несброшенные в этом воркере."""
+    post_ids = list(post_ids)
+    keys = {views_cache_key(post_id): post_id for post_id in post_ids}
+    stored = {
+        keys[key]: value for key, value in cache.get_many(list(keys)).items()
+    }
+    missing = [post_id for post_id in post_ids if post_id not in stored]
+    if missing:
+        loaded = dict(PostViews.objects.filter(
+            post_id__in=missing
+        ).values_list('post_id', 'views'))
+        loaded = {post_id: loaded.get(post_id, 0) for post_id in missing}
+        cache.set_many(
+            {views_cache_key(post_id): value
+             for post_id, value in loaded.items()},
+            VIEWS_CACHE_SEC,
+        )
+        stored.update(loaded)
+    with _lock:
+        return {
+            post_id: stored[post_id] + _pending.get(post_id, 0)
+            for post_id in post_ids
+        }
+
+
+def attach_view_counts(posts) -> None:
+    """Проставляет постам атрибут views для шаблонов."""
+    counts = view_counts(post.pk for post in posts)
+    for post in posts:
+        post.views = counts[post.pk]
+
+
+def _sketch(model, key: str, row_id: int, pending: dict) -> HyperLogLog:
+    data = model.objects.filter(**{key: row_id}).values_list(
+        'viewers', flat=True
+    ).first()
+    sketch = HyperLogLog(data)
+    with _lock:
+        for index, rank in pending.get(row_id, {}).items():
+            sketch.update(index, rank)
+    return sketch
+
+
+def post_viewers(post_id: int) -> HyperLogLog:
+    """Скетч зрителей поста с несброшенными в этом воркере."""
+    return _sketch(PostViews, 'post_id', post_id, _pending_post_viewers)
+
+
+def author_viewers(author_id: int) -> HyperLogLog:
+    """Скетч зрителей всех постов автора."""
+    return _sketch(
+        AuthorViewers, 'user_id', author_id, _pending_author_viewers
+    )
+
+
+def group_viewers(group_id: int) -> HyperLogLog:
+    """Скетч зрителей группы — слияние скетчей её постов."""
+    sketch = merge_all(PostViews.objects.filter(
+        post__group_id=group_id
+    ).values_list('viewers', flat=True).iterator())
+    with _lock:
+        pending_ids = sorted(_pending_post_viewers)
+    # Из несброшенного берутся только посты этой группы
+    for start in range(0, len(pending_ids), FLUSH_BATCH_SIZE):
+        group_posts = list(Post.objects.filter(
+            group_id=group_id,
+            id__in=pending_ids[start:start + FLUSH_BATCH_SIZE],
+        ).values_list('id', flat=True))
+        with _lock:
+            for post_id in group_posts:
+                registers = _pending_post_viewers.get(post_id, {})
+                for index, rank in registers.items():
+                    sketch.update(index, rank)
+    return sketch
+
+
+def discard(post_id: int) -> None:
+    """Забывает несброшенные просмотры удалённого поста."""
+    global _pending_views
+    with _lock:
+        _pending_views -= _pending.pop(post_id, 0)
+        _pending_post_viewers.pop(post_id, None)
+
+
+def reset() -> None:
+    """Забывает несброшенные просмотры (используется в тестах)."""
+    global _pending_views, _retry_after
+    _retry_after = 0.0
+    with _lock:
+        _pending.clear()
+        _pending_views = 0
+        _pending_post_viewers.clear()
+        _pending_author_viewers.clear()
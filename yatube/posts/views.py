@@ -1,23 +1,30 @@
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from .follows import (follow, follow_stats, followers_page,
+                      following_ids, following_page, is_following,
+                      parse_cursor, unfollow)
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
-from .utils import pagination, posts_cacher
+from .heatmap import daily_counts, heatmap_weeks
+from .models import Group, Post, User
+from .similar import similar_posts
+from .suggestions import get_suggestions
+from .trending import SITE_SCOPE, group_scope, record_view, trending_ids
+from .utils import (FEED_CACHE_SEC, INDEX_CACHE_KEY, feed_changed,
+                    feed_page, follow_feed_key, group_feed_key,
+                    hydrate_posts, pagination, profile_feed_key)
+from .view_counts import (attach_view_counts, author_viewers, count_view,
+                          post_viewers, viewer_id)
 
 CACHE_SEC_FOR_POSTS = 20
 
 
 def index(request):
-    posts_list = Post.objects.select_related('group', 'author')
-    # Кеширование
-    index_posts_cache = posts_cacher(
-        posts_list,
-        'index_posts_cache',
-        CACHE_SEC_FOR_POSTS,
+    # Кеширование: новые посты появляются по истечении срока
+    page_obj = feed_page(
+        request, Post.objects.all(), INDEX_CACHE_KEY, CACHE_SEC_FOR_POSTS
     )
-
-    page_obj = pagination(request, index_posts_cache)
     context = {
         'page_obj': page_obj,
     }
@@ -27,9 +34,15 @@ def index(request):
 @login_required
 def follow_index(request):
     posts_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = pagination(request, posts_list)
+    # Новые и удалённые посты авторов видны по их отметкам времени
+    changed = feed_changed(following_ids(request.user.id))
+    page_obj = feed_page(
+        request, posts_list, follow_feed_key(request.user.id),
+        FEED_CACHE_SEC, changed,
+    )
     context = {
         'page_obj': page_obj,
+        'suggestions': get_suggestions(request.user.id),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -38,8 +51,7 @@ def follow_index(request):
 def profile_follow(request, username):
     # Подписаться на автора
     author = get_object_or_404(User, username=username)
-    if request.user != author:
-        Follow.objects.update_or_create(user=request.user, author=author)
+    follow(request.user.id, author.id)
     return redirect('posts:profile', author)
 
 
@@ -47,15 +59,15 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     # Дизлайк, отписка
     author = get_object_or_404(User, username=username)
-    follow = Follow.objects.filter(user=request.user, author=author)
-    follow.delete()
+    unfollow(request.user.id, author.id)
     return redirect('posts:profile', author)
 
 
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts_list = group.posts.select_related('group')
-    page_obj = pagination(request, posts_list)
+    page_obj = feed_page(
+        request, group.posts.all(), group_feed_key(group.id), FEED_CACHE_SEC
+    )
     context = {
         'page_obj': page_obj,
         'group': group,
@@ -65,36 +77,108 @@ def group_posts(request, slug):
 
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts_list = author.posts.select_related('author')
-    page_obj = pagination(request, posts_list)
+    page_obj = feed_page(
+        request, author.posts.all(), profile_feed_key(author.id),
+        FEED_CACHE_SEC,
+    )
     show_follow = True
     following = False
+    suggestions = []
+    if request.user.is_authenticated:
+        suggestions = get_suggestions(request.user.id)
     if request.user == author or request.user.is_anonymous:
         show_follow = False
     else:
-        following = Follow.objects.filter(
-            user=request.user,
-            author=author
-        ).exists()
+        following = is_following(request.user.id, author.id)
+    activity = daily_counts(author.id)
 
     context = {
         'page_obj': page_obj,
         'author': author,
         'following': following,
         'show_follow': show_follow,
+        'suggestions': suggestions,
+        'unique_viewers': author_viewers(author.id).count(),
+        'heatmap': heatmap_weeks(activity),
+        'heatmap_total': sum(activity),
     }
     return render(request, 'posts/profile.html', context)
 
 
+def follow_list(request, username, direction, as_json):
+    # Подписчики или подписки одной страницей по курсору ?after=
+    user = get_object_or_404(User, username=username)
+    cursor = parse_cursor(request.GET.get('after'))
+    if direction == 'followers':
+        people, next_cursor = followers_page(user.id, cursor)
+        count = follow_stats(user.id)[0]
+    else:
+        people, next_cursor = following_page(user.id, cursor)
+        count = follow_stats(user.id)[1]
+    if as_json:
+        return JsonResponse({
+            'count': count,
+            'next': next_cursor,
+            'results': [
+                {
+                    'id': person.id,
+                    'username': person.username,
+                    'full_name': person.get_full_name(),
+                }
+                for person in people
+            ],
+        })
+    context = {
+        'author': user,
+        'direction': direction,
+        'people': people,
+        'count': count,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'posts/follow_list.html', context)
+
+
+def followers(request, username, as_json=False):
+    return follow_list(request, username, 'followers', as_json)
+
+
+def following(request, username, as_json=False):
+    return follow_list(request, username, 'following', as_json)
+
+
+def trending(request, slug=None):
+    # Популярное: порядок из кеша, посты догружаются как в лентах
+    group = None
+    scope = SITE_SCOPE
+    if slug is not None:
+        group = get_object_or_404(Group, slug=slug)
+        scope = group_scope(group.id)
+    page_obj = pagination(request, trending_ids(scope))
+    page_obj.object_list = hydrate_posts(page_obj.object_list)
+    attach_view_counts(page_obj.object_list)
+    context = {
+        'page_obj': page_obj,
+        'group': group,
+    }
+    return render(request, 'posts/trending.html', context)
+
+
 def post_detail(request, post_id):
     # Здесь код запроса к модели и создание словаря контекста
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('group', 'author'), id=post_id
+    )
+    record_view(post)
+    count_view(post.pk, viewer_id(request), post.author_id)
+    attach_view_counts([post])
+    post.unique_viewers = post_viewers(post.pk).count()
     form = CommentForm()
-    comments = post.comments.select_related('post')
+    comments = post.comments.select_related('author')
     context = {
         'post': post,
         'comments': comments,
-        'form': form
+        'form': form,
+        'similar_posts': similar_posts(post.pk),
     }
     return render(request, 'posts/post_detail.html', context)
 
@@ -0,0 +1,38 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# Сохранение пользователя сбрасывает запись сигналом, но
+# QuerySet.update сигналов не шлёт: отключение пользователя или смена
+# пароля таким путём видны не позже чем через этот срок
+USER_CACHE_SEC = 10
+
+
+def user_cache_key(user_id) -> str:
+    return f'user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, который берёт пользователя сессии из кеша.
+
+    AuthenticationMiddleware загружает request.user на каждом запросе;
+    с этим бэкендом запрос к БД нужен только при промахе. Запись
+    сбрасывается при сохранении пользователя (в том числе при смене
+    пароля и входе) и при выходе.
+
+    Сброс должен дойти до всех воркеров, поэтому кешируется только в
+    общем кеше: с LocMemCache бэкенд каждый раз читает БД, как
+    ModelBackend.
+    """
+
+    def get_user(self, user_id):
+        if isinstance(caches['default'], LocMemCache):
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, USER_CACHE_SEC)
+        # Неактивного пользователя не пускаем, даже если он в кеше
+        return user if self.user_can_authenticate(user) else None
@@ -1,6 +1,74 @@
-def main():
-    pass
+import time
+from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
 
-if __name__ == '__main__':
-    main()
+from posts.models import Follow, Post
+
+from . import backends
+from .backends import user_cache_key
+
+User = get_user_model()
+
+
+class CachedAuthTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.author = User.objects.create_user(username='author')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Post.objects.create(text='Тестовый пост', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_warm_page_view_without_queries(self):
+        """Повторный просмотр ленты не обращается к БД ради авторизации"""
+        for url in (reverse('posts:index'), reverse('posts:follow_index')):
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(response.context['user'], self.user)
+
+    def test_user_dropped_from_cache_on_save(self):
+        self.client.get(reverse('posts:index'))
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        # Свой экземпляр, чтобы не менять общий для всех тестов self.user
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new-password')
+        user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        # Старая сессия после смены пароля недействительна
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_user_dropped_from_cache_on_logout(self):
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('users:logout'))
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_user_deactivated_without_signal_rejected(self):
+        """Отключение через update видно не позже срока записи"""
+        with patch.object(backends, 'USER_CACHE_SEC', 0.1):
+            self.client.get(reverse('posts:index'))
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            time.sleep(0.2)
+            response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_changed_without_signal_ends_session(self):
+        with patch.object(backends, 'USER_CACHE_SEC', 0.1):
+            self.client.get(reverse('posts:index'))
+            User.objects.filter(pk=self.user.pk).update(password='!')
+            time.sleep(0.2)
+            response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 302)
@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -25,6 +29,12 @@ SECRET_KEY = '4kb@jq!($qh4%52nqkek1&390tr^+frs!*gy^=gpwnp_#+-$^6'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+TESTING = 'test' in sys.argv or 'pytest' in sys.modules
+if TESTING:
+    # Тесты пишут файлы кеша и метрик сюда, а не рядом с запущенным сайтом
+    TEST_TMP_DIR = tempfile.mkdtemp(prefix='yatube-test-')
+    atexit.register(shutil.rmtree, TEST_TMP_DIR, True)
+
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
@@ -32,13 +42,17 @@ ALLOWED_HOSTS = [
     'testserver',
 ]
 
+INTERNAL_IPS = [
+    '127.0.0.1',
+]
+
 
 # Application definition
 
 INSTALLED_APPS = [
     'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
-    'core',
+    'core.apps.CoreConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -49,11 +63,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.db.QueryInstrumentationMiddleware',
+    'core.nplusone.NPlusOneMiddleware',
+    'core.template_timing.TemplateTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilingMiddleware',
+    'core.memory.MemoryProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -109,6 +129,14 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Пользователь сессии берётся из кеша, а не из БД на каждом запросе
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+
+# Сессия читается из кеша, а пишется и в кеш, и в БД. Вариант совсем
+# без БД — сессия в подписанной cookie:
+# SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -142,8 +170,87 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Общий для всех воркеров хоста кеш без внешних сервисов, перед ним
+# небольшой L1 в памяти каждого процесса. Кеш в памяти одного процесса
+# не годится: граф подписок, ленты и пользователи сбрасываются
+# сигналами, а сигнал видит только свой воркер
+SHARED_CACHE_PATH = '/var/tmp/yatube-cache'
+if TESTING:
+    SHARED_CACHE_PATH = os.path.join(TEST_TMP_DIR, 'cache')
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.layered.LayeredCache',
+        'LOCATION': 'layered',
+        'OPTIONS': {'L2': 'shared', 'L1_SIZE': 256, 'L1_TIMEOUT': 2},
+    },
+    'shared': {
+        'BACKEND': 'core.cache.shared.SharedMemoryCache',
+        'LOCATION': SHARED_CACHE_PATH,
+        'OPTIONS': {'SIZE': 64 * 1024 * 1024},
+    },
+}
+
+# Метрики: каждый воркер сбрасывает свой снимок в METRICS_DIR,
+# эндпоинт /metrics/ складывает снимки всех процессов
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 5
+# Токен сборщика метрик: запрос с заголовком «Authorization: Bearer
+# <токен>». Адресу клиента не доверяем — за прокси он у всех один.
+# Пустой токен — эндпоинт открыт только сотрудникам
+METRICS_TOKEN = ''
+
+# Журнал медленных запросов: порог в мс и каталог статистики по отпечаткам
+SLOW_QUERY_THRESHOLD = 100
+# Доля обычных запросов, у которых в статистику пишется место вызова:
+# для этого обходится стек. У медленных место ищется всегда
+QUERY_LOCATION_SAMPLE_RATE = 0.01
+QUERY_STATS_DIR = os.path.join(METRICS_DIR, 'queries')
+if TESTING:
+    METRICS_DIR = os.path.join(TEST_TMP_DIR, 'metrics')
+    QUERY_STATS_DIR = os.path.join(METRICS_DIR, 'queries')
+
+# Поиск N+1: сколько одинаковых запросов от ленивого обращения к связи
+# за один HTTP-запрос считать проблемой; в тестах проблема — ошибка
+NPLUSONE_DETECTION = DEBUG or TESTING
+NPLUSONE_THRESHOLD = 2
+NPLUSONE_RAISE = TESTING
+
+# Диагностика проекта (yatube.memory, yatube.db.slow, yatube.db.nplusone,
+# yatube.cache, yatube.views) пишется в консоль с уровня INFO. В тестах
+# — только ошибки: ожидаемые сообщения проверяет assertLogs
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{asctime} {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
+        },
+    },
+    'loggers': {
+        'yatube': {
+            'handlers': ['console'],
+            'level': 'ERROR' if TESTING else 'INFO',
+            'propagate': False,
+        },
+    },
 }
+
+# Время рендеринга шаблонов и тегов: заголовок Server-Timing и /metrics/
+TEMPLATE_TIMING = True
+
+# Выборочное профилирование: доля профилируемых запросов, период снятия
+# стека в секундах и каталог для профилей в формате collapsed stacks
+PROFILING_SAMPLE_RATE = 0
+PROFILING_INTERVAL = 0.005
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Диагностика памяти через tracemalloc: только для dev-сервера
+MEMORY_PROFILING = False
+MEMORY_PROFILING_TOP = 10